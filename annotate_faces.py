@@ -5,7 +5,8 @@ Facial landmark annotation tool
 This program expects either a single image as an argument, or a directory
 with many images, and a number n of images to be processed in that directory.
 In this last case, names are sorted, and images at positions 0, floor(N/n),
-floor(2N/n), ... floor((n - 1)N/n) are selected.
+floor(2N/n), ... floor((n - 1)N/n) are selected. A video (-v) is annotated frame by frame, with the
+landmarks of each frame carried over to the next by optical flow.
 
 Output is to stdout and follows a csv format:
   'image_fname,' +
@@ -21,19 +22,99 @@ Run without arguments for usage information.
 from __future__ import print_function
 from __future__ import division
 import os
+import sys
+import math
+import time
 import argparse
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 
-import cv2
+import numpy as np
 from matplotlib import pyplot as plt
 from matplotlib.widgets import Button
+from matplotlib.patches import Rectangle
+from matplotlib.collections import LineCollection
 import matplotlib.cbook
 
-warnings.filterwarnings('ignore', category=matplotlib.cbook.mplDeprecation)
+from image_loader import display_image, load_display_image, ImagePrefetcher, DisplayPyramid
+from annotation_io import format_header, format_row, image_key, TextAnnotationWriter, ResumeIndex, SkipList
+from annotation_store import SQLiteAnnotationStore
+from dataset_manifest import build_manifest
+from landmark_schemes import DEFAULT_SCHEME, available_schemes, load_scheme
+from latency_trace import Tracer
+from click_journal import ClickJournal, adopt_journals
+from work_queue import WorkQueue, WorkServer, WorkClient, RemoteOutput
+from output_shards import session_name, shard_path, list_shards, merge_shards, annotated_in_shards, ShardWriter
+from render_overlays import render_overlays
+from annotation_qa import RESIDUAL_THRESHOLD, find_suspects, write_report, format_findings
+from annotation_agreement import (compare_annotators, check_consensus_path, write_consensus, write_image_report,
+                                  write_landmark_report, write_annotator_report, format_nme)
+from shape_model import ShapeModel
+from thumbnail_cache import ThumbnailCache
+from contact_sheet import ContactSheet
+from spatial_index import GridIndex
+from annotation_arrays import load_annotations, latest_rows
+from video_frames import (RING_FRAMES, VideoFrames, frame_key, parse_frame_key, track_landmarks, label_points,
+                          pixel_labels)
 
+warnings.filterwarnings('ignore', category=matplotlib.MatplotlibDeprecationWarning)
 
-def enum(**enums):
-    return type('Enum', (), enums)
+
+# Pressing within this many screen pixels of a placed landmark grabs it for dragging
+GRAB_RADIUS = 8
+
+# A grabbed landmark only starts to move once the mouse is this many screen pixels away from the press; a
+# shorter slip is a click that places the current label
+DRAG_THRESHOLD = 4
+
+# The hit-testing grid has this many cells along the longer image side
+GRID_CELLS = 64
+
+# Full-resolution pixels across the loupe; they are magnified to fill its axes
+LOUPE_PIXELS = 32
+
+# Milliseconds between checks, on the GUI thread, whether a background full-resolution decode has finished
+FULL_DECODE_POLL_MS = 50
+
+# Suspects printed by --qa; the report has all of them
+QA_SHOWN = 10
+
+# Landmarks with the least agreement printed by --agree
+AGREE_SHOWN = 5
+
+# Keys that step through the frames of a video without saving, and how far
+FRAME_STEPS = {'left': -1, 'right': 1}
+
+# With the loupe, it takes the top of the right column and the landmark buttons the area below it
+LOUPE_RECT = [0.5, 0.6, 0.48, 0.32]
+LOUPE_BUTTON_AREA = dict(top=0.58, height=0.39)
+
+
+# Handlers and drawing stages recorded as spans with --profile
+TRACED_METHODS = ('on_click', 'on_release', 'on_mouse_move', 'on_key_press', 'button_event', 'on_view_changed',
+                  'redraw_annotations', 'blit_overlay', 'blit_loupe', 'blit_button', 'preannotate', 'init_subplots',
+                  'save_annotations')
+
+# curr_state is RECT_STATE while the bounding box is drawn, and otherwise the number of the landmark placed next
+RECT_STATE = 0
+
+
+def button_layout(count, left=0.5, top=0.88, width=0.48, height=0.69, max_pitch=0.07):
+    """
+    Returns [x, y, width, height] figure rectangles for count buttons, filled column by column from the top left.
+    The grid is chosen so that the buttons are as large as possible (up to max_pitch apart) within the area.
+    """
+    best = None
+    for columns in range(1, count + 1):
+        rows = -(-count // columns)
+        # The gap between buttons is a seventh of the pitch
+        pitch = min(max_pitch, width / (columns - 1 / 7), height / (rows - 1 / 7))
+        if best is None or pitch > best[0]:
+            best = (pitch, rows)
+
+    pitch, rows = best
+    size = pitch * 6 / 7
+    return [[left + (i // rows) * pitch, top - size - (i % rows) * pitch, size, size] for i in range(count)]
 
 
 class InteractiveViewer(object):
@@ -45,20 +126,72 @@ class InteractiveViewer(object):
 
     Functions:
     __init__: Requires input of img_path, which is the path to the images that you wish to generate
-    labels for. Also Initializes all variables to obvious starting values.
+    labels for. Also Initializes all variables to obvious starting values. scheme is the LandmarkScheme to
+    annotate (iBUG-68 by default); it decides the number of landmark buttons and the overlay contours. tracer
+    is the latency Tracer of --profile, and journal the ClickJournal that every label change is written to.
+    image is the image already decoded, as an RGB array or a DisplayPyramid; without it img_path is loaded.
+    loupe is the number of full-resolution pixels across the loupe next to the image (0: no loupe).
+
+    display_pyramid: Returns the DisplayPyramid to show for an image given to __init__ or set_image. Used by:
+    __init__ and set_image
+
+    instrument: If the tracer is enabled, wraps the methods in TRACED_METHODS so that every call is recorded as
+    a span. Image loading, full canvas draws and the event loop are recorded as well. Used by: __init__
+
+    restore_journal: Starts journaling the current image and puts back the labels the journal still holds for
+    it from an earlier, unfinished session. Used by: __init__ and set_image
+
+    journal_label: Appends the current value of one label (0 is the bounding box) to the journal. Used by:
+    place_label, on_release, button_event and preannotate.
+
+    finish_journal: Drops the journaled labels of the current image once it is saved or skipped. Used by:
+    save_annotations and run.
+
+    button_label: Returns the text of a button: the label number, with a "?" while it has no label.
+
+    redraw_annotations: Moves the bounding box, landmark and contour overlay artists to the current labels and
+    blits them over the cached image background for user's benefit. The image itself is never re-rendered. This
+    function is used by: preannotate and set_image.
+
+    update_rect: Moves the bounding box artist to coords_list[0]. Used by: button_event, place_label, on_release
+    and on_mouse_move, which then blit the overlay, so no event handler touches more than the one label it
+    changes.
+
+    update_landmark: Copies a single entry of coords_list into its row of the landmark scatter offsets and the
+    contour vertices that use it. Missing landmarks are stored as NaN and are not drawn. Used by: on_click,
+    button_event and redraw_annotations.
+
+    draw_overlay: Draws the bounding box, the contour polylines of the scheme and the landmark scatter.
+
+    on_draw: Is run after every full canvas draw (first show, resize, zoom/pan). Caches the rendered image
+    background and draws the animated overlay on top of it.
+
+    blit_overlay: Restores the cached background and blits only the overlay artists. Falls back to a full
+    draw if no background has been cached yet.
+
+    move_loupe: Centers the loupe on the full-resolution pixel under the mouse. Returns True if that pixel
+    changed. Used by: on_mouse_move
 
-    redraw_annotations: Clones the current input image and displays current landmarks/bounding box for
-    user's benefit. This function is used by: on_click, on_mouse_move, and button_event.
+    blit_loupe: Shows the loupe crop around its center, with the placed landmarks and the outline of the pixel a
+    click would label, and blits only the loupe axes. The crop is a slice of the finest pyramid level already
+    decoded (the full resolution once the annotator zoomed in), so it costs the same for any image size and
+    never waits for a decode. Used by: on_mouse_move and blit_overlay, so the loupe follows label changes.
+
+    blit_button: Blits a single button after its label changed, so label updates do not trigger a full redraw.
 
     update_button_labels: Updates the button label (in the UI). This function is only called when a button is
     clicked by the user. Currently, it resets the button name to default of "<BUTTON_LABEL>?". This function
     is used by: button_event and init_subplots.
 
     on_click: Is run when the user clicks their mouse. If the user's click is not within the display image
-    then the functions returns without doing anything. Otherwise the function sets the InteractiveViewer state
-    correctly and records the appropriate label based on current state.
-
-    If the current state is GET_RECT, then the user must place their mouse within the input image, click, and
+    then the functions returns without doing anything. If the click lands within GRAB_RADIUS screen pixels of
+    a placed landmark (found through the GridIndex), that landmark is grabbed: moving the mouse drags it and
+    only its rows of the overlay are updated. Otherwise (or if the mouse is released before it moved
+    DRAG_THRESHOLD screen pixels) the
+    function sets the InteractiveViewer state correctly and records the appropriate label based on current
+    state (place_label).
+
+    If the current state is RECT_STATE, then the user must place their mouse within the input image, click, and
     hold. Then the "on_mouse_move" and "on_release" functions will be used to record the label and advance the
     program to its next state.
 
@@ -67,50 +200,101 @@ class InteractiveViewer(object):
 
     Used by: this function is called when the user clicks their mouse.
 
-    on_release: Is run when the user releases their mouse button. If the current state is not GET_RECT
+    image_coords: Converts the data coordinates of a mouse event into the full-resolution pixel it falls on.
+    Used by: on_click, on_release and on_mouse_move.
+
+    on_view_changed: Is run when the image axes are zoomed, panned or resized. Shows the viewport at the
+    resolution the screen needs, cropped from the DisplayPyramid, on top of the downsampled overview. Once the
+    view is zoomed in, starts load_full.
+
+    load_full: Starts decoding the full resolution of a reduced JPEG decode on the viewer's decoding thread, so
+    the loupe and closer zooms get full-resolution pixels, and a backend timer that runs on_full_loaded. Used
+    by: on_view_changed
+
+    on_full_loaded: Runs on the GUI thread until the decode has finished. Then shows the viewport and the loupe
+    at full resolution, or reports a failed decode. Used by: load_full
+
+    on_release: Is run when the user releases their mouse button. Ends a landmark drag if one is in progress.
+    Otherwise, if the current state is not RECT_STATE
     or the mouse is outside of the input image, then this functions returns nothing. If the current state is
-    GET_RECT, then the function records the user defined bounding box, updates the label display, and
+    RECT_STATE, then the function records the user defined bounding box, updates the label display, and
     advances.
 
     Used by: this function is called when the user releases their mouse.
 
+    preannotate: Fits the mean shape of the ShapeModel to the bounding box and places every landmark that has
+    no label yet. Used by: on_release, once the bounding box is drawn (only with --preannotate).
+
+    place_landmarks: Sets every landmark that has no label yet to the given position (a list of (x, y) or None
+    per landmark) and continues with the first landmark still missing. Used by: preannotate and annotate_video,
+    which places the landmarks tracked from the previous frame.
+
     on_key_press: This function records the keys pressed and sets the key_pressed event flag to True. Currently,
     this function is used to check if the user pressed the q key. If they do then the program immediately exits
     without saving.
 
     Used by: this function is called when the user presses a key on their keyboard.
 
-    on_mouse_move: This function is called when the user moves their mouse. If the current state is not
-    GET_RECT then the functions returns nothing, immediately. Otherwise, the position of the mouse is recorded
+    on_close: Is run when the annotation window is closed. Treated like pressing q.
+
+    should_stop: Returns True once the current image is done, skipped or the user asked to quit. Used by:
+    on_key_press, button_event and run.
+
+    on_mouse_move: This function is called when the user moves their mouse. The loupe follows the mouse over
+    the image. While a landmark is dragged, it follows the mouse. Otherwise, if the current state is not
+    RECT_STATE then only the loupe is updated. Otherwise, the position of the mouse is recorded
     for the bounding box label and the label display is updated.
 
     Used by: this function is called when the user moves the mouse.
 
     connect:
 
-    button_event: Defines what should occur when a given button is clicked by the user.
+    button_event: Defines what should occur when a given button is clicked by the user. Landmark and Rect
+    buttons are looked up in button_index (button axes -> landmark number), so dispatch costs the same for any
+    number of landmarks.
 
     Used by: init_subplots
 
-    init_subplots: Creates the display window and buttons.
+    init_subplots: Creates the display window, the loupe and one button per landmark of the scheme, laid out by
+    button_layout.
 
     Used by: run
 
-    save_annotations: Write the labels to stdout and output file.
+    save_annotations: Write the labels to stdout and to the output (a TextAnnotationWriter for
+    landmark_output.txt, a SQLiteAnnotationStore or a RemoteOutput), and drops them from the journal once they
+    are in the output; a RemoteOutput does that when it has submitted them.
 
     Used by: run
 
-    run: Initializes the UI and runs the "connect" function. Then, continues looping pauses to allow the UI
-    to update labels and the label display. Also manages exiting the program or skipping some image.
+    set_image: Switches the viewer to another image and resets all labels. Once the window exists, it is kept:
+    only the image data, the button labels, the window title and the zoom history are replaced, so one
+    InteractiveViewer serves a whole directory. With keep_view, the zoom is kept if the new image has the same
+    size, as for the frames of a video. Used by: main
+
+    close: Closes the window and stops the decoding thread and its timers. Used by: main
+
+    run: Initializes the UI and runs the "connect" function on first use. Then blocks in the backend's event loop
+    (no polling, so an idle annotator costs no CPU) until Done, Skip, q or closing the window stops it. Also
+    manages exiting the program or skipping some image. The window stays open afterwards so that the next image
+    can reuse it.
     """
 
-    def __init__(self, img_path):
+    def __init__(self, img_path, image=None, output=None, shape_model=None, scheme=None, tracer=None, journal=None,
+                 loupe=LOUPE_PIXELS):
 
         self.img_path = img_path
+        self.tracer = Tracer() if tracer is None else tracer
+        self.tracer.set_image(img_path)
+        self.instrument()
+        self.scheme = load_scheme() if scheme is None else scheme
+        self.number_of_attributes = self.scheme.number_of_landmarks
+        self.output = output
+        self.shape_model = shape_model
+        self.journal = journal
         self.key_pressed = False
         self.key_event = None
 
-        self.coords_list = [None for i in range(69)]
+        self.coords_list = [None for i in range(self.number_of_attributes + 1)]
         self.coords_list[0] = [(0, 0), (0, 0)]
 
         # self.coords_1 = None
@@ -119,16 +303,49 @@ class InteractiveViewer(object):
         # self.coords_4 = None
         # self.coords_5 = None
 
-        self.image = cv2.imread(img_path)
-        self.image = cv2.cvtColor(self.image, cv2.COLOR_BGR2RGB)
-        self.clone = self.image.copy()
+        # Directory mode hands in images already decoded by the ImagePrefetcher
+        with self.tracer.span('load'):
+            self.pyramid = self.display_pyramid(img_path, image)
+
+        # Placed landmarks for hit-testing, and the landmark being dragged
+        self.landmark_index = GridIndex(max(self.pyramid.height, self.pyramid.width) / GRID_CELLS)
+        self.drag_index = None
+        self.drag_press_event = None
+        self.drag_origin = None
+        self.drag_moved = False
 
         self.fig = None
         self.im_ax = None
 
+        # Overlay artists are animated: they are left out of full canvas draws and blitted on top of the
+        # cached background, so a click never re-renders the image itself
+        self.im_artist = None
+        self.detail_artist = None
+        self.rect_artist = None
+        self.contour_artist = None
+        self.contour_vertices = None
+        self.landmark_artist = None
+        self.landmark_offsets = None
+        self.background = None
+
+        # The loupe is blitted the same way, from a background of its own
+        self.loupe = loupe
+        self.loupe_ax = None
+        self.loupe_artist = None
+        self.loupe_landmark_artist = None
+        self.loupe_pixel_artist = None
+        self.loupe_background = None
+        self.loupe_center = None
+        # Decodes the full resolution of a reduced JPEG decode once the annotator zooms in
+        self.full_decoder = ThreadPoolExecutor(max_workers=1)
+        # Running timers of load_full; the backends do not keep them alive
+        self.full_timers = set()
+
         # self.button_rect = None
 
-        self.button_list = [None for i in range(69)]
+        self.button_list = [None for i in range(self.number_of_attributes + 1)]
+        # Button axes -> landmark number (RECT_STATE for the bounding box button), for dispatching clicks
+        self.button_index = {}
 
         # self.button_1 = None
         # self.button_2 = None
@@ -143,1006 +360,605 @@ class InteractiveViewer(object):
 
         self.is_finished = False
         self.is_skipped = False
+        self.is_closed = False
+
+        self.curr_state = self.attr_state_counter
+        self.restore_journal()
+
+    @staticmethod
+    def display_pyramid(img_path, image):
+        # image is a DisplayPyramid from the prefetcher, a decoded array, or None to load img_path here
+        if image is None:
+            return load_display_image(img_path)
+        if isinstance(image, DisplayPyramid):
+            return image
+        return DisplayPyramid(image)
+
+    def instrument(self):
+        if not self.tracer.enabled:
+            return
+        # The wrapped bound methods shadow the class methods on this instance, so every caller, including the
+        # callbacks registered in connect and init_subplots, goes through them
+        for name in TRACED_METHODS:
+            setattr(self, name, self.tracer.wrap(name, getattr(self, name)))
 
-        self.States = enum(GET_RECT=0,
-                           GET_1=1,
-                           GET_2=2,
-                           GET_3=3,
-                           GET_4=4,
-                           GET_5=5,
-                           GET_6=6,
-                           GET_7=7,
-                           GET_8=8,
-                           GET_9=9,
-                           GET_10=10,
-                           GET_11=11,
-                           GET_12=12,
-                           GET_13=13,
-                           GET_14=14,
-                           GET_15=15,
-                           GET_16=16,
-                           GET_17=17,
-                           GET_18=18,
-                           GET_19=19,
-                           GET_20=20,
-                           GET_21=21,
-                           GET_22=22,
-                           GET_23=23,
-                           GET_24=24,
-                           GET_25=25,
-                           GET_26=26,
-                           GET_27=27,
-                           GET_28=28,
-                           GET_29=29,
-                           GET_30=30,
-                           GET_31=31,
-                           GET_32=32,
-                           GET_33=33,
-                           GET_34=34,
-                           GET_35=35,
-                           GET_36=36,
-                           GET_37=37,
-                           GET_38=38,
-                           GET_39=39,
-                           GET_40=40,
-                           GET_41=41,
-                           GET_42=42,
-                           GET_43=43,
-                           GET_44=44,
-                           GET_45=45,
-                           GET_46=46,
-                           GET_47=47,
-                           GET_48=48,
-                           GET_49=49,
-                           GET_50=50,
-                           GET_51=51,
-                           GET_52=52,
-                           GET_53=53,
-                           GET_54=54,
-                           GET_55=55,
-                           GET_56=56,
-                           GET_57=57,
-                           GET_58=58,
-                           GET_59=59,
-                           GET_60=60,
-                           GET_61=61,
-                           GET_62=62,
-                           GET_63=63,
-                           GET_64=64,
-                           GET_65=65,
-                           GET_66=66,
-                           GET_67=67,
-                           GET_68=68)
-
-        self.number_of_attributes = 68
-
-        self.curr_state = eval(f"self.States.GET_{self.attr_state_counter}")
+    def restore_journal(self):
+        if self.journal is None:
+            return
+
+        for index, coords in self.journal.begin(self.img_path).items():
+            self.coords_list[index] = coords
+        # Continue with the first landmark that has no label yet
+        missing = [i for i in range(1, self.number_of_attributes + 1) if self.coords_list[i] is None]
+        self.attr_state_counter = missing[0] if missing else 1
+        self.curr_state = self.attr_state_counter
+
+    def journal_label(self, index):
+        if self.journal is not None:
+            self.journal.record(index, self.coords_list[index])
+
+    def finish_journal(self):
+        if self.journal is not None:
+            self.journal.complete(self.img_path)
+
+    def button_label(self, index):
+        if index == RECT_STATE:
+            return 'Rect?' if self.coords_list[0] == [(0, 0), (0, 0)] else 'Rect'
+        return f"{index}?" if self.coords_list[index] is None else str(index)
 
     def redraw_annotations(self):
-        self.image = self.clone.copy()
+        self.update_rect()
+        for i in range(1, self.number_of_attributes + 1):
+            self.update_landmark(i)
+
+        self.blit_overlay()
 
+    def update_rect(self):
         if self.coords_list[0] is not None:
-            cv2.rectangle(self.image, self.coords_list[0][0], self.coords_list[0][1],
-                          (0, 255, 0), 5)
-        if self.coords_list[1] is not None:
-            cv2.circle(self.image, self.coords_list[1], 1, (255, 0, 0), -1)
-        if self.coords_list[2] is not None:
-            cv2.circle(self.image, self.coords_list[2], 1, (255, 0, 0), -1)
-        if self.coords_list[3] is not None:
-            cv2.circle(self.image, self.coords_list[3], 1, (255, 0, 0), -1)
-        if self.coords_list[4] is not None:
-            cv2.circle(self.image, self.coords_list[4], 1, (255, 0, 0), -1)
-        if self.coords_list[5] is not None:
-            cv2.circle(self.image, self.coords_list[5], 1, (255, 0, 0), -1)
-        if self.coords_list[6] is not None:
-            cv2.circle(self.image, self.coords_list[6], 1, (255, 0, 0), -1)
-        if self.coords_list[7] is not None:
-            cv2.circle(self.image, self.coords_list[7], 1, (255, 0, 0), -1)
-        if self.coords_list[8] is not None:
-            cv2.circle(self.image, self.coords_list[8], 1, (255, 0, 0), -1)
-        if self.coords_list[9] is not None:
-            cv2.circle(self.image, self.coords_list[9], 1, (255, 0, 0), -1)
-        if self.coords_list[10] is not None:
-            cv2.circle(self.image, self.coords_list[10], 1, (255, 0, 0), -1)
-        if self.coords_list[11] is not None:
-            cv2.circle(self.image, self.coords_list[11], 1, (255, 0, 0), -1)
-        if self.coords_list[12] is not None:
-            cv2.circle(self.image, self.coords_list[12], 1, (255, 0, 0), -1)
-        if self.coords_list[13] is not None:
-            cv2.circle(self.image, self.coords_list[13], 1, (255, 0, 0), -1)
-        if self.coords_list[14] is not None:
-            cv2.circle(self.image, self.coords_list[14], 1, (255, 0, 0), -1)
-        if self.coords_list[15] is not None:
-            cv2.circle(self.image, self.coords_list[15], 1, (255, 0, 0), -1)
-        if self.coords_list[16] is not None:
-            cv2.circle(self.image, self.coords_list[16], 1, (255, 0, 0), -1)
-        if self.coords_list[17] is not None:
-            cv2.circle(self.image, self.coords_list[17], 1, (255, 0, 0), -1)
-        if self.coords_list[18] is not None:
-            cv2.circle(self.image, self.coords_list[18], 1, (255, 0, 0), -1)
-        if self.coords_list[19] is not None:
-            cv2.circle(self.image, self.coords_list[19], 1, (255, 0, 0), -1)
-        if self.coords_list[20] is not None:
-            cv2.circle(self.image, self.coords_list[20], 1, (255, 0, 0), -1)
-        if self.coords_list[21] is not None:
-            cv2.circle(self.image, self.coords_list[21], 1, (255, 0, 0), -1)
-        if self.coords_list[22] is not None:
-            cv2.circle(self.image, self.coords_list[22], 1, (255, 0, 0), -1)
-        if self.coords_list[23] is not None:
-            cv2.circle(self.image, self.coords_list[23], 1, (255, 0, 0), -1)
-        if self.coords_list[24] is not None:
-            cv2.circle(self.image, self.coords_list[24], 1, (255, 0, 0), -1)
-        if self.coords_list[25] is not None:
-            cv2.circle(self.image, self.coords_list[25], 1, (255, 0, 0), -1)
-        if self.coords_list[26] is not None:
-            cv2.circle(self.image, self.coords_list[26], 1, (255, 0, 0), -1)
-        if self.coords_list[27] is not None:
-            cv2.circle(self.image, self.coords_list[27], 1, (255, 0, 0), -1)
-        if self.coords_list[28]is not None:
-            cv2.circle(self.image, self.coords_list[28], 1, (255, 0, 0), -1)
-        if self.coords_list[29] is not None:
-            cv2.circle(self.image, self.coords_list[29], 1, (255, 0, 0), -1)
-        if self.coords_list[30] is not None:
-            cv2.circle(self.image, self.coords_list[30], 1, (255, 0, 0), -1)
-        if self.coords_list[31] is not None:
-            cv2.circle(self.image, self.coords_list[31], 1, (255, 0, 0), -1)
-        if self.coords_list[32] is not None:
-            cv2.circle(self.image, self.coords_list[32], 1, (255, 0, 0), -1)
-        if self.coords_list[33] is not None:
-            cv2.circle(self.image, self.coords_list[33], 1, (255, 0, 0), -1)
-        if self.coords_list[34] is not None:
-            cv2.circle(self.image, self.coords_list[34], 1, (255, 0, 0), -1)
-        if self.coords_list[35] is not None:
-            cv2.circle(self.image, self.coords_list[35], 1, (255, 0, 0), -1)
-        if self.coords_list[36] is not None:
-            cv2.circle(self.image, self.coords_list[36], 1, (255, 0, 0), -1)
-        if self.coords_list[37] is not None:
-            cv2.circle(self.image, self.coords_list[37], 1, (255, 0, 0), -1)
-        if self.coords_list[38] is not None:
-            cv2.circle(self.image, self.coords_list[38], 1, (255, 0, 0), -1)
-        if self.coords_list[39] is not None:
-            cv2.circle(self.image, self.coords_list[39], 1, (255, 0, 0), -1)
-        if self.coords_list[40] is not None:
-            cv2.circle(self.image, self.coords_list[40], 1, (255, 0, 0), -1)
-        if self.coords_list[41] is not None:
-            cv2.circle(self.image, self.coords_list[41], 1, (255, 0, 0), -1)
-        if self.coords_list[42] is not None:
-            cv2.circle(self.image, self.coords_list[42], 1, (255, 0, 0), -1)
-        if self.coords_list[43] is not None:
-            cv2.circle(self.image, self.coords_list[43], 1, (255, 0, 0), -1)
-        if self.coords_list[44] is not None:
-            cv2.circle(self.image, self.coords_list[44], 1, (255, 0, 0), -1)
-        if self.coords_list[45] is not None:
-            cv2.circle(self.image, self.coords_list[45], 1, (255, 0, 0), -1)
-        if self.coords_list[46] is not None:
-            cv2.circle(self.image, self.coords_list[46], 1, (255, 0, 0), -1)
-        if self.coords_list[47] is not None:
-            cv2.circle(self.image, self.coords_list[47], 1, (255, 0, 0), -1)
-        if self.coords_list[48] is not None:
-            cv2.circle(self.image, self.coords_list[48], 1, (255, 0, 0), -1)
-        if self.coords_list[49] is not None:
-            cv2.circle(self.image, self.coords_list[49], 1, (255, 0, 0), -1)
-        if self.coords_list[50] is not None:
-            cv2.circle(self.image, self.coords_list[50], 1, (255, 0, 0), -1)
-        if self.coords_list[51] is not None:
-            cv2.circle(self.image, self.coords_list[51], 1, (255, 0, 0), -1)
-        if self.coords_list[52] is not None:
-            cv2.circle(self.image, self.coords_list[52], 1, (255, 0, 0), -1)
-        if self.coords_list[53] is not None:
-            cv2.circle(self.image, self.coords_list[53], 1, (255, 0, 0), -1)
-        if self.coords_list[54] is not None:
-            cv2.circle(self.image, self.coords_list[54], 1, (255, 0, 0), -1)
-        if self.coords_list[55] is not None:
-            cv2.circle(self.image, self.coords_list[55], 1, (255, 0, 0), -1)
-        if self.coords_list[56] is not None:
-            cv2.circle(self.image, self.coords_list[56], 1, (255, 0, 0), -1)
-        if self.coords_list[57] is not None:
-            cv2.circle(self.image, self.coords_list[57], 1, (255, 0, 0), -1)
-        if self.coords_list[58] is not None:
-            cv2.circle(self.image, self.coords_list[58], 1, (255, 0, 0), -1)
-        if self.coords_list[59] is not None:
-            cv2.circle(self.image, self.coords_list[59], 1, (255, 0, 0), -1)
-        if self.coords_list[60] is not None:
-            cv2.circle(self.image, self.coords_list[60], 1, (255, 0, 0), -1)
-        if self.coords_list[61] is not None:
-            cv2.circle(self.image, self.coords_list[61], 1, (255, 0, 0), -1)
-        if self.coords_list[62] is not None:
-            cv2.circle(self.image, self.coords_list[62], 1, (255, 0, 0), -1)
-        if self.coords_list[63] is not None:
-            cv2.circle(self.image, self.coords_list[63], 1, (255, 0, 0), -1)
-        if self.coords_list[64] is not None:
-            cv2.circle(self.image, self.coords_list[64], 1, (255, 0, 0), -1)
-        if self.coords_list[65] is not None:
-            cv2.circle(self.image, self.coords_list[65], 1, (255, 0, 0), -1)
-        if self.coords_list[66] is not None:
-            cv2.circle(self.image, self.coords_list[66], 1, (255, 0, 0), -1)
-        if self.coords_list[67] is not None:
-            cv2.circle(self.image, self.coords_list[67], 1, (255, 0, 0), -1)
-        if self.coords_list[68] is not None:
-            cv2.circle(self.image, self.coords_list[68], 1, (255, 0, 0), -1)
-
-        self.im_ax.imshow(self.image)
+            (x0, y0), (x1, y1) = self.coords_list[0]
+            self.rect_artist.set_bounds(min(x0, x1), min(y0, y1), abs(x1 - x0), abs(y1 - y0))
+            self.rect_artist.set_visible(True)
+        else:
+            self.rect_artist.set_visible(False)
+
+    def update_landmark(self, index):
+        coords = self.coords_list[index]
+        xy = (np.nan, np.nan) if coords is None else coords
+
+        # Offsets and contour vertices are updated in place, so moving one point only touches its own rows
+        self.landmark_offsets[index - 1] = xy
+        for path, vertex in self.contour_vertices[index]:
+            path.vertices[vertex] = xy
+        self.landmark_index.update(index, coords)
+
+    def draw_overlay(self):
+        self.im_ax.draw_artist(self.rect_artist)
+        self.im_ax.draw_artist(self.contour_artist)
+        self.im_ax.draw_artist(self.landmark_artist)
+
+    def draw_loupe(self):
+        if self.loupe_center is None:
+            return
+        self.loupe_ax.draw_artist(self.loupe_artist)
+        self.loupe_ax.draw_artist(self.loupe_landmark_artist)
+        self.loupe_ax.draw_artist(self.loupe_pixel_artist)
+
+    def on_draw(self, event):
+        # Animated artists are rendered into saved figures, so such a draw is no clean background
+        if self.fig.canvas.is_saving():
+            return
+
+        self.background = self.fig.canvas.copy_from_bbox(self.im_ax.bbox)
+        self.draw_overlay()
+        if self.loupe_ax is not None:
+            self.loupe_background = self.fig.canvas.copy_from_bbox(self.loupe_ax.bbox)
+            self.draw_loupe()
+
+    def blit_overlay(self):
+        if self.background is None:
+            self.fig.canvas.draw_idle()
+            return
+
+        self.fig.canvas.restore_region(self.background)
+        self.draw_overlay()
+        self.fig.canvas.blit(self.im_ax.bbox)
+        self.blit_loupe()
+
+    def move_loupe(self, event):
+        if self.loupe_ax is None or event.inaxes != self.im_ax:
+            return False
+
+        center = self.image_coords(event)
+        if center == self.loupe_center:
+            return False
+        self.loupe_center = center
+        return True
+
+    def blit_loupe(self):
+        if self.loupe_background is None or self.loupe_center is None:
+            return
+
+        x, y = self.loupe_center
+        x0, x1, y0, y1 = x - self.loupe / 2, x + self.loupe / 2, y - self.loupe / 2, y + self.loupe / 2
+        stale = self.fig.stale
+        self.loupe_ax.set_xlim(x0, x1)
+        self.loupe_ax.set_ylim(y1, y0)
+        region = self.pyramid.region(self.pyramid.finest(), x0, x1, y0, y1)
+        if region is not None:
+            crop, extent = region
+            self.loupe_artist.set_data(crop)
+            self.loupe_artist.set_extent(extent)
+        self.loupe_artist.set_visible(region is not None)
+        self.loupe_landmark_artist.set_offsets(self.landmark_offsets)
+        self.loupe_pixel_artist.set_data([x - 0.5, x + 0.5, x + 0.5, x - 0.5, x - 0.5],
+                                         [y - 0.5, y - 0.5, y + 0.5, y + 0.5, y - 0.5])
+
+        self.fig.canvas.restore_region(self.loupe_background)
+        self.draw_loupe()
+        self.fig.canvas.blit(self.loupe_ax.bbox)
+        # Moving the loupe's limits is already on screen; don't leave the figure marked for a full redraw
+        self.fig.stale = stale
+
+    def blit_button(self, button):
+        if self.background is None:
+            return
+
+        button.ax.draw_artist(button.ax)
+        self.fig.canvas.blit(button.ax.bbox)
+        # The label is already on screen; don't leave the figure marked for a full redraw
+        self.fig.stale = False
 
     def update_button_labels(self):
-        if self.curr_state == self.States.GET_RECT:
+        if self.curr_state == RECT_STATE:
             self.button_list[0].label.set_text('Rect?')
+            self.blit_button(self.button_list[0])
         else:
-            eval(f"self.button_list[{self.attr_state_counter}].label.set_text('{self.attr_state_counter}?')")
+            self.button_list[self.attr_state_counter].label.set_text(f"{self.attr_state_counter}?")
+            self.blit_button(self.button_list[self.attr_state_counter])
 
     def on_click(self, event):
         if event.inaxes != self.im_ax:
             return
 
-        if self.curr_state == self.States.GET_RECT:
-            self.coords_list[0][0] = (int(event.xdata), int(event.ydata))
+        toolbar = self.fig.canvas.toolbar
+        if self.curr_state != RECT_STATE and not (toolbar is not None and toolbar.mode):
+            # Pressing near a placed landmark grabs it. If the mouse is released without moving, the press
+            # still counts as a normal click, so placing points close to each other keeps working.
+            hit = self.landmark_index.nearest(event.xdata, event.ydata, self.grab_radius())
+            if hit is not None:
+                self.drag_index = hit
+                self.drag_press_event = event
+                self.drag_origin = self.coords_list[hit]
+                self.drag_moved = False
+                return
+
+        self.place_label(event)
+
+    def place_label(self, event):
+        if self.curr_state == RECT_STATE:
+            self.coords_list[0][0] = self.image_coords(event)
         else:
-            self.curr_state = eval(f"self.States.GET_{self.attr_state_counter}")
-            exec(f"self.coords_list[{self.attr_state_counter}] = (int(event.xdata), int(event.ydata))")
-            eval(f"self.button_list[{self.attr_state_counter}].label.set_text(str(self.attr_state_counter))")
+            self.curr_state = self.attr_state_counter
+            self.coords_list[self.attr_state_counter] = self.image_coords(event)
+            self.button_list[self.attr_state_counter].label.set_text(str(self.attr_state_counter))
+            self.blit_button(self.button_list[self.attr_state_counter])
+            self.update_landmark(self.attr_state_counter)
+            self.journal_label(self.attr_state_counter)
             if self.attr_state_counter < self.number_of_attributes:
                 self.attr_state_counter = self.attr_state_counter + 1
             else:
                 self.attr_state_counter = 1
+            self.blit_overlay()
+            return
 
-        self.redraw_annotations()
+        self.update_rect()
+        self.blit_overlay()
+
+    def grab_radius(self):
+        # GRAB_RADIUS screen pixels, in image pixels at the current zoom
+        x0, x1 = self.im_ax.get_xlim()
+        return GRAB_RADIUS * abs(x1 - x0) / max(self.im_ax.bbox.width, 1)
+
+    def image_coords(self, event):
+        # Both display artists are placed in full-resolution pixel coordinates, so the data coordinates of the
+        # event already refer to the full-resolution image; pixel i covers [i - 0.5, i + 0.5)
+        height, width = self.pyramid.height, self.pyramid.width
+        x = min(max(int(math.floor(event.xdata + 0.5)), 0), width - 1)
+        y = min(max(int(math.floor(event.ydata + 0.5)), 0), height - 1)
+        return x, y
+
+    def on_view_changed(self, ax):
+        x0, x1 = self.im_ax.get_xlim()
+        y0, y1 = self.im_ax.get_ylim()
+        if abs(x1 - x0) < self.pyramid.width or abs(y1 - y0) < self.pyramid.height:
+            # Zoomed in: decode the full resolution of a reduced JPEG decode for the loupe and closer zooms
+            self.load_full()
+        # Never waits for that decode; until it lands, the reduced decode is shown
+        viewport = self.pyramid.viewport(x0, x1, y0, y1, self.im_ax.bbox.width, self.im_ax.bbox.height)
+
+        if viewport is None:
+            self.detail_artist.set_visible(False)
+            return
+
+        crop, extent = viewport
+        self.detail_artist.set_data(crop)
+        self.detail_artist.set_extent(extent)
+        self.detail_artist.set_visible(True)
+
+    def load_full(self):
+        future = self.pyramid.load_full_in_background(self.full_decoder)
+        if future is None:
+            return
+        # Matplotlib may only be touched from the GUI thread, so a backend timer there checks on the decode
+        timer = self.fig.canvas.new_timer(interval=FULL_DECODE_POLL_MS)
+        timer.add_callback(self.on_full_loaded, self.img_path, self.pyramid, future, timer)
+        self.full_timers.add(timer)
+        timer.start()
+
+    def on_full_loaded(self, img_path, pyramid, future, timer):
+        if not future.done():
+            return
+        timer.stop()
+        self.full_timers.discard(timer)
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            # The pyramid keeps showing the reduced decode
+            print(f"could not decode the full resolution of {img_path}: {future.exception()}", file=sys.stderr)
+            return
+        if self.fig is None or pyramid is not self.pyramid:
+            # Moved on to another image
+            return
+        self.on_view_changed(self.im_ax)
+        # The detail image is part of the cached background; the loupe is redrawn from the finer level with it
+        self.fig.canvas.draw_idle()
 
     def on_release(self, event):
-        if event.inaxes != self.im_ax:
+        if self.drag_index is not None:
+            if not self.drag_moved:
+                # A click next to the landmark, not a drag: it stays where it was
+                self.coords_list[self.drag_index] = self.drag_origin
+                self.place_label(self.drag_press_event)
+            else:
+                self.journal_label(self.drag_index)
+            self.drag_index = None
+            self.drag_press_event = None
+            self.drag_origin = None
             return
 
-        if self.curr_state == self.States.GET_RECT:
-            self.coords_list[0][1] = (int(event.xdata), int(event.ydata))
+        if event.inaxes != self.im_ax:
+            return
 
-            cv2.rectangle(self.image, self.coords_list[0][0],
-                          self.coords_list[0][1],
-                          (0, 255, 0), 5)
+        if self.curr_state == RECT_STATE:
+            self.coords_list[0][1] = self.image_coords(event)
 
             self.button_list[0].label.set_text('Rect')
-
-            self.im_ax.imshow(self.image)
+            self.blit_button(self.button_list[0])
+            self.update_rect()
+            self.blit_overlay()
+            self.journal_label(0)
 
             self.attr_state_counter = 1
-            self.curr_state = eval(f"self.States.GET_{self.attr_state_counter}")
+            self.curr_state = self.attr_state_counter
+
+            if self.shape_model is not None:
+                self.preannotate()
+
+    def preannotate(self):
+        fitted = self.shape_model.fit_to_box(self.coords_list[0])
+        if fitted is None:
+            return
+
+        height, width = self.pyramid.height, self.pyramid.width
+        fitted = np.clip(np.rint(fitted), 0, [width - 1, height - 1]).astype(int)
+        self.place_landmarks([(x, y) for x, y in fitted.tolist()])
+
+    def place_landmarks(self, coords):
+        for i in range(1, self.number_of_attributes + 1):
+            # Landmarks the annotator already placed are kept
+            if self.coords_list[i] is None and coords[i - 1] is not None:
+                self.coords_list[i] = coords[i - 1]
+                self.journal_label(i)
+        missing = [i for i in range(1, self.number_of_attributes + 1) if self.coords_list[i] is None]
+        self.attr_state_counter = missing[0] if missing else 1
+        self.curr_state = self.attr_state_counter
+
+        # Before the window exists, init_subplots shows the labels
+        if self.fig is None:
+            return
+        for i in range(1, self.number_of_attributes + 1):
+            self.button_list[i].label.set_text(self.button_label(i))
+        self.redraw_annotations()
+        self.fig.canvas.draw_idle()
 
     def on_key_press(self, event):
         self.key_event = event
         self.key_pressed = True
 
+        if self.should_stop():
+            self.fig.canvas.stop_event_loop()
+
+    def on_close(self, event):
+        self.is_closed = True
+        event.canvas.stop_event_loop()
+
+    def should_stop(self):
+        return (self.is_finished
+                or self.is_skipped
+                or self.is_closed
+                or (self.key_pressed and self.key_event.key == 'q'))
+
     def on_mouse_move(self, event):
-        if self.curr_state != self.States.GET_RECT or event.inaxes != self.im_ax:
+        loupe_moved = self.move_loupe(event)
+
+        if self.drag_index is not None:
+            press = self.drag_press_event
+            if not self.drag_moved and math.hypot(event.x - press.x, event.y - press.y) < DRAG_THRESHOLD:
+                # Still a click
+                if loupe_moved:
+                    self.blit_loupe()
+                return
+            if event.inaxes == self.im_ax:
+                # Only the dragged landmark's rows change
+                self.drag_moved = True
+                self.coords_list[self.drag_index] = self.image_coords(event)
+                self.update_landmark(self.drag_index)
+                self.blit_overlay()
+                return
+        elif self.curr_state == RECT_STATE and event.inaxes == self.im_ax:
+            self.coords_list[0][1] = self.image_coords(event)
+            self.update_rect()
+            self.blit_overlay()
             return
-        else:
-            self.coords_list[0][1] = (int(event.xdata), int(event.ydata))
-            self.redraw_annotations()
+
+        if loupe_moved:
+            self.blit_loupe()
 
     def connect(self):
         self.fig.canvas.mpl_connect('button_press_event', self.on_click)
         self.fig.canvas.mpl_connect('button_release_event', self.on_release)
         self.fig.canvas.mpl_connect('key_press_event', self.on_key_press)
         self.fig.canvas.mpl_connect('motion_notify_event', self.on_mouse_move)
+        self.fig.canvas.mpl_connect('draw_event', self.on_draw)
+        self.fig.canvas.mpl_connect('close_event', self.on_close)
 
     def button_event(self, event):
         self.key_pressed = False
 
-        if event.inaxes == self.button_list[1].ax:
-            self.coords_list[1] = None
-            self.attr_state_counter = 1
-            self.curr_state = self.States.GET_1
-
-        elif event.inaxes == self.button_list[2].ax:
-            self.coords_list[2] = None
-            self.attr_state_counter = 2
-            self.curr_state = self.States.GET_2
-
-        elif event.inaxes == self.button_list[3].ax:
-            self.coords_list[3] = None
-            self.attr_state_counter = 3
-            self.curr_state = self.States.GET_3
-
-        elif event.inaxes == self.button_list[4].ax:
-            self.coords_list[4] = None
-            self.attr_state_counter = 4
-            self.curr_state = self.States.GET_4
-
-        elif event.inaxes == self.button_list[5].ax:
-            self.coords_list[5] = None
-            self.attr_state_counter = 5
-            self.curr_state = self.States.GET_5
-
-        elif event.inaxes == self.button_list[6].ax:
-            self.coords_list[6] = None
-            self.attr_state_counter = 6
-            self.curr_state = self.States.GET_6
-
-        elif event.inaxes == self.button_list[7].ax:
-            self.coords_list[7] = None
-            self.attr_state_counter = 7
-            self.curr_state = self.States.GET_7
-
-        elif event.inaxes == self.button_list[8].ax:
-            self.coords_list[8] = None
-            self.attr_state_counter = 8
-            self.curr_state = self.States.GET_8
-
-        elif event.inaxes == self.button_list[9].ax:
-            self.coords_list[9] = None
-            self.attr_state_counter = 9
-            self.curr_state = self.States.GET_9
-
-        elif event.inaxes == self.button_list[10].ax:
-            self.coords_list[10] = None
-            self.attr_state_counter = 10
-            self.curr_state = self.States.GET_10
-
-        elif event.inaxes == self.button_list[11].ax:
-            self.coords_list[11] = None
-            self.attr_state_counter = 11
-            self.curr_state = self.States.GET_11
-
-        elif event.inaxes == self.button_list[12].ax:
-            self.coords_list[12] = None
-            self.attr_state_counter = 12
-            self.curr_state = self.States.GET_12
-
-        elif event.inaxes == self.button_list[13].ax:
-            self.coords_list[13] = None
-            self.attr_state_counter = 13
-            self.curr_state = self.States.GET_13
-
-        elif event.inaxes == self.button_list[14].ax:
-            self.coords_list[14] = None
-            self.attr_state_counter = 14
-            self.curr_state = self.States.GET_14
-
-        elif event.inaxes == self.button_list[15].ax:
-            self.coords_list[15] = None
-            self.attr_state_counter = 15
-            self.curr_state = self.States.GET_15
-
-        elif event.inaxes == self.button_list[16].ax:
-            self.coords_list[16] = None
-            self.attr_state_counter = 16
-            self.curr_state = self.States.GET_16
-
-        elif event.inaxes == self.button_list[17].ax:
-            self.coords_list[17] = None
-            self.attr_state_counter = 17
-            self.curr_state = self.States.GET_17
-
-        elif event.inaxes == self.button_list[18].ax:
-            self.coords_list[18] = None
-            self.attr_state_counter = 18
-            self.curr_state = self.States.GET_18
-
-        elif event.inaxes == self.button_list[19].ax:
-            self.coords_list[19] = None
-            self.attr_state_counter = 19
-            self.curr_state = self.States.GET_19
-
-        elif event.inaxes == self.button_list[20].ax:
-            self.coords_list[20] = None
-            self.attr_state_counter = 20
-            self.curr_state = self.States.GET_20
-
-        elif event.inaxes == self.button_list[21].ax:
-            self.coords_list[21] = None
-            self.attr_state_counter = 21
-            self.curr_state = self.States.GET_21
-
-        elif event.inaxes == self.button_list[22].ax:
-            self.coords_list[22] = None
-            self.attr_state_counter = 22
-            self.curr_state = self.States.GET_22
-
-        elif event.inaxes == self.button_list[23].ax:
-            self.coords_list[23] = None
-            self.attr_state_counter = 23
-            self.curr_state = self.States.GET_23
-
-        elif event.inaxes == self.button_list[24].ax:
-            self.coords_list[24] = None
-            self.attr_state_counter = 24
-            self.curr_state = self.States.GET_24
-
-        elif event.inaxes == self.button_list[25].ax:
-            self.coords_list[25] = None
-            self.attr_state_counter = 25
-            self.curr_state = self.States.GET_25
-
-        elif event.inaxes == self.button_list[26].ax:
-            self.coords_list[26] = None
-            self.attr_state_counter = 26
-            self.curr_state = self.States.GET_26
-
-        elif event.inaxes == self.button_list[27].ax:
-            self.coords_list[27] = None
-            self.attr_state_counter = 27
-            self.curr_state = self.States.GET_27
-
-        elif event.inaxes == self.button_list[28].ax:
-            self.coords_list[28] = None
-            self.attr_state_counter = 28
-            self.curr_state = self.States.GET_28
-
-        elif event.inaxes == self.button_list[29].ax:
-            self.coords_list[29] = None
-            self.attr_state_counter = 29
-            self.curr_state = self.States.GET_29
-
-        elif event.inaxes == self.button_list[30].ax:
-            self.coords_list[30] = None
-            self.attr_state_counter = 30
-            self.curr_state = self.States.GET_30
-
-        elif event.inaxes == self.button_list[31].ax:
-            self.coords_list[31] = None
-            self.attr_state_counter = 31
-            self.curr_state = self.States.GET_31
-
-        elif event.inaxes == self.button_list[32].ax:
-            self.coords_list[32] = None
-            self.attr_state_counter = 32
-            self.curr_state = self.States.GET_32
-
-        elif event.inaxes == self.button_list[33].ax:
-            self.coords_list[33] = None
-            self.attr_state_counter = 33
-            self.curr_state = self.States.GET_33
-
-        elif event.inaxes == self.button_list[34].ax:
-            self.coords_list[34] = None
-            self.attr_state_counter = 34
-            self.curr_state = self.States.GET_34
-
-        elif event.inaxes == self.button_list[35].ax:
-            self.coords_list[35] = None
-            self.attr_state_counter = 35
-            self.curr_state = self.States.GET_35
-
-        elif event.inaxes == self.button_list[36].ax:
-            self.coords_list[36] = None
-            self.attr_state_counter = 36
-            self.curr_state = self.States.GET_36
-
-        elif event.inaxes == self.button_list[37].ax:
-            self.coords_list[37] = None
-            self.attr_state_counter = 37
-            self.curr_state = self.States.GET_37
-
-        elif event.inaxes == self.button_list[38].ax:
-            self.coords_list[38] = None
-            self.attr_state_counter = 38
-            self.curr_state = self.States.GET_38
-
-        elif event.inaxes == self.button_list[39].ax:
-            self.coords_list[39] = None
-            self.attr_state_counter = 39
-            self.curr_state = self.States.GET_39
-
-        elif event.inaxes == self.button_list[40].ax:
-            self.coords_list[40] = None
-            self.attr_state_counter = 40
-            self.curr_state = self.States.GET_40
-
-        elif event.inaxes == self.button_list[41].ax:
-            self.coords_list[41] = None
-            self.attr_state_counter = 41
-            self.curr_state = self.States.GET_41
-
-        elif event.inaxes == self.button_list[42].ax:
-            self.coords_list[42] = None
-            self.attr_state_counter = 42
-            self.curr_state = self.States.GET_42
-
-        elif event.inaxes == self.button_list[43].ax:
-            self.coords_list[43] = None
-            self.attr_state_counter = 43
-            self.curr_state = self.States.GET_43
-
-        elif event.inaxes == self.button_list[44].ax:
-            self.coords_list[44] = None
-            self.attr_state_counter = 44
-            self.curr_state = self.States.GET_44
-
-        elif event.inaxes == self.button_list[45].ax:
-            self.coords_list[45] = None
-            self.attr_state_counter = 45
-            self.curr_state = self.States.GET_45
-
-        elif event.inaxes == self.button_list[46].ax:
-            self.coords_list[46] = None
-            self.attr_state_counter = 46
-            self.curr_state = self.States.GET_46
-
-        elif event.inaxes == self.button_list[47].ax:
-            self.coords_list[47] = None
-            self.attr_state_counter = 47
-            self.curr_state = self.States.GET_47
-
-        elif event.inaxes == self.button_list[48].ax:
-            self.coords_list[48] = None
-            self.attr_state_counter = 48
-            self.curr_state = self.States.GET_48
-
-        elif event.inaxes == self.button_list[49].ax:
-            self.coords_list[49] = None
-            self.attr_state_counter = 49
-            self.curr_state = self.States.GET_49
-
-        elif event.inaxes == self.button_list[50].ax:
-            self.coords_list[50] = None
-            self.attr_state_counter = 50
-            self.curr_state = self.States.GET_50
-
-        elif event.inaxes == self.button_list[51].ax:
-            self.coords_list[51] = None
-            self.attr_state_counter = 51
-            self.curr_state = self.States.GET_51
-
-        elif event.inaxes == self.button_list[52].ax:
-            self.coords_list[52] = None
-            self.attr_state_counter = 52
-            self.curr_state = self.States.GET_52
-
-        elif event.inaxes == self.button_list[53].ax:
-            self.coords_list[53] = None
-            self.attr_state_counter = 53
-            self.curr_state = self.States.GET_53
-
-        elif event.inaxes == self.button_list[54].ax:
-            self.coords_list[54] = None
-            self.attr_state_counter = 54
-            self.curr_state = self.States.GET_54
-
-        elif event.inaxes == self.button_list[55].ax:
-            self.coords_list[55] = None
-            self.attr_state_counter = 55
-            self.curr_state = self.States.GET_55
-
-        elif event.inaxes == self.button_list[56].ax:
-            self.coords_list[56] = None
-            self.attr_state_counter = 56
-            self.curr_state = self.States.GET_56
-
-        elif event.inaxes == self.button_list[57].ax:
-            self.coords_list[57] = None
-            self.attr_state_counter = 57
-            self.curr_state = self.States.GET_57
-
-        elif event.inaxes == self.button_list[58].ax:
-            self.coords_list[58] = None
-            self.attr_state_counter = 58
-            self.curr_state = self.States.GET_58
-
-        elif event.inaxes == self.button_list[59].ax:
-            self.coords_list[59] = None
-            self.attr_state_counter = 59
-            self.curr_state = self.States.GET_59
-
-        elif event.inaxes == self.button_list[60].ax:
-            self.coords_list[60] = None
-            self.attr_state_counter = 60
-            self.curr_state = self.States.GET_60
-
-        elif event.inaxes == self.button_list[61].ax:
-            self.coords_list[61] = None
-            self.attr_state_counter = 61
-            self.curr_state = self.States.GET_61
-
-        elif event.inaxes == self.button_list[62].ax:
-            self.coords_list[62] = None
-            self.attr_state_counter = 62
-            self.curr_state = self.States.GET_62
-
-        elif event.inaxes == self.button_list[63].ax:
-            self.coords_list[63] = None
-            self.attr_state_counter = 63
-            self.curr_state = self.States.GET_63
-
-        elif event.inaxes == self.button_list[64].ax:
-            self.coords_list[64] = None
-            self.attr_state_counter = 64
-            self.curr_state = self.States.GET_64
-
-        elif event.inaxes == self.button_list[65].ax:
-            self.coords_list[65] = None
-            self.attr_state_counter = 65
-            self.curr_state = self.States.GET_65
-
-        elif event.inaxes == self.button_list[66].ax:
-            self.coords_list[66] = None
-            self.attr_state_counter = 66
-            self.curr_state = self.States.GET_66
-
-        elif event.inaxes == self.button_list[67].ax:
-            self.coords_list[67] = None
-            self.attr_state_counter = 67
-            self.curr_state = self.States.GET_67
-
-        elif event.inaxes == self.button_list[68].ax:
-            self.coords_list[68] = None
-            self.attr_state_counter = 68
-            self.curr_state = self.States.GET_68
-
+        index = self.button_index.get(event.inaxes)
+        if index == RECT_STATE:
+            self.coords_list[0] = [(0, 0), (0, 0)]
+            self.curr_state = RECT_STATE
+            self.update_rect()
+            self.journal_label(0)
+        elif index is not None:
+            self.coords_list[index] = None
+            self.attr_state_counter = index
+            self.curr_state = index
+            self.update_landmark(index)
+            self.journal_label(index)
         elif event.inaxes == self.button_done.ax:
             self.is_finished = True
-
         elif event.inaxes == self.button_skip.ax:
             self.is_skipped = True
 
-        elif event.inaxes == self.button_list[0].ax:
-            self.coords_list[0] = [(0, 0), (0, 0)]
-            self.curr_state = self.States.GET_RECT
-
-        self.redraw_annotations()
+        self.blit_overlay()
         self.update_button_labels()
 
+        if self.should_stop():
+            self.fig.canvas.stop_event_loop()
+
     def init_subplots(self):
         self.fig = plt.figure(os.path.basename(self.img_path))
+        if self.tracer.enabled:
+            # Full renders of the figure: first show, resize, zoom/pan, and any draw_idle
+            self.fig.canvas.draw = self.tracer.wrap('draw', self.fig.canvas.draw)
 
         self.im_ax = self.fig.add_subplot(1, 2, 1)
         self.im_ax.set_title('Input')
-        self.im_ax.imshow(self.image, interpolation='nearest')
-
-        self.button_list[0] = Button(plt.axes([0.5, 0.82, 0.06, 0.06]), 'Rect?')
-
-        self.button_list[0].on_clicked(self.button_event)
-
-        self.button_list[1] = Button(plt.axes([0.5, 0.75, 0.06, 0.06]),
-                               '1?')
-        self.button_list[1].on_clicked(self.button_event)
-
-        self.button_list[2] = Button(plt.axes([0.5, 0.68, 0.06, 0.06]),
-                               '2?')
-        self.button_list[2].on_clicked(self.button_event)
-
-        self.button_list[3] = Button(plt.axes([0.5, 0.61, 0.06, 0.06]),
-                               '3?')
-        self.button_list[3].on_clicked(self.button_event)
-
-        self.button_list[4] = Button(plt.axes([0.5, 0.54, 0.06, 0.06]),
-                               '4?')
-        self.button_list[4].on_clicked(self.button_event)
-
-        self.button_list[5] = Button(plt.axes([0.5, 0.47, 0.06, 0.06]),
-                               '5?')
-        self.button_list[5].on_clicked(self.button_event)
-
-        self.button_list[6] = Button(plt.axes([0.5, 0.40, 0.06, 0.06]),
-                               '6?')
-        self.button_list[6].on_clicked(self.button_event)
-
-        self.button_list[7] = Button(plt.axes([0.5, 0.33, 0.06, 0.06]),
-                               '7?')
-        self.button_list[7].on_clicked(self.button_event)
-
-        self.button_list[8] = Button(plt.axes([0.5, 0.26, 0.06, 0.06]),
-                               '8?')
-        self.button_list[8].on_clicked(self.button_event)
-
-        self.button_list[9] = Button(plt.axes([0.5, 0.19, 0.06, 0.06]),
-                               '9?')
-        self.button_list[9].on_clicked(self.button_event)
-
-        self.button_list[10] = Button(plt.axes([0.57, 0.82, 0.06, 0.06]),
-                                '10?')
-        self.button_list[10].on_clicked(self.button_event)
-
-        self.button_list[11] = Button(plt.axes([0.57, 0.75, 0.06, 0.06]),
-                                '11?')
-        self.button_list[11].on_clicked(self.button_event)
-
-        self.button_list[12] = Button(plt.axes([0.57, 0.68, 0.06, 0.06]),
-                                '12?')
-        self.button_list[12].on_clicked(self.button_event)
+        # The overview covers the whole image; the detail image only holds the zoomed-in viewport. Both use
+        # full-resolution pixel coordinates as their extent.
+        height, width = self.pyramid.height, self.pyramid.width
+        self.im_artist = self.im_ax.imshow(self.pyramid.overview(), interpolation='nearest',
+                                           extent=(-0.5, width - 0.5, height - 0.5, -0.5))
+        self.detail_artist = self.im_ax.imshow(self.pyramid.overview()[:1, :1], interpolation='nearest',
+                                               visible=False)
+        self.im_ax.set_xlim(-0.5, width - 0.5)
+        self.im_ax.set_ylim(height - 0.5, -0.5)
+        self.im_ax.set_autoscale_on(False)
+        self.im_ax.callbacks.connect('xlim_changed', self.on_view_changed)
+        self.im_ax.callbacks.connect('ylim_changed', self.on_view_changed)
+        self.fig.canvas.mpl_connect('resize_event', lambda event: self.on_view_changed(self.im_ax))
+
+        self.rect_artist = self.im_ax.add_patch(Rectangle((0, 0), 0, 0, fill=False, edgecolor=(0, 1, 0),
+                                                          linewidth=2, animated=True))
+
+        # One segment per contour; every landmark remembers which contour vertices it feeds
+        self.contour_artist = self.im_ax.add_collection(LineCollection(
+            [np.full((len(contour), 2), np.nan) for contour in self.scheme.contours],
+            colors=[(0, 1, 1, 0.6)], linewidths=1, animated=True))
+        self.contour_vertices = [[] for i in range(self.number_of_attributes + 1)]
+        for path, contour in zip(self.contour_artist.get_paths(), self.scheme.contours):
+            for vertex, index in enumerate(contour):
+                self.contour_vertices[index].append((path, vertex))
+
+        nan_points = np.full((self.number_of_attributes, 2), np.nan)
+        self.landmark_artist = self.im_ax.scatter(nan_points[:, 0], nan_points[:, 1], s=6, c=[(1, 0, 0)],
+                                                  linewidths=0, animated=True)
+        self.landmark_offsets = self.landmark_artist.get_offsets()
+        # Show any labels restored from the journal
+        self.update_rect()
+        for i in range(1, self.number_of_attributes + 1):
+            self.update_landmark(i)
+
+        if self.loupe:
+            self.init_loupe()
+
+        for index, rect in enumerate(button_layout(self.number_of_attributes + 1,
+                                                   **(LOUPE_BUTTON_AREA if self.loupe else {}))):
+            button = Button(plt.axes(rect), self.button_label(index))
+            button.on_clicked(self.button_event)
+            self.button_list[index] = button
+            self.button_index[button.ax] = index
 
-        self.button_list[13] = Button(plt.axes([0.57, 0.61, 0.06, 0.06]),
-                                '13?')
-        self.button_list[13].on_clicked(self.button_event)
-
-        self.button_list[14] = Button(plt.axes([0.57, 0.54, 0.06, 0.06]),
-                                '14?')
-        self.button_list[14].on_clicked(self.button_event)
-
-        self.button_list[15] = Button(plt.axes([0.57, 0.47, 0.06, 0.06]),
-                                '15?')
-        self.button_list[15].on_clicked(self.button_event)
-
-        self.button_list[16] = Button(plt.axes([0.57, 0.40, 0.06, 0.06]),
-                                '16?')
-        self.button_list[16].on_clicked(self.button_event)
-
-        self.button_list[17] = Button(plt.axes([0.57, 0.33, 0.06, 0.06]),
-                                '17?')
-        self.button_list[17].on_clicked(self.button_event)
-
-        self.button_list[18] = Button(plt.axes([0.57, 0.26, 0.06, 0.06]),
-                                '18?')
-        self.button_list[18].on_clicked(self.button_event)
-
-        self.button_list[19] = Button(plt.axes([0.57, 0.19, 0.06, 0.06]),
-                                '19?')
-        self.button_list[19].on_clicked(self.button_event)
-
-        self.button_list[20] = Button(plt.axes([0.64, 0.82, 0.06, 0.06]),
-                                '20?')
-        self.button_list[20].on_clicked(self.button_event)
-
-        self.button_list[21] = Button(plt.axes([0.64, 0.75, 0.06, 0.06]),
-                                '21?')
-        self.button_list[21].on_clicked(self.button_event)
-
-        self.button_list[22] = Button(plt.axes([0.64, 0.68, 0.06, 0.06]),
-                                '22?')
-        self.button_list[22].on_clicked(self.button_event)
-
-        self.button_list[23] = Button(plt.axes([0.64, 0.61, 0.06, 0.06]),
-                                '23?')
-        self.button_list[23].on_clicked(self.button_event)
-
-        self.button_list[24] = Button(plt.axes([0.64, 0.54, 0.06, 0.06]),
-                                '24?')
-        self.button_list[24].on_clicked(self.button_event)
-
-        self.button_list[25] = Button(plt.axes([0.64, 0.47, 0.06, 0.06]),
-                                '25?')
-        self.button_list[25].on_clicked(self.button_event)
-
-        self.button_list[26] = Button(plt.axes([0.64, 0.40, 0.06, 0.06]),
-                                '26?')
-        self.button_list[26].on_clicked(self.button_event)
-
-        self.button_list[27] = Button(plt.axes([0.64, 0.33, 0.06, 0.06]),
-                                '27?')
-        self.button_list[27].on_clicked(self.button_event)
-
-        self.button_list[28] = Button(plt.axes([0.64, 0.26, 0.06, 0.06]),
-                                '28?')
-        self.button_list[28].on_clicked(self.button_event)
-
-        self.button_list[29] = Button(plt.axes([0.64, 0.19, 0.06, 0.06]),
-                                '29?')
-        self.button_list[29].on_clicked(self.button_event)
-
-        self.button_list[30] = Button(plt.axes([0.71, 0.82, 0.06, 0.06]),
-                                '30?')
-        self.button_list[30].on_clicked(self.button_event)
-
-        self.button_list[31] = Button(plt.axes([0.71, 0.75, 0.06, 0.06]),
-                                '31?')
-        self.button_list[31].on_clicked(self.button_event)
-
-        self.button_list[32] = Button(plt.axes([0.71, 0.68, 0.06, 0.06]),
-                                '32?')
-        self.button_list[32].on_clicked(self.button_event)
-
-        self.button_list[33] = Button(plt.axes([0.71, 0.61, 0.06, 0.06]),
-                                '33?')
-        self.button_list[33].on_clicked(self.button_event)
-
-        self.button_list[34] = Button(plt.axes([0.71, 0.54, 0.06, 0.06]),
-                                '34?')
-        self.button_list[34].on_clicked(self.button_event)
-
-        self.button_list[35] = Button(plt.axes([0.71, 0.47, 0.06, 0.06]),
-                                '35?')
-        self.button_list[35].on_clicked(self.button_event)
-
-        self.button_list[36] = Button(plt.axes([0.71, 0.40, 0.06, 0.06]),
-                                '36?')
-        self.button_list[36].on_clicked(self.button_event)
-
-        self.button_list[37] = Button(plt.axes([0.71, 0.33, 0.06, 0.06]),
-                                '37?')
-        self.button_list[37].on_clicked(self.button_event)
-
-        self.button_list[38] = Button(plt.axes([0.71, 0.26, 0.06, 0.06]),
-                                '38?')
-        self.button_list[38].on_clicked(self.button_event)
-
-        self.button_list[39] = Button(plt.axes([0.71, 0.19, 0.06, 0.06]),
-                                '39?')
-        self.button_list[39].on_clicked(self.button_event)
-
-        self.button_list[40] = Button(plt.axes([0.78, 0.82, 0.06, 0.06]),
-                                '40?')
-        self.button_list[40].on_clicked(self.button_event)
-
-        self.button_list[41] = Button(plt.axes([0.78, 0.75, 0.06, 0.06]),
-                                '41?')
-        self.button_list[41].on_clicked(self.button_event)
-
-        self.button_list[42] = Button(plt.axes([0.78, 0.68, 0.06, 0.06]),
-                                '42?')
-        self.button_list[42].on_clicked(self.button_event)
-
-        self.button_list[43] = Button(plt.axes([0.78, 0.61, 0.06, 0.06]),
-                                '43?')
-        self.button_list[43].on_clicked(self.button_event)
-
-        self.button_list[44] = Button(plt.axes([0.78, 0.54, 0.06, 0.06]),
-                                '44?')
-        self.button_list[44].on_clicked(self.button_event)
-
-        self.button_list[45] = Button(plt.axes([0.78, 0.47, 0.06, 0.06]),
-                                '45?')
-        self.button_list[45].on_clicked(self.button_event)
-
-        self.button_list[46] = Button(plt.axes([0.78, 0.40, 0.06, 0.06]),
-                                '46?')
-        self.button_list[46].on_clicked(self.button_event)
-
-        self.button_list[47] = Button(plt.axes([0.78, 0.33, 0.06, 0.06]),
-                                '47?')
-        self.button_list[47].on_clicked(self.button_event)
-
-        self.button_list[48] = Button(plt.axes([0.78, 0.26, 0.06, 0.06]),
-                                '48?')
-        self.button_list[48].on_clicked(self.button_event)
-
-        self.button_list[49] = Button(plt.axes([0.78, 0.19, 0.06, 0.06]),
-                                '49?')
-        self.button_list[49].on_clicked(self.button_event)
-
-        self.button_list[50] = Button(plt.axes([0.85, 0.82, 0.06, 0.06]),
-                                '50?')
-        self.button_list[50].on_clicked(self.button_event)
+        self.button_done = Button(plt.axes([0.5, 0.13, 0.45, 0.05]),
+                                  'Done')
+        self.button_done.on_clicked(self.button_event)
 
-        self.button_list[51] = Button(plt.axes([0.85, 0.75, 0.06, 0.06]),
-                                '51?')
-        self.button_list[51].on_clicked(self.button_event)
+        self.button_skip = Button(plt.axes([0.5, 0.07, 0.45, 0.05]),
+                                  'Skip')
+        self.button_skip.on_clicked(self.button_event)
 
-        self.button_list[52] = Button(plt.axes([0.85, 0.68, 0.06, 0.06]),
-                                '52?')
-        self.button_list[52].on_clicked(self.button_event)
+        self.update_button_labels()
 
-        self.button_list[53] = Button(plt.axes([0.85, 0.61, 0.06, 0.06]),
-                                '53?')
-        self.button_list[53].on_clicked(self.button_event)
+    def init_loupe(self):
+        self.loupe_ax = plt.axes(LOUPE_RECT, facecolor=(0, 0, 0))
+        self.loupe_ax.set_xticks([])
+        self.loupe_ax.set_yticks([])
+        self.loupe_ax.set_aspect('equal')
+        self.loupe_ax.set_autoscale_on(False)
+        self.loupe_artist = self.loupe_ax.imshow(self.pyramid.overview()[:1, :1], interpolation='nearest',
+                                                 animated=True)
+        nan_points = np.full((self.number_of_attributes, 2), np.nan)
+        self.loupe_landmark_artist = self.loupe_ax.scatter(nan_points[:, 0], nan_points[:, 1], s=24, c=[(1, 0, 0)],
+                                                           linewidths=0, animated=True)
+        self.loupe_pixel_artist, = self.loupe_ax.plot([], [], color=(1, 1, 0), linewidth=1, animated=True)
 
-        self.button_list[54] = Button(plt.axes([0.85, 0.54, 0.06, 0.06]),
-                                '54?')
-        self.button_list[54].on_clicked(self.button_event)
+    def save_annotations(self):
+        print(format_header(self.number_of_attributes))
+        print(format_row(self.img_path, self.coords_list))
+
+        self.output.write(self.img_path, self.coords_list)
+        if not isinstance(self.output, RemoteOutput):
+            # The labels are in the output now; the journal no longer needs them. A RemoteOutput only buffers
+            # them until its batch is submitted, and completes the journal itself then.
+            self.finish_journal()
+        if self.shape_model is not None:
+            # Picks up the row just written, so the mean shape improves as the session goes on
+            self.shape_model.refresh()
+
+    def set_image(self, img_path, image=None, keep_view=False):
+        size = (self.pyramid.height, self.pyramid.width)
+        self.img_path = img_path
+        self.tracer.set_image(img_path)
+        self.key_pressed = False
+        self.key_event = None
 
-        self.button_list[55] = Button(plt.axes([0.85, 0.47, 0.06, 0.06]),
-                                '55?')
-        self.button_list[55].on_clicked(self.button_event)
+        self.coords_list = [None for i in range(self.number_of_attributes + 1)]
+        self.coords_list[0] = [(0, 0), (0, 0)]
 
-        self.button_list[56] = Button(plt.axes([0.85, 0.40, 0.06, 0.06]),
-                                '56?')
-        self.button_list[56].on_clicked(self.button_event)
+        with self.tracer.span('load'):
+            self.pyramid = self.display_pyramid(img_path, image)
 
-        self.button_list[57] = Button(plt.axes([0.85, 0.33, 0.06, 0.06]),
-                                '57?')
-        self.button_list[57].on_clicked(self.button_event)
+        self.landmark_index = GridIndex(max(self.pyramid.height, self.pyramid.width) / GRID_CELLS)
+        self.drag_index = None
+        self.drag_press_event = None
+        self.drag_origin = None
+        self.drag_moved = False
 
-        self.button_list[58] = Button(plt.axes([0.85, 0.26, 0.06, 0.06]),
-                                '58?')
-        self.button_list[58].on_clicked(self.button_event)
+        self.attr_state_counter = 1
+        self.curr_state = self.attr_state_counter
+        self.restore_journal()
 
-        self.button_list[59] = Button(plt.axes([0.85, 0.19, 0.06, 0.06]),
-                                '59?')
-        self.button_list[59].on_clicked(self.button_event)
+        self.is_finished = False
+        self.is_skipped = False
 
-        self.button_list[60] = Button(plt.axes([0.92, 0.82, 0.06, 0.06]),
-                                '60?')
-        self.button_list[60].on_clicked(self.button_event)
+        if self.fig is None:
+            return
 
-        self.button_list[61] = Button(plt.axes([0.92, 0.75, 0.06, 0.06]),
-                                '61?')
-        self.button_list[61].on_clicked(self.button_event)
+        # The window and its widgets are kept; only the image data, labels and title change
+        height, width = self.pyramid.height, self.pyramid.width
+        self.im_artist.set_data(self.pyramid.overview())
+        self.im_artist.set_extent((-0.5, width - 0.5, height - 0.5, -0.5))
+        self.detail_artist.set_visible(False)
+        # The loupe reappears once the mouse moves over the new image
+        self.loupe_center = None
+        if keep_view and size == (height, width):
+            # The limits stay, so the viewport of the new image has to be cropped here
+            self.on_view_changed(self.im_ax)
+        else:
+            self.im_ax.set_xlim(-0.5, width - 0.5)
+            self.im_ax.set_ylim(height - 0.5, -0.5)
+            if self.fig.canvas.toolbar is not None:
+                # Forget the zoom/pan history of the previous image
+                self.fig.canvas.toolbar.update()
 
-        self.button_list[62] = Button(plt.axes([0.92, 0.68, 0.06, 0.06]),
-                                '62?')
-        self.button_list[62].on_clicked(self.button_event)
+        for i in range(self.number_of_attributes + 1):
+            self.button_list[i].label.set_text(self.button_label(i))
 
-        self.button_list[63] = Button(plt.axes([0.92, 0.61, 0.06, 0.06]),
-                                '63?')
-        self.button_list[63].on_clicked(self.button_event)
+        if self.fig.canvas.manager is not None:
+            self.fig.canvas.manager.set_window_title(os.path.basename(img_path))
 
-        self.button_list[64] = Button(plt.axes([0.92, 0.54, 0.06, 0.06]),
-                                '64?')
-        self.button_list[64].on_clicked(self.button_event)
+        # The cached background shows the previous image; the next full draw replaces it
+        self.background = None
+        self.redraw_annotations()
 
-        self.button_list[65] = Button(plt.axes([0.92, 0.47, 0.06, 0.06]),
-                                '65?')
-        self.button_list[65].on_clicked(self.button_event)
+    def close(self):
+        if self.fig is not None and not self.is_closed:
+            plt.close(self.fig)
+        self.fig = None
+        for timer in self.full_timers:
+            timer.stop()
+        self.full_timers.clear()
+        self.full_decoder.shutdown(wait=False)
 
-        self.button_list[66] = Button(plt.axes([0.92, 0.40, 0.06, 0.06]),
-                                '66?')
-        self.button_list[66].on_clicked(self.button_event)
+    def run(self):
+        if self.fig is None:
+            self.is_closed = False
+            self.init_subplots()
+            self.connect()
 
-        self.button_list[67] = Button(plt.axes([0.92, 0.33, 0.06, 0.06]),
-                                '67?')
-        self.button_list[67].on_clicked(self.button_event)
+        if self.fig.stale:
+            self.fig.canvas.draw_idle()
+        plt.show(block=False)
 
-        self.button_list[68] = Button(plt.axes([0.92, 0.26, 0.06, 0.06]),
-                                '68?')
-        self.button_list[68].on_clicked(self.button_event)
+        # Block in the backend's own event loop until Done, Skip, 'q' or closing the window stops it
+        if not self.should_stop():
+            # The event_loop span is the time spent on the image; the handlers it ran are nested in it
+            with self.tracer.span('event_loop'):
+                self.fig.canvas.start_event_loop(timeout=0)
 
-        self.button_done = Button(plt.axes([0.5, 0.13, 0.45, 0.05]),
-                                  'Done')
-        self.button_done.on_clicked(self.button_event)
+        if self.is_finished:
+            self.save_annotations()
+            return 0  # finished normally
+        elif self.is_skipped:
+            self.finish_journal()
+            return 0
+        else:
+            return 1  # aborted (pressed 'q')
 
-        self.button_skip = Button(plt.axes([0.5, 0.07, 0.45, 0.05]),
-                                  'Skip')
-        self.button_skip.on_clicked(self.button_event)
 
-        self.update_button_labels()
+class VideoViewer(InteractiveViewer):
+    """
+    VideoViewer - Class
 
-    def save_annotations(self):
+    InteractiveViewer for the frames of a video (-v). Done saves the frame and Skip leaves it unsaved; both
+    move on to the next frame. The keys in FRAME_STEPS move to another frame without saving.
 
-        print('image_name,x_0,x_1,x_2,x_3,x_4,x_5,x_6,x_7,x_8,x_9,x_10,x_11,x_12,'
-              'x_13,x_14,x_15,x_16,x_17,x_18,x_19,x_20,x_21,x_22,x_23,x_24,'
-              'x_25,x_26,x_27,x_28,x_29,x_30,x_31,x_32,x_33,x_34,x_35,x_36,'
-              'x_37,x_38,x_39,x_40,x_41,x_42,x_43,x_44,x_45,x_46,x_47,x_48,'
-              'x_49,x_50,x_51,x_52,x_53,x_54,x_55,x_56,x_57,x_58,x_59,x_60,'
-              'x_61,x_62,x_63,x_64,x_65,x_66,x_67,y_0,y_1,y_2,y_3,y_4,'
-              'y_5,y_6,y_7,y_8,y_9,y_10,y_11,y_12,y_13,y_14,y_15,y_16,'
-              'y_17,y_18,y_19,y_20,y_21,y_22,y_23,y_24,y_25,y_26,y_27,'
-              'y_28,y_29,y_30,y_31,y_32,y_33,y_34,y_35,y_36,y_37,y_38,'
-              'y_39,y_40,y_41,y_42,y_43,y_44,y_45,y_46,y_47,y_48,y_49,'
-              'y_50,y_51,y_52,y_53,y_54,y_55,y_56,y_57,y_58,y_59,y_60,'
-              'y_61,y_62,y_63,y_64,y_65,y_66,y_67')
-
-        f_winner.write('image_name,x_0,x_1,x_2,x_3,x_4,x_5,x_6,x_7,x_8,x_9,x_10,x_11,x_12,'
-              'x_13,x_14,x_15,x_16,x_17,x_18,x_19,x_20,x_21,x_22,x_23,x_24,'
-              'x_25,x_26,x_27,x_28,x_29,x_30,x_31,x_32,x_33,x_34,x_35,x_36,'
-              'x_37,x_38,x_39,x_40,x_41,x_42,x_43,x_44,x_45,x_46,x_47,x_48,'
-              'x_49,x_50,x_51,x_52,x_53,x_54,x_55,x_56,x_57,x_58,x_59,x_60,'
-              'x_61,x_62,x_63,x_64,x_65,x_66,x_67,y_0,y_1,y_2,y_3,y_4,'
-              'y_5,y_6,y_7,y_8,y_9,y_10,y_11,y_12,y_13,y_14,y_15,y_16,'
-              'y_17,y_18,y_19,y_20,y_21,y_22,y_23,y_24,y_25,y_26,y_27,'
-              'y_28,y_29,y_30,y_31,y_32,y_33,y_34,y_35,y_36,y_37,y_38,'
-              'y_39,y_40,y_41,y_42,y_43,y_44,y_45,y_46,y_47,y_48,y_49,'
-              'y_50,y_51,y_52,y_53,y_54,y_55,y_56,y_57,y_58,y_59,y_60,'
-              'y_61,y_62,y_63,y_64,y_65,y_66,y_67\n')
-
-        print(self.img_path, end="")
-        f_winner.write(f"{self.img_path}")
-        for i in range(69):
-            for j in range(2):
-                try:
-                    if i > 0:
-                        print(f",{self.coords_list[i][j]}", end="")
-                        f_winner.write(f",{self.coords_list[i][j]}")
-                    # elif self.bounding_box is True:
-                    #     print(f",{self.coords_list[i][j]}",end="")
-                    #     f_winner.write(f",{self.coords_list[i][j]}")
-                except:
-                    if i > 0:
-                        print(",(-1,-1)", end="")
-                        f_winner.write(",(-1,-1)")
-                    # elif self.bounding_box is True:
-                    #     print(",(-1,-1)", end="")
-                    #     f_winner.write(",(-1,-1)")
-
-        print()
-        f_winner.write("\n")
+    Functions:
+    init_subplots: Takes the FRAME_STEPS keys away from the toolbar's zoom history first, so stepping to the
+    next frame does not also zoom back out.
 
-    def run(self):
-        self.init_subplots()
-        self.connect()
+    should_stop: Also stops once a FRAME_STEPS key is pressed.
 
-        while True:
-            # Wait for output, and 'update' figure
-            plt.pause(0.01)
+    frame_step: Returns how many frames to move after run: 1 after Done or Skip, the FRAME_STEPS entry of the
+    key pressed, or None to stop annotating (q or the window closed).
+    """
 
-            # Exit
-            if (self.is_finished
-                    or (self.key_pressed and self.key_event.key == 'q')
-                    or self.is_skipped):
-                break
+    def init_subplots(self):
+        for name in ('keymap.back', 'keymap.forward'):
+            plt.rcParams[name] = [key for key in plt.rcParams[name] if key not in FRAME_STEPS]
+        super(VideoViewer, self).init_subplots()
 
-        plt.close()
+    def should_stop(self):
+        return super(VideoViewer, self).should_stop() or (self.key_pressed and self.key_event.key in FRAME_STEPS)
 
-        if self.is_finished:
-            self.save_annotations()
-            return 0  # finished normally
-        elif self.is_skipped:
-            return 0
-        else:
-            return 1  # aborted (pressed 'q')
+    def frame_step(self):
+        if self.is_finished or self.is_skipped:
+            return 1
+        if self.is_closed or not self.key_pressed:
+            return None
+        return FRAME_STEPS.get(self.key_event.key)
 
 
 def parse_arguments():
@@ -1153,34 +969,536 @@ def parse_arguments():
                             help='dir with images')
     base_group.add_argument('-i', '--img', type=str,
                             help='single image')
+    base_group.add_argument('--render', type=str,
+                            help='headless: save overlays of the annotations in --output to this dir')
+    base_group.add_argument('-v', '--video', type=str,
+                            help='video to annotate frame by frame; the landmarks of a frame are carried over to '
+                                 'the next by optical flow')
+    base_group.add_argument('--connect', type=str, metavar='URL',
+                            help='annotate images handed out by a --serve work server, e.g. http://host:8765')
+    base_group.add_argument('--merge', action='store_true',
+                            help='headless: merge the --shard files of --output into --output, by time')
+    base_group.add_argument('--qa', type=str, metavar='REPORT',
+                            help='headless: check the annotations in --output for mistakes and write the suspect '
+                                 'images, worst first, to this CSV file')
+    base_group.add_argument('--agree', type=str, nargs='+', metavar='OUTPUT',
+                            help='headless: compare the text outputs of several annotators, write their median '
+                                 'consensus to --output and the agreement (NME) to <output>.agreement*.csv')
     # base_group.add_argument('-b', '--bounding_box')
     parser.add_argument('-n', '--nimgs', type=int,
                         help='number of images for -d mode', default=1)
+    parser.add_argument('-o', '--output', type=str,
+                        help='text file the annotations are appended to', default='landmark_output.txt')
+    parser.add_argument('--shard', action='store_true',
+                        help='append to a shard of --output of this process only (<output>.shards/), so several '
+                             'annotators can share one output directory; combine the shards with --merge')
+    parser.add_argument('--db', type=str,
+                        help='write annotations to this SQLite database instead of the text output')
+    parser.add_argument('-r', '--recursive', action='store_true',
+                        help='in -d mode, also annotate images in subdirectories')
+    parser.add_argument('--manifest', type=str,
+                        help='cache the -d image listing in this file; later runs only re-list changed directories')
+    parser.add_argument('--scheme', type=str, default=DEFAULT_SCHEME,
+                        help=f"landmark scheme: one of {', '.join(available_schemes())}, or a scheme definition "
+                             f"file (default: {DEFAULT_SCHEME})")
+    parser.add_argument('--preannotate', action='store_true',
+                        help='after drawing the face box, place all landmarks from the mean shape of the output')
+    parser.add_argument('--resume', action='store_true',
+                        help='in -d mode, skip images that already have an annotation in the output; in -v mode, '
+                             'start at the first frame without one')
+    parser.add_argument('--browse', action='store_true',
+                        help='in -d mode, pick images from a paged thumbnail grid showing done/skipped/pending')
+    parser.add_argument('--thumbnails', type=str, metavar='DIR',
+                        help='thumbnail cache directory for --browse (default: ~/.cache/annotate_faces/thumbnails)')
+    parser.add_argument('--serve', type=str, metavar='HOST:PORT',
+                        help='hand out the -d images to --connect annotators and write their annotations to the '
+                             'output, e.g. 0.0.0.0:8765')
+    parser.add_argument('--lease-timeout', type=float,
+                        help='seconds a served image stays leased to an annotator that stopped responding',
+                        default=900)
+    parser.add_argument('--submit-batch', type=int,
+                        help='with --connect, number of finished images sent to the server at once', default=4)
+    parser.add_argument('--no-journal', action='store_true',
+                        help='do not journal unsaved labels to <output>.journal (a journal per process with '
+                             '--shard and --connect) for crash recovery')
+    parser.add_argument('--profile', type=str, metavar='TRACE',
+                        help='record per-event latencies to this trace file (.csv, otherwise Chrome trace JSON) '
+                             'and print a latency report at exit')
+    parser.add_argument('--qa-threshold', type=float, default=RESIDUAL_THRESHOLD,
+                        help='with --qa, robust z-score above which a landmark is reported as an outlier')
+    parser.add_argument('-j', '--workers', type=int,
+                        help='worker processes for --render (default: all cores)')
+    parser.add_argument('--decode', type=str, choices=('auto', '1', '2', '4', '8'), default='auto',
+                        help='JPEG decode resolution: auto decodes large images at the resolution of the first '
+                             'frame and at full resolution only once zoomed in; 2/4/8 always start at 1/2, 1/4 '
+                             'or 1/8 resolution; 1 always decodes the full resolution')
+    parser.add_argument('--loupe', type=int, default=LOUPE_PIXELS,
+                        help='full-resolution pixels across the magnifier next to the image (0: no magnifier)')
+    parser.add_argument('--ring-frames', type=int, default=RING_FRAMES,
+                        help='decoded video frames kept for stepping back in -v mode')
+    parser.add_argument('--prefetch', type=int,
+                        help='number of upcoming images decoded in the background in -d mode', default=4)
+    parser.add_argument('--cache-mb', type=int,
+                        help='memory budget in MB for decoded images in -d mode', default=1024)
 
     args = parser.parse_args()
-    if args.dirimgs is None and args.img is None:
+    if (args.dirimgs is None and args.img is None and args.video is None and args.render is None
+            and args.connect is None and not args.merge and args.qa is None and args.agree is None):
         parser.print_help()
 
     return args
 
 
+def open_output(args, scheme):
+    if args.db is not None:
+        # The work server flushes once per submitted batch
+        return SQLiteAnnotationStore(args.db, batch_size=1 if args.serve is None else 1000)
+    # The work server always skips images that are already annotated, and the browser shows them
+    resume = args.resume or args.serve is not None or args.browse
+    if args.shard and args.serve is None:
+        path = shard_path(args.output)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        index = ResumeIndex(path, number_of_landmarks=scheme.number_of_landmarks) if resume else None
+        return ShardWriter(open(path, 'a'), index)
+    index = ResumeIndex(args.output, number_of_landmarks=scheme.number_of_landmarks) if resume else None
+    return TextAnnotationWriter(open(args.output, 'a'), index)
+
+
+def annotated_images(output, args=None, scheme=None):
+    """Returns a container of the already annotated image paths that supports fast membership tests."""
+    if isinstance(output, SQLiteAnnotationStore):
+        return set(image_key(img_path) for img_path in output.annotated_paths())
+    if isinstance(output, ShardWriter):
+        # Images annotated by other annotators, in their shards or already merged, count as well. Our own shard
+        # is already indexed by the writer.
+        done = annotated_in_shards(args.output, scheme.number_of_landmarks, exclude=[output.f.name])
+        if output.index is not None:
+            done |= output.index.done
+        return done
+    return output.index
+
+
+def text_output_path(args, output):
+    """Returns the path of the text file that output appends to: the shard of this process with --shard."""
+    if isinstance(output, ShardWriter):
+        return output.f.name
+    return args.output
+
+
+def journal_path(args, output):
+    """
+    Returns the path of the ClickJournal: <output>.journal, or a journal of this process only when several
+    processes share the output, next to its shard with --shard and in <output>.journals/ with --connect.
+    """
+    if isinstance(output, ShardWriter):
+        return os.path.splitext(output.f.name)[0] + '.journal'
+    if isinstance(output, RemoteOutput):
+        os.makedirs(args.output + '.journals', exist_ok=True)
+        return os.path.join(args.output + '.journals', session_name() + '.journal')
+    return (args.db if args.db is not None else args.output) + '.journal'
+
+
+def decode_reduction(args):
+    return args.decode if args.decode == 'auto' else int(args.decode)
+
+
+def pending_images(img_paths, done):
+    for img_path in img_paths:
+        if image_key(img_path) not in done:
+            yield img_path
+
+
+def agree(args, scheme):
+    missing = [path for path in args.agree if not os.path.exists(path)]
+    if missing:
+        print(f"--agree compares text outputs; {', '.join(missing)} does not exist", file=sys.stderr)
+        return
+    if len(args.agree) < 2:
+        print("--agree compares two or more text outputs", file=sys.stderr)
+        return
+    # Rejected before the comparison, which takes a while on large outputs
+    try:
+        check_consensus_path(args.output, args.agree)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return
+    agreement = compare_annotators(args.agree, scheme)
+    write_consensus(args.output, agreement)
+    write_image_report(args.output + '.agreement.csv', agreement)
+    write_landmark_report(args.output + '.agreement_landmarks.csv', agreement)
+    write_annotator_report(args.output + '.agreement_annotators.csv', agreement)
+
+    print(f"Compared {len(agreement.img_paths)} images annotated by two or more of {len(args.agree)} annotators, "
+          f"{agreement.single_images} annotated by one only", file=sys.stderr)
+    nme = agreement.image_nme[~np.isnan(agreement.image_nme)]
+    if not len(nme):
+        return
+    print(f"  NME per image: mean {format_nme(nme.mean())}, median {format_nme(np.median(nme))}", file=sys.stderr)
+    for path, images, annotator_nme in zip(args.agree, agreement.annotator_images, agreement.annotator_nme):
+        print(f"  {path}: {images} images, NME {format_nme(annotator_nme) or '-'} against the consensus",
+              file=sys.stderr)
+    worst = np.argsort(-np.nan_to_num(agreement.landmark_nme, nan=-np.inf))[:AGREE_SHOWN]
+    print(f"  least agreement on landmarks "
+          f"{', '.join(f'{landmark + 1} ({format_nme(agreement.landmark_nme[landmark])})' for landmark in worst)}",
+          file=sys.stderr)
+    print(f"Consensus written to {args.output}, agreement per image, landmark and annotator to "
+          f"{args.output}.agreement*.csv", file=sys.stderr)
+
+
 def main(args):
+    try:
+        scheme = load_scheme(args.scheme)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return
+
+    if args.render is not None:
+        if not os.path.exists(args.output):
+            print(f"--render draws a text output; {args.output} does not exist", file=sys.stderr)
+            return
+        rendered, failed = render_overlays(args.output, args.render, workers=args.workers, scheme=scheme)
+        print(f"Rendered {rendered} overlays to {args.render}, {failed} images could not be read", file=sys.stderr)
+        return
+
+    if args.qa is not None:
+        if not os.path.exists(args.output):
+            print(f"--qa checks a text output; {args.output} does not exist", file=sys.stderr)
+            return
+        suspects, checked = find_suspects(args.output, scheme, args.qa_threshold)
+        write_report(args.qa, suspects)
+        counts = {}
+        for img_path, score, findings in suspects:
+            for finding, detail in findings:
+                counts[finding] = counts.get(finding, 0) + 1
+        print(f"Checked {checked} images: {len(suspects)} suspects "
+              f"({', '.join(f'{count} {finding}' for finding, count in counts.items()) or 'none'}), "
+              f"worst first in {args.qa}", file=sys.stderr)
+        for img_path, score, findings in suspects[:QA_SHOWN]:
+            print(f"  {img_path}: {format_findings(findings)}", file=sys.stderr)
+        return
+
+    if args.agree is not None:
+        agree(args, scheme)
+        return
+
+    if args.merge:
+        try:
+            merged = merge_shards(args.output)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return
+        # Including the shard of any rows appended to the output since the last merge
+        print(f"Merged {merged} annotations from {len(list_shards(args.output))} shards into {args.output}",
+              file=sys.stderr)
+        return
+
+    if args.serve is not None:
+        if args.dirimgs is None:
+            print("--serve hands out the images of a -d directory", file=sys.stderr)
+            return
+        output = open_output(args, scheme)
+        try:
+            serve(args, output, scheme)
+        finally:
+            output.close()
+        return
+
+    client = None
+    if args.connect is not None:
+        client = WorkClient(args.connect)
+        # The server decides the landmark scheme
+        scheme = client.scheme()
+        output = RemoteOutput(client, args.submit_batch)
+    elif args.dirimgs is None and args.img is None and args.video is None:
+        return
+    else:
+        output = open_output(args, scheme)
+
+    tracer = Tracer(args.profile)
+    skip_list = None
     if args.dirimgs is not None:
-        flist = sorted(os.listdir(args.dirimgs))
-        for curr_file in flist:  # [::len(flist) // args.nimgs][:args.nimgs]:
-            img_path = os.path.join(args.dirimgs, curr_file)
-            viewer = InteractiveViewer(img_path)
-            if viewer.run() == 1:
+        skip_list = SkipList((args.db if args.db is not None else args.output) + '.skipped')
+    journal = None
+    if not args.no_journal:
+        path = journal_path(args, output)
+        if isinstance(output, (ShardWriter, RemoteOutput)):
+            adopt_journals(path)
+        journal = ClickJournal(path)
+        if isinstance(output, RemoteOutput):
+            output.on_submitted = lambda img_paths: journal.complete(*img_paths)
+        if len(journal):
+            print(f"Journal: unfinished labels of {len(journal)} images are restored when they come up",
+                  file=sys.stderr)
+    shape_model = None
+    if args.preannotate:
+        if args.db is not None or client is not None:
+            print("--preannotate learns the mean shape from a text output and is ignored with --db and --connect",
+                  file=sys.stderr)
+        else:
+            # Refreshed from the rows this session appends, so with --shard it learns from the shard
+            shape_model = ShapeModel(text_output_path(args, output), number_of_landmarks=scheme.number_of_landmarks)
+    try:
+        if client is not None:
+            annotate_remote(args, client, output, scheme, shape_model, tracer, journal)
+        elif args.browse and args.dirimgs is not None:
+            browse(args, output, scheme, shape_model, tracer, journal, skip_list)
+        elif args.video is not None:
+            annotate_video(args, output, scheme, shape_model, tracer, journal)
+        else:
+            annotate(args, output, scheme, shape_model, tracer, journal, skip_list)
+    finally:
+        # Finished annotations go out before the leases of the images not annotated are given back
+        output.close()
+        if client is not None:
+            client.close()
+        tracer.close()
+        if journal is not None:
+            journal.close()
+            if isinstance(output, (ShardWriter, RemoteOutput)) and not len(journal):
+                # Nothing left for a later session to adopt
+                os.remove(journal.path)
+        if skip_list is not None:
+            skip_list.close()
+
+
+def annotate(args, output, scheme, shape_model=None, tracer=None, journal=None, skip_list=None):
+    tracer = Tracer() if tracer is None else tracer
+    if args.dirimgs is not None:
+        img_paths = build_manifest(args.dirimgs, args.manifest, recursive=args.recursive)
+        if args.resume:
+            total = len(img_paths)
+            img_paths = list(pending_images(img_paths, annotated_images(output, args, scheme)))
+            print(f"Resuming: {len(img_paths)} of {total} images left to annotate", file=sys.stderr)
+        reduce = decode_reduction(args)
+        prefetcher = ImagePrefetcher(img_paths, prefetch=args.prefetch, max_bytes=args.cache_mb * 1024 * 1024,
+                                     loader=lambda img_path: load_display_image(img_path, reduce))
+        # One viewer (and one window) is reused for the whole directory
+        viewer = None
+        try:
+            for index, img_path in enumerate(img_paths):  # [::len(img_paths) // args.nimgs][:args.nimgs]:
+                # Time spent waiting for the prefetcher; the viewer's load span only covers the pyramid then
+                try:
+                    with tracer.span('prefetch_wait', img_path):
+                        image = prefetcher.get(index)
+                except (IOError, OSError) as e:
+                    # A corrupt or unreadable file does not end the session
+                    print(f"Skipping {img_path}: {e}", file=sys.stderr)
+                    if skip_list is not None:
+                        skip_list.add(img_path)
+                    continue
+                if viewer is None:
+                    viewer = InteractiveViewer(img_path, image, output, shape_model, scheme, tracer, journal,
+                                               args.loupe)
+                else:
+                    viewer.set_image(img_path, image)
+                if viewer.run() == 1:
+                    break
+                if viewer.is_skipped and skip_list is not None:
+                    skip_list.add(img_path)
+        finally:
+            prefetcher.close()
+            if viewer is not None:
+                viewer.close()
+
+    elif args.img is not None:
+        img_path = args.img
+        image = load_display_image(img_path, decode_reduction(args))
+        viewer = InteractiveViewer(img_path, image, output, shape_model, scheme, tracer, journal, args.loupe)
+        viewer.run()
+        viewer.close()
+
+
+def annotate_remote(args, client, output, scheme, shape_model=None, tracer=None, journal=None):
+    tracer = Tracer() if tracer is None else tracer
+    viewer = None
+    try:
+        while True:
+            # Lease the image to annotate now plus the ones to prefetch
+            leased, outstanding = client.lease(args.prefetch + 1)
+            if not leased:
+                if not outstanding:
+                    break
+                # The rest is leased to other annotators or waits in our own unsent batch; an image comes back
+                # here if its annotator goes away
+                output.flush()
+                print(f"Waiting: {outstanding} images are leased to other annotators", file=sys.stderr)
+                time.sleep(5)
+                continue
+
+            img_paths = [img_path for lease_id, img_path in leased]
+            prefetcher = ImagePrefetcher(img_paths, prefetch=args.prefetch, max_bytes=args.cache_mb * 1024 * 1024,
+                                         loader=lambda img_path: display_image(client.fetch_image(img_path), img_path,
+                                                                               decode_reduction(args)))
+            try:
+                for index, img_path in enumerate(img_paths):
+                    try:
+                        with tracer.span('prefetch_wait', img_path):
+                            image = prefetcher.get(index)
+                    except (IOError, OSError) as e:
+                        # Given back as skipped, so the image is not handed to the next annotator to fail again
+                        print(f"Skipping {img_path}: {e}", file=sys.stderr)
+                        client.release([img_path], skipped=True)
+                        continue
+                    if viewer is None:
+                        viewer = InteractiveViewer(img_path, image, output, shape_model, scheme, tracer, journal,
+                                                   args.loupe)
+                    else:
+                        viewer.set_image(img_path, image)
+                    if viewer.run() == 1:
+                        return
+                    if viewer.is_skipped:
+                        client.release([img_path], skipped=True)
+            finally:
+                prefetcher.close()
+    finally:
+        if viewer is not None:
+            viewer.close()
+
+
+def saved_frames(args, output, scheme):
+    """
+    Returns {frame index: landmark list} of the frames of the -v video that already have an annotation in the text
+    output (the shard of this process with --shard) or the SQLite database. Shards of other annotators are not
+    looked at.
+    """
+    video_key = image_key(args.video)
+    saved = {}
+    if isinstance(output, SQLiteAnnotationStore):
+        for img_path in output.annotated_paths():
+            frame = parse_frame_key(img_path)
+            if frame is not None and image_key(frame[0]) == video_key:
+                saved[frame[1]] = output.latest(img_path)
+    elif isinstance(output, TextAnnotationWriter) and os.path.exists(text_output_path(args, output)):
+        output.flush()
+        landmarks, paths = load_annotations(text_output_path(args, output), scheme.number_of_landmarks)
+        for key, row in latest_rows(paths).items():
+            frame = parse_frame_key(key)
+            if frame is not None and frame[0] == video_key:
+                saved[frame[1]] = [None if x != x else (int(x), int(y)) for x, y in landmarks[row].tolist()]
+    return saved
+
+
+def annotate_video(args, output, scheme, shape_model=None, tracer=None, journal=None):
+    tracer = Tracer() if tracer is None else tracer
+    try:
+        frames = VideoFrames(args.video, args.ring_frames)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return
+    saved = saved_frames(args, output, scheme)
+    index = 0
+    if args.resume:
+        while index in saved:
+            index += 1
+        print(f"Resuming: {len(saved)} frames annotated, starting at frame {index} of {len(frames)}",
+              file=sys.stderr)
+
+    # The frame shown last and the positions of its labels; the labels of the next frame are tracked from them
+    previous = None
+    if index - 1 in saved:
+        previous = frames.get(index - 1), label_points(saved[index - 1])
+    viewer = None
+    try:
+        while True:
+            with tracer.span('decode', args.video):
+                frame = frames.get(index)
+            if frame is None:
                 break
+            img_path = frame_key(args.video, index)
+            if viewer is None:
+                viewer = VideoViewer(img_path, frame, output, shape_model, scheme, tracer, journal, args.loupe)
             else:
+                viewer.set_image(img_path, frame, keep_view=True)
+
+            # An annotated frame shows its annotation; any other frame the labels it is reached from, moved along
+            labels = saved.get(index)
+            tracked = None
+            if labels is None and previous is not None:
+                with tracer.span('track', img_path):
+                    tracked = track_landmarks(previous[0], frame, previous[1])
+                labels = pixel_labels(tracked)
+            if labels is not None:
+                viewer.place_landmarks(labels)
+
+            viewer.run()
+            labels = viewer.coords_list[1:]
+            if viewer.is_finished:
+                saved[index] = labels
+            step = viewer.frame_step()
+            if step is None:
+                break
+            previous = frame, label_points(labels, tracked)
+            index = max(index + step, 0)
+    finally:
+        frames.close()
+        if viewer is not None:
+            viewer.close()
+
+
+def browse(args, output, scheme, shape_model=None, tracer=None, journal=None, skip_list=None):
+    img_paths = build_manifest(args.dirimgs, args.manifest, recursive=args.recursive)
+    done = annotated_images(output, args, scheme)
+    # A SQLite output hands out a snapshot, so this session's annotations are tracked here as well
+    annotated = set()
+
+    def state(img_path):
+        key = image_key(img_path)
+        if key in done or key in annotated:
+            return 'done'
+        return 'skipped' if key in skip_list else 'pending'
+
+    thumbnails = ThumbnailCache(args.thumbnails, workers=args.workers)
+    sheet = ContactSheet(img_paths, state, thumbnails)
+    viewer = None
+    try:
+        while True:
+            index = sheet.run()
+            if index is None:
+                break
+            img_path = img_paths[index]
+            try:
+                image = load_display_image(img_path, decode_reduction(args))
+            except (IOError, OSError) as e:
+                print(f"Skipping {img_path}: {e}", file=sys.stderr)
+                skip_list.add(img_path)
                 continue
-
-        img_path = args.img
-        viewer = InteractiveViewer(img_path)
-        viewer.run()
+            if viewer is None:
+                viewer = InteractiveViewer(img_path, image, output, shape_model, scheme, tracer, journal, args.loupe)
+            else:
+                viewer.set_image(img_path, image)
+            # Done or Skip go back to the sheet, and so does q, which only leaves the image
+            viewer.run()
+            if viewer.is_finished:
+                annotated.add(image_key(img_path))
+            elif viewer.is_skipped:
+                skip_list.add(img_path)
+            if viewer.is_closed:
+                # The window is gone; the next image opens a new viewer
+                viewer.close()
+                viewer = None
+    finally:
+        sheet.close()
+        thumbnails.close()
+        if viewer is not None:
+            viewer.close()
+
+
+def serve(args, output, scheme):
+    img_paths = build_manifest(args.dirimgs, args.manifest, recursive=args.recursive)
+    img_paths = list(pending_images(img_paths, annotated_images(output)))
+
+    host, _, port = args.serve.rpartition(':')
+    queue = WorkQueue(img_paths, lease_timeout=args.lease_timeout)
+    server = WorkServer((host, int(port)), queue, output, scheme)
+    print(f"Serving {len(img_paths)} images to annotate on {args.serve}", file=sys.stderr)
+    try:
+        server.serve_until_done()
+    finally:
+        server.server_close()
+        status = queue.status()
+        print(f"Annotated {status['done']}, skipped {status['skipped']}, {status['queued'] + status['leased']} left "
+              f"({status['reissued']} re-issued after a lease expired)", file=sys.stderr)
 
 
 if __name__ == '__main__':
-    f_winner = open('landmark_output.txt', 'a')
     main(parse_arguments())
-    f_winner.close()
@@ -0,0 +1,331 @@
+"""
+Inter-annotator agreement over the text outputs of several annotators
+
+compare_annotators joins the outputs of annotators who labeled (some of) the same images on the image path
+and compares, for every image that at least two of them annotated, their latest annotations of it:
+  consensus  the median of every landmark over the annotators who labeled it, x and y separately
+  NME        normalized mean error: the mean distance between two annotators' landmarks, over the landmarks
+             both labeled, divided by the inter-ocular distance of the consensus (the distance of the
+             scheme's "interocular" pair, e.g. the outer eye corners of iBUG-68), or by the square root of
+             the consensus' bounding box area for schemes without one
+The NME of an image is the mean NME of all pairs of its annotators. Over all images, the NME is aggregated per
+landmark, per pair of annotators and per annotator against the consensus.
+
+Every output is loaded with load_annotations (memory-mapped), and the join is a hash join: one pass over the
+latest rows of each output looks its images up in a dict from image key to position, so the join is an
+(images, annotators) table of row numbers (-1 where an annotator has no row). The images are then compared in
+chunks of CHUNK_IMAGES: the shapes of a chunk are gathered into an (images, annotators, K, 2) array with NaN
+for what is missing, the median is a sort along the annotator axis (NaN sorts last), and the landmark
+distances of all annotator pairs come from one subtraction indexed by np.triu_indices, broadcast over the
+images and landmarks. No Python loop runs per image or per pair.
+
+write_consensus writes the consensus shapes as a text output that starts with a CONSENSUS_MARKER line, to a
+target that check_consensus_path validates before anything is compared;
+write_image_report, write_landmark_report and write_annotator_report write the agreement as CSV.
+"""
+from __future__ import print_function
+from __future__ import division
+import os
+import csv
+
+import numpy as np
+
+from annotation_io import format_header, format_row
+from annotation_arrays import load_annotations, latest_rows
+from landmark_schemes import load_scheme
+from output_shards import OUTPUT_CACHES
+
+# Images compared at once; small enough that the (images, pairs, K) temporaries of a chunk stay in the CPU cache
+CHUNK_IMAGES = 256
+
+# First line of a consensus output, so writing the consensus again may replace it
+CONSENSUS_MARKER = '# consensus of annotators'
+
+
+class Agreement(object):
+    """
+    Agreement - Class
+
+    Result of compare_annotators. Per image compared, in the order the images first appear in the outputs:
+      img_paths         image path (as written by the first annotator who annotated it)
+      annotators        (M,) number of annotators who annotated it
+      image_nme         (M,) mean NME of all pairs of its annotators (NaN if no pair labeled a common landmark)
+      worst_pair        (M, 2) the annotators (0-based, in the order of output_paths) of its largest pair NME
+      worst_landmark    (M,) the landmark (0-based) with the largest mean distance over the pairs
+      consensus         (M, K, 2) float32 median shape, NaN where nobody labeled a landmark
+    and aggregated over all images:
+      landmark_nme      (K,) mean NME of every landmark over all pairs that labeled it
+      annotator_nme     (A,) mean NME of every annotator against the consensus of the images it annotated
+      annotator_images  (A,) number of compared images every annotator annotated
+      pair_nme          (A, A) mean NME of every pair of annotators over the images both annotated (symmetric,
+                        NaN on the diagonal and for pairs without a common image)
+      pair_images       (A, A) number of images every pair annotated
+    single_images is the number of images only one annotator annotated, which are not compared.
+
+    Functions:
+    __init__: Requires the output paths and the number of landmarks; the arrays are filled by compare_annotators.
+    """
+
+    def __init__(self, output_paths, number_of_landmarks):
+        annotators = len(output_paths)
+        self.output_paths = list(output_paths)
+        self.img_paths = []
+        self.annotators = np.empty(0, dtype=np.int64)
+        self.image_nme = np.empty(0)
+        self.worst_pair = np.empty((0, 2), dtype=np.int64)
+        self.worst_landmark = np.empty(0, dtype=np.int64)
+        self.consensus = np.empty((0, number_of_landmarks, 2), dtype=np.float32)
+        self.landmark_nme = np.full(number_of_landmarks, np.nan)
+        self.annotator_nme = np.full(annotators, np.nan)
+        self.annotator_images = np.zeros(annotators, dtype=np.int64)
+        self.pair_nme = np.full((annotators, annotators), np.nan)
+        self.pair_images = np.zeros((annotators, annotators), dtype=np.int64)
+        self.single_images = 0
+
+
+def join_outputs(output_paths, number_of_landmarks):
+    """
+    Joins the latest rows of the outputs on the image path. Returns (img_paths, table, landmarks): the path of
+    every image in any output, the (images, outputs) int64 table of the row of its latest annotation in every
+    output (-1 for none), and the (N, K, 2) landmarks array of every output.
+    """
+    positions = {}
+    img_paths = []
+    columns = []
+    all_landmarks = []
+    for output_path in output_paths:
+        landmarks, paths = load_annotations(output_path, number_of_landmarks)
+        latest = latest_rows(paths)
+        position = np.empty(len(latest), dtype=np.int64)
+        for i, (key, row) in enumerate(latest.items()):
+            image = positions.get(key)
+            if image is None:
+                image = positions[key] = len(img_paths)
+                img_paths.append(str(paths[row]))
+            position[i] = image
+        columns.append((position, np.fromiter(latest.values(), dtype=np.int64, count=len(latest))))
+        all_landmarks.append(landmarks)
+
+    table = np.full((len(img_paths), len(output_paths)), -1, dtype=np.int64)
+    for annotator, (position, rows) in enumerate(columns):
+        table[position, annotator] = rows
+    return img_paths, table, all_landmarks
+
+
+def nan_median(values, axis):
+    """Median along axis ignoring NaN (NaN where all are NaN), without the per-slice loop of np.nanmedian."""
+    ordered = np.sort(values, axis=axis)
+    count = (~np.isnan(values)).sum(axis=axis, keepdims=True)
+    low = np.take_along_axis(ordered, np.maximum(count - 1, 0) // 2, axis=axis)
+    high = np.take_along_axis(ordered, count // 2, axis=axis)
+    return np.squeeze((low + high) / 2, axis=axis)
+
+
+def shape_scale(shapes, interocular):
+    """
+    Returns the (N,) normalizing distance of an (N, K, 2) array of shapes: the distance of the interocular pair
+    (0-based, or None), or where that is unlabeled, the square root of the bounding box area. NaN for shapes
+    without any extent.
+    """
+    labeled = ~np.isnan(shapes[:, :, 0])
+    low = np.where(labeled[:, :, None], shapes, np.inf).min(axis=1)
+    high = np.where(labeled[:, :, None], shapes, -np.inf).max(axis=1)
+    with np.errstate(invalid='ignore'):
+        scale = np.sqrt(np.prod(high - low, axis=1))
+    if interocular is not None:
+        left, right = interocular
+        eyes = np.hypot(*(shapes[:, right] - shapes[:, left]).T)
+        scale = np.where(np.isnan(eyes), scale, eyes)
+    return np.where(np.isfinite(scale) & (scale > 0), scale, np.nan)
+
+
+def compare_chunk(shapes, interocular, pairs):
+    """
+    Compares the annotators of an (N, A, K, 2) float32 chunk of shapes (NaN where missing or unlabeled) over the
+    annotator pairs (two index arrays, first < second). Returns (consensus, errors, consensus_errors):
+    the (N, K, 2) median shapes, the (N, P, K) NME of every pair and landmark and the (N, A, K) NME of every
+    annotator and landmark against the consensus, NaN where not both are labeled.
+    """
+    consensus = nan_median(shapes, axis=1)
+    scale = shape_scale(consensus, interocular)[:, None, None]
+    # As complex x + iy a distance is one subtraction and one abs, on half the temporaries of separate x and y
+    points = shapes.view(np.complex64)[..., 0]
+    first, second = pairs
+    errors = np.abs(points[:, first] - points[:, second])
+    errors /= scale
+    consensus_errors = np.abs(points - consensus.view(np.complex64)[:, None, :, 0])
+    consensus_errors /= scale
+    return consensus, errors, consensus_errors
+
+
+def masked_sums(errors, axis):
+    """Returns (sum, count) of the non-NaN errors along axis."""
+    labeled = ~np.isnan(errors)
+    return np.where(labeled, errors, 0).sum(axis=axis), labeled.sum(axis=axis)
+
+
+def ratio(total, count):
+    return np.where(count > 0, total / np.maximum(count, 1), np.nan)
+
+
+def compare_annotators(output_paths, scheme=None, chunk_images=CHUNK_IMAGES):
+    """
+    Compares the latest annotations of the images annotated in two or more of the text outputs. Returns an
+    Agreement. scheme is the LandmarkScheme the outputs were annotated with (iBUG-68 by default).
+    """
+    scheme = load_scheme() if scheme is None else scheme
+    number_of_landmarks = scheme.number_of_landmarks
+    interocular = None if scheme.interocular is None else tuple(index - 1 for index in scheme.interocular)
+    agreement = Agreement(output_paths, number_of_landmarks)
+
+    img_paths, table, landmarks = join_outputs(output_paths, number_of_landmarks)
+    annotators = (table >= 0).sum(axis=1)
+    compared = np.flatnonzero(annotators >= 2)
+    agreement.single_images = int((annotators == 1).sum())
+    agreement.img_paths = [img_paths[image] for image in compared]
+    agreement.annotators = annotators[compared]
+    table = table[compared]
+
+    count = len(output_paths)
+    pairs = np.triu_indices(count, 1)
+    image_nme = np.full(len(compared), np.nan)
+    worst_pair = np.zeros(len(compared), dtype=np.int64)
+    worst_landmark = np.zeros(len(compared), dtype=np.int64)
+    consensus = np.empty((len(compared), number_of_landmarks, 2), dtype=np.float32)
+    landmark_sums = np.zeros((2, number_of_landmarks))
+    pair_sums = np.zeros((2, len(pairs[0])))
+    annotator_sums = np.zeros((2, count))
+
+    for start in range(0, len(compared), chunk_images):
+        rows = table[start:start + chunk_images]
+        shapes = np.full((len(rows), count, number_of_landmarks, 2), np.nan, dtype=np.float32)
+        for annotator in range(count):
+            present = rows[:, annotator] >= 0
+            shapes[present, annotator] = landmarks[annotator][rows[present, annotator]]
+        chunk_consensus, errors, consensus_errors = compare_chunk(shapes, interocular, pairs)
+        end = start + len(rows)
+        consensus[start:end] = chunk_consensus
+
+        # Per image: the mean over the pairs of the mean over their common landmarks
+        total, labeled = masked_sums(errors, axis=2)
+        nme = ratio(total, labeled)
+        compared_pairs = (labeled > 0).sum(axis=1)
+        image_nme[start:end] = ratio(np.nansum(nme, axis=1), compared_pairs)
+        worst_pair[start:end] = np.nan_to_num(nme, nan=-np.inf).argmax(axis=1)
+        total, labeled = masked_sums(errors, axis=1)
+        worst_landmark[start:end] = np.nan_to_num(ratio(total, labeled), nan=-np.inf).argmax(axis=1)
+
+        landmark_sums += total.sum(axis=0), labeled.sum(axis=0)
+        pair_sums += np.nansum(nme, axis=0), (~np.isnan(nme)).sum(axis=0)
+        annotator_nme = ratio(*masked_sums(consensus_errors, axis=2))
+        annotator_sums += np.nansum(annotator_nme, axis=0), (~np.isnan(annotator_nme)).sum(axis=0)
+
+    agreement.image_nme = image_nme
+    agreement.worst_pair = np.stack([pairs[0][worst_pair], pairs[1][worst_pair]], axis=1)
+    agreement.worst_landmark = worst_landmark
+    agreement.consensus = consensus
+    agreement.landmark_nme = ratio(*landmark_sums)
+    agreement.annotator_nme = ratio(*annotator_sums)
+    agreement.annotator_images = (table >= 0).sum(axis=0)
+    agreement.pair_nme[pairs] = agreement.pair_nme.T[pairs] = ratio(*pair_sums)
+    pair_images = ((table[:, pairs[0]] >= 0) & (table[:, pairs[1]] >= 0)).sum(axis=0)
+    agreement.pair_images[pairs] = agreement.pair_images.T[pairs] = pair_images
+    return agreement
+
+
+def check_consensus_path(output_path, output_paths):
+    """
+    Raises ValueError if the consensus of output_paths cannot be written to output_path: it is one of the
+    compared outputs, exists and is not an earlier consensus, or its directory does not exist. Cheap, so it is
+    called before the comparison as well.
+    """
+    if any(os.path.abspath(output_path) == os.path.abspath(path) for path in output_paths):
+        raise ValueError(f"{output_path} is one of the compared outputs; write the consensus to another file")
+    if os.path.isdir(output_path):
+        raise ValueError(f"{output_path} is a directory; write the consensus to a file")
+    if not os.path.isdir(os.path.dirname(os.path.abspath(output_path))):
+        raise ValueError(f"The directory of {output_path} does not exist; write the consensus to another file")
+    if os.path.exists(output_path) and os.path.getsize(output_path):
+        with open(output_path, 'r', encoding='utf-8') as f:
+            if not f.readline().startswith(CONSENSUS_MARKER):
+                raise ValueError(f"{output_path} has annotations that are not a consensus; write the consensus "
+                                 f"to another file")
+
+
+def write_consensus(output_path, agreement):
+    """
+    Writes the consensus shapes of an Agreement as a text output, replacing output_path. Raises ValueError if
+    check_consensus_path rejects output_path.
+    """
+    check_consensus_path(output_path, agreement.output_paths)
+
+    header = format_header(agreement.consensus.shape[1])
+    # Converted to int as a whole. A complete row is its x, y, x, y, ... joined, the same as format_row writes
+    # it; only the rows with unlabeled landmarks go through format_row.
+    labeled = ~np.isnan(agreement.consensus[:, :, 0])
+    complete = labeled.all(axis=1).tolist()
+    shapes = np.rint(np.nan_to_num(agreement.consensus)).astype(np.int64).reshape(len(labeled), -1)
+    tmp_path = output_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(f"{CONSENSUS_MARKER}: {', '.join(agreement.output_paths)}\n")
+        for image, (img_path, shape) in enumerate(zip(agreement.img_paths, shapes.tolist())):
+            f.write(header + '\n')
+            if complete[image]:
+                f.write(img_path + ',' + ','.join(map(str, shape)) + '\n')
+                continue
+            coords_list = [None] + [(shape[2 * k], shape[2 * k + 1]) if present else None
+                                    for k, present in enumerate(labeled[image].tolist())]
+            f.write(format_row(img_path, coords_list) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, output_path)
+
+    for suffix in OUTPUT_CACHES:
+        if os.path.exists(output_path + suffix):
+            os.remove(output_path + suffix)
+
+
+def annotator_names(agreement):
+    return [os.path.basename(path) for path in agreement.output_paths]
+
+
+def format_nme(value):
+    return '' if np.isnan(value) else f"{value:.4f}"
+
+
+def write_image_report(report_path, agreement):
+    """Writes the NME of every compared image as CSV, worst first: image, annotators, nme, pair and landmark."""
+    names = annotator_names(agreement)
+    order = np.argsort(-np.nan_to_num(agreement.image_nme, nan=-np.inf), kind='stable')
+    with open(report_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['rank', 'image', 'annotators', 'nme', 'worst_pair', 'worst_landmark'])
+        for rank, image in enumerate(order.tolist(), 1):
+            first, second = agreement.worst_pair[image]
+            writer.writerow([rank, agreement.img_paths[image], agreement.annotators[image],
+                             format_nme(agreement.image_nme[image]), f"{names[first]} / {names[second]}",
+                             agreement.worst_landmark[image] + 1])
+
+
+def write_landmark_report(report_path, agreement):
+    """Writes the NME of every landmark as CSV."""
+    with open(report_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['landmark', 'nme'])
+        for landmark, nme in enumerate(agreement.landmark_nme.tolist(), 1):
+            writer.writerow([landmark, format_nme(nme)])
+
+
+def write_annotator_report(report_path, agreement):
+    """
+    Writes one CSV row per annotator: images compared, NME against the consensus and the NME against every
+    other annotator (one column each).
+    """
+    names = annotator_names(agreement)
+    with open(report_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['annotator', 'images', 'nme_consensus'] + [f"nme_{name}" for name in names])
+        for annotator, path in enumerate(agreement.output_paths):
+            writer.writerow([path, agreement.annotator_images[annotator],
+                             format_nme(agreement.annotator_nme[annotator])]
+                            + [format_nme(nme) for nme in agreement.pair_nme[annotator]])
@@ -0,0 +1,232 @@
+"""
+NumPy loader for the text annotation output
+
+load_annotations turns landmark_output.txt into arrays for training code:
+  landmarks  (N, K, 2) float32, x and y of every landmark of every row, NaN where unlabeled
+  paths      (N,) str, the image path of every row
+in the order of the rows in the file (an image annotated twice has two rows; the last one is its latest).
+
+Parsing is vectorized over chunks of the file. Every missing "(-1,-1)" is collapsed to -1 first, so a data
+row always ends in 2 * K numbers. The positions of all newlines and commas of a chunk then give, per row, where
+its path ends (at the 2K-th comma from the end of the line) without scanning the rows in Python, and the
+number fields of all rows are joined and converted by a single np.fromstring call. Header lines
+and comments are dropped by their first bytes, and pairs of -1 become NaN.
+
+AnnotationArrays caches the result next to the output:
+  <output>.landmarks.npy, <output>.paths.npy   the arrays, opened memory-mapped
+  <output>.arrays.json                         number of rows and output offset they cover
+Opening the cache maps the arrays and only parses the bytes appended to the output since then, appending
+their rows to the .npy files in place. The .npy headers leave room for the row count to grow, so nothing is
+rewritten except when a longer path than any before widens the paths array. A cache of another landmark
+scheme, or of an output that shrank (was truncated or replaced), is rebuilt from scratch.
+"""
+from __future__ import print_function
+from __future__ import division
+import os
+import json
+import struct
+
+import numpy as np
+
+from annotation_io import NUMBER_OF_LANDMARKS, MISSING, HEADER_PREFIX, image_key
+
+# Bytes of the output parsed at once
+CHUNK_BYTES = 32 * 1024 * 1024
+
+# Fixed size of the .npy headers written here, so the row count can grow in place
+HEADER_BYTES = 128
+
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+
+
+def parse_chunk(data, number_of_landmarks=NUMBER_OF_LANDMARKS):
+    """Returns (paths, landmarks) for the data rows in data, a bytes object of complete lines."""
+    data = data.replace(b',' + MISSING.encode('ascii'), b',-1').replace(b'\r', b'')
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(buffer == ord('\n'))
+    starts = np.concatenate(([0], ends[:-1] + 1))
+
+    # Drop blank lines, comments and the repeated header lines
+    first = buffer[np.minimum(starts, len(buffer) - 1)]
+    keep = (ends > starts) & (first != ord('#'))
+    header = HEADER_PREFIX.encode('ascii')
+    heads = buffer[np.minimum(starts[:, None] + np.arange(len(header)), len(buffer) - 1)]
+    keep &= ~(heads == np.frombuffer(header, dtype=np.uint8)).all(axis=1)
+    starts = starts[keep]
+    ends = ends[keep]
+    if not len(starts):
+        return [], np.empty((0, number_of_landmarks, 2), dtype=np.float32)
+
+    # The numbers of a row are its last 2 * K fields, so its path ends at the 2K-th comma from its end
+    commas = np.flatnonzero(buffer == ord(','))
+    path_ends = np.searchsorted(commas, ends) - 2 * number_of_landmarks
+    if (path_ends < 0).any() or (commas[path_ends] < starts).any():
+        raise ValueError(f"rows with fewer than {2 * number_of_landmarks} values")
+    path_ends = commas[path_ends]
+
+    starts = starts.tolist()
+    path_ends = path_ends.tolist()
+    numbers = b','.join([data[path_end + 1:end] for path_end, end in zip(path_ends, ends.tolist())])
+    # Coordinates are integers, which np.fromstring parses several times faster than floats
+    values = np.fromstring(numbers, dtype=np.int32, sep=',')
+    if values.size != len(starts) * number_of_landmarks * 2:
+        raise ValueError("rows with values that are not integers")
+
+    paths = [data[start:path_end].decode('utf-8') for start, path_end in zip(starts, path_ends)]
+    landmarks = values.reshape(len(starts), number_of_landmarks, 2).astype(np.float32)
+    landmarks[(landmarks == -1).all(axis=2)] = np.nan
+    return paths, landmarks
+
+
+def iter_chunks(f, offset=0, chunk_bytes=CHUNK_BYTES):
+    """Yields (end_offset, data) for chunks of complete lines of a binary file object, starting at offset."""
+    f.seek(offset)
+    tail = b''
+    while True:
+        data = f.read(chunk_bytes)
+        if not data:
+            # A row still being written is left for the next load
+            break
+        data = tail + data
+        end = data.rfind(b'\n') + 1
+        tail = data[end:]
+        if end:
+            offset += end
+            yield offset, data[:end]
+
+
+def write_npy_header(f, dtype, shape):
+    header = repr({'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)), 'fortran_order': False,
+                   'shape': tuple(shape)})
+    header = header.ljust(HEADER_BYTES - len(NPY_MAGIC) - 3) + '\n'
+    f.seek(0)
+    f.write(NPY_MAGIC + struct.pack('<H', len(header)) + header.encode('latin1'))
+
+
+def append_npy(path, array, rows):
+    """Appends array to the .npy file at path, which keeps its first rows rows."""
+    row_bytes = array.dtype.itemsize * int(np.prod(array.shape[1:]))
+    with open(path, 'r+b' if os.path.exists(path) else 'w+b') as f:
+        f.seek(HEADER_BYTES + rows * row_bytes)
+        f.truncate()
+        f.write(np.ascontiguousarray(array).tobytes())
+        write_npy_header(f, array.dtype, (rows + len(array),) + array.shape[1:])
+
+
+def load_annotations(output_path, number_of_landmarks=NUMBER_OF_LANDMARKS, cache=True):
+    """
+    Returns (landmarks, paths) for a text output, see the module docstring. With cache, they are memory-mapped
+    from the cache next to the output, which is brought up to date first.
+    """
+    if cache:
+        arrays = AnnotationArrays(output_path, number_of_landmarks)
+        return arrays.landmarks, arrays.paths
+
+    all_paths = []
+    all_landmarks = []
+    with open(output_path, 'rb') as f:
+        for offset, data in iter_chunks(f):
+            paths, landmarks = parse_chunk(data, number_of_landmarks)
+            all_paths.extend(paths)
+            all_landmarks.append(landmarks)
+    landmarks = np.concatenate(all_landmarks) if all_landmarks else np.empty((0, number_of_landmarks, 2),
+                                                                            dtype=np.float32)
+    return landmarks, np.array(all_paths, dtype=str)
+
+
+def latest_rows(paths):
+    """
+    Returns {image key: row} with the last row of every image in paths (the paths array of load_annotations),
+    in the order the images first appear.
+    """
+    return dict(zip(map(image_key, paths.tolist()), range(len(paths))))
+
+
+class AnnotationArrays(object):
+    """
+    AnnotationArrays - Class
+
+    Memory-mapped array cache of a text annotation output, kept up to date incrementally.
+
+    Functions:
+    __init__: Requires the path of the text output. number_of_landmarks must match the landmark scheme of the
+    output. Opens the cache and refreshes it.
+
+    refresh: Parses the rows appended to the output since the last refresh, appends them to the cache and
+    maps the arrays again.
+
+    landmarks: (N, K, 2) float32 array, NaN where unlabeled. Read-only.
+
+    paths: (N,) array of image paths. Read-only.
+    """
+
+    def __init__(self, output_path, number_of_landmarks=NUMBER_OF_LANDMARKS):
+        self.output_path = output_path
+        self.number_of_landmarks = number_of_landmarks
+        self.landmarks_path = output_path + '.landmarks.npy'
+        self.paths_path = output_path + '.paths.npy'
+        self.meta_path = output_path + '.arrays.json'
+
+        self.offset = 0
+        self.rows = 0
+        self.width = 1
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r') as f:
+                meta = json.load(f)
+            output_size = os.path.getsize(output_path) if os.path.exists(output_path) else 0
+            if (meta['landmarks'] == number_of_landmarks and meta['offset'] <= output_size
+                    and self.cached_bytes(self.landmarks_path, number_of_landmarks * 2 * 4, meta['rows'])
+                    and self.cached_bytes(self.paths_path, meta['width'] * 4, meta['rows'])):
+                self.offset = meta['offset']
+                self.rows = meta['rows']
+                self.width = meta['width']
+
+        self.landmarks = None
+        self.paths = None
+        self.refresh()
+
+    @staticmethod
+    def cached_bytes(path, row_bytes, rows):
+        return os.path.exists(path) and os.path.getsize(path) >= HEADER_BYTES + rows * row_bytes
+
+    def refresh(self):
+        if os.path.exists(self.output_path) and os.path.getsize(self.output_path) > self.offset:
+            offset = self.offset
+            rows = self.rows
+            with open(self.output_path, 'rb') as f:
+                for offset, data in iter_chunks(f, self.offset):
+                    paths, landmarks = parse_chunk(data, self.number_of_landmarks)
+                    if not paths:
+                        continue
+                    self.append_paths(paths, rows)
+                    append_npy(self.landmarks_path, landmarks, rows)
+                    rows += len(paths)
+
+            # The arrays are written before the offset covering them, so a crash in between only re-parses
+            self.offset = offset
+            self.rows = rows
+            tmp_path = self.meta_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'landmarks': self.number_of_landmarks, 'offset': self.offset, 'rows': self.rows,
+                           'width': self.width}, f)
+            os.replace(tmp_path, self.meta_path)
+
+        self.landmarks = self.map(self.landmarks_path, np.float32, (self.number_of_landmarks, 2))
+        self.paths = self.map(self.paths_path, f"<U{self.width}", ())
+
+    def append_paths(self, paths, rows):
+        paths = np.array(paths, dtype=str)
+        width = paths.dtype.itemsize // 4
+        if width > self.width:
+            # The new rows have a longer path than the cached ones; rewrite the cache at the new width
+            cached = self.map(self.paths_path, f"<U{self.width}", (), rows).astype(f"<U{width}")
+            self.width = width
+            append_npy(self.paths_path, cached, 0)
+        append_npy(self.paths_path, paths.astype(f"<U{self.width}"), rows)
+
+    def map(self, path, dtype, row_shape, rows=None):
+        # The row count comes from the metadata: rows past it are from an interrupted refresh
+        rows = self.rows if rows is None else rows
+        if not rows:
+            return np.empty((0,) + row_shape, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r', offset=HEADER_BYTES, shape=(rows,) + row_shape)
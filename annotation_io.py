@@ -0,0 +1,239 @@
+"""
+Annotation output for the Face-Annotation-Tool
+
+The text output format (landmark_output.txt) is one header line followed by one row per annotated image:
+  image_name,x_0,...,x_67,y_0,...,y_67
+  <img_path>,<x_1>,<y_1>,<x_2>,<y_2>,...,<x_68>,<y_68>
+Note that the rows hold interleaved x,y pairs, and that a landmark without a label is written as
+"(-1,-1),(-1,-1)". The header line is repeated before every row. Lines starting with '#' are comments, like
+the timestamps of the output shards in output_shards.py. This is the default 68 point layout; with
+another landmark scheme (see landmark_schemes.py) the header and rows have that scheme's number of points, and
+the readers below take it as number_of_landmarks.
+
+format_header / format_row produce these lines from a coords_list as kept by InteractiveViewer, parse_row and
+parse_path read them back and iter_rows streams the data rows of an output file.
+
+TextAnnotationWriter appends annotations to an open text file in this format. It shares its interface
+(write, flush, close) with SQLiteAnnotationStore in annotation_store.py, so either can be the viewer's output.
+
+ResumeIndex is the set of images that already have a row in a text output, used by --resume. It is cached
+next to the output and extended incrementally, so the output itself is only read where it grew.
+
+SkipList is the set of images skipped in the viewer, kept in <output>.skipped.
+"""
+from __future__ import print_function
+from __future__ import division
+import os
+
+NUMBER_OF_LANDMARKS = 68
+
+HEADER_PREFIX = 'image_name,'
+
+HEADER = (HEADER_PREFIX
+          + ','.join(f"x_{i}" for i in range(NUMBER_OF_LANDMARKS)) + ','
+          + ','.join(f"y_{i}" for i in range(NUMBER_OF_LANDMARKS)))
+
+MISSING = '(-1,-1)'
+
+
+def format_header(number_of_landmarks=NUMBER_OF_LANDMARKS):
+    if number_of_landmarks == NUMBER_OF_LANDMARKS:
+        return HEADER
+    return (HEADER_PREFIX
+            + ','.join(f"x_{i}" for i in range(number_of_landmarks)) + ','
+            + ','.join(f"y_{i}" for i in range(number_of_landmarks)))
+
+
+def format_row(img_path, coords_list):
+    fields = [img_path]
+    for coords in coords_list[1:]:
+        if coords is None:
+            fields.extend((MISSING, MISSING))
+        else:
+            fields.extend((str(coords[0]), str(coords[1])))
+    return ','.join(fields)
+
+
+def parse_path(line, number_of_landmarks=NUMBER_OF_LANDMARKS):
+    # Rows end in 2 * number_of_landmarks numeric fields once every missing "(-1,-1)" is collapsed into a single
+    # field; the path is whatever precedes them, so paths containing commas survive
+    return line.rstrip('\r\n').replace(',' + MISSING, ',-1').rsplit(',', 2 * number_of_landmarks)[0]
+
+
+def parse_row(line, number_of_landmarks=NUMBER_OF_LANDMARKS):
+    """Returns (img_path, landmarks) for a data row; landmarks is a list of (x, y) tuples, None if unlabeled."""
+    fields = line.rstrip('\r\n').replace(',' + MISSING, ',-1').rsplit(',', 2 * number_of_landmarks)
+    values = [int(value) for value in fields[1:]]
+    landmarks = [None if (x, y) == (-1, -1) else (x, y) for x, y in zip(values[0::2], values[1::2])]
+    return fields[0], landmarks
+
+
+def iter_rows(f, offset=0):
+    """Yields (end_offset, row) for the complete data rows of a binary file object, starting at offset."""
+    f.seek(offset)
+    for line in f:
+        if not line.endswith(b'\n'):
+            # A row still being written; it is picked up on the next scan
+            break
+        offset += len(line)
+        row = line.decode('utf-8')
+        if not row.strip() or row.startswith(HEADER_PREFIX) or row.startswith('#'):
+            continue
+        yield offset, row
+
+
+def image_key(img_path):
+    return os.path.normpath(img_path)
+
+
+class TextAnnotationWriter(object):
+    """
+    TextAnnotationWriter - Class
+
+    Appends annotations to a text file in the landmark_output.txt format.
+
+    Functions:
+    __init__: Requires an open, writable file object. If a ResumeIndex is given, every written image is added
+    to it.
+
+    write: Writes the header line and the row for one image, and flushes it to the file.
+
+    flush: Flushes the file. Rows are flushed as they are written; this is for callers that batch writes,
+    like the work server.
+
+    close: Closes the file (and the index).
+    """
+
+    def __init__(self, f, index=None):
+        self.f = f
+        self.index = index
+
+    def write(self, img_path, coords_list):
+        self.f.write(format_header(len(coords_list) - 1) + '\n')
+        self.f.write(format_row(img_path, coords_list) + '\n')
+        self.f.flush()
+
+        if self.index is not None:
+            self.index.add(img_path, self.f.tell())
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+        if self.index is not None:
+            self.index.close()
+
+
+class ResumeIndex(object):
+    """
+    ResumeIndex - Class
+
+    Hash set of the image paths that have a row in a text output file.
+
+    The set is cached in <output>.idx, an append-only file of "<offset>\t<path>" lines where offset is the
+    position in the output just past that image's row. Opening the index reads the cache and then only the
+    part of the output after the last cached offset. If the output is shorter than that offset (it was
+    truncated or replaced), the cache is rebuilt from scratch.
+
+    Functions:
+    __init__: Requires the path of the text output. index_path overrides the cache location, and
+    number_of_landmarks must match the landmark scheme of the output.
+
+    __contains__: Returns True if the image already has a row. Paths are compared after os.path.normpath.
+
+    add: Records an image whose row ends at offset in the output. Used by TextAnnotationWriter.
+
+    close: Closes the cache file.
+    """
+
+    def __init__(self, output_path, index_path=None, number_of_landmarks=NUMBER_OF_LANDMARKS):
+        self.output_path = output_path
+        self.index_path = output_path + '.idx' if index_path is None else index_path
+        self.done = set()
+        self.offset = 0
+
+        if os.path.exists(self.index_path):
+            valid_bytes = 0
+            with open(self.index_path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    valid_bytes += len(line)
+                    offset, _, img_path = line.decode('utf-8').rstrip('\n').partition('\t')
+                    self.done.add(img_path)
+                    self.offset = int(offset)
+            if os.path.getsize(self.index_path) > valid_bytes:
+                # Torn last line of a crashed session; the output scan below recovers that image
+                os.truncate(self.index_path, valid_bytes)
+
+        output_size = os.path.getsize(output_path) if os.path.exists(output_path) else 0
+        if output_size < self.offset:
+            self.done = set()
+            self.offset = 0
+            os.remove(self.index_path)
+
+        self.f = open(self.index_path, 'a', encoding='utf-8')
+        if output_size > self.offset:
+            with open(output_path, 'rb') as output:
+                for offset, row in iter_rows(output, self.offset):
+                    self.add(parse_path(row, number_of_landmarks), offset)
+            self.f.flush()
+
+    def __contains__(self, img_path):
+        return image_key(img_path) in self.done
+
+    def __len__(self):
+        return len(self.done)
+
+    def add(self, img_path, offset):
+        key = image_key(img_path)
+        self.done.add(key)
+        self.offset = offset
+        self.f.write(f"{offset}\t{key}\n")
+
+    def close(self):
+        self.f.close()
+
+
+class SkipList(object):
+    """
+    SkipList - Class
+
+    Hash set of the images skipped in the viewer, kept in an append-only file of one path per line.
+
+    Functions:
+    __init__: Requires the path of the skip file, which is read if it exists.
+
+    __contains__: Returns True if the image was skipped. Paths are compared after os.path.normpath.
+
+    add: Records a skipped image.
+
+    close: Closes the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.skipped = set()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.endswith('\n'):
+                        self.skipped.add(line[:-1])
+        self.f = open(path, 'a', encoding='utf-8')
+
+    def __contains__(self, img_path):
+        return image_key(img_path) in self.skipped
+
+    def __len__(self):
+        return len(self.skipped)
+
+    def add(self, img_path):
+        key = image_key(img_path)
+        if key not in self.skipped:
+            self.skipped.add(key)
+            self.f.write(key + '\n')
+            self.f.flush()
+
+    def close(self):
+        self.f.close()
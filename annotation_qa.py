@@ -0,0 +1,218 @@
+"""
+Outlier detection over all annotations of a text output
+
+find_suspects checks the latest annotation of every image in the output and ranks the ones that are probably
+wrong, worst first:
+  mirrored   the shape fits the mean shape far better reflected than rotated: left and right are swapped
+             throughout (or the landmarks were placed on a mirrored image)
+  swapped    left/right landmark pairs of the scheme (e.g. the two eyes) in the wrong order
+  origin     landmarks at (0, 0), dropped there instead of on the face
+  outlier    a landmark much farther from the mean shape than that landmark usually is
+  missing    landmarks left unlabeled, "(-1,-1)"
+
+The annotations are loaded with load_annotations, memory-mapped, and scored in chunks of CHUNK_ROWS rows, so
+memory use does not grow with the output. The mean shape is the Procrustes mean (shape_model.procrustes_mean)
+of a sample of the complete shapes, made robust by taking the median of the aligned shapes. Every shape is
+then aligned to the mean by the similarity transform that fits its usable landmarks best. In 2-D that fit
+is closed-form: with the centered points as complex numbers x and m, the rotation and scale are
+sum(conj(x) m) / sum(|x|^2), and the best reflection comes from sum(x m) the same way. All of this is
+vectorized over the chunk, without a per-row SVD. A landmark's residual is its distance from the mean after
+alignment, and it counts as an outlier when its robust z-score (median and MAD of that landmark's residuals
+in the sample) exceeds the threshold.
+"""
+from __future__ import print_function
+from __future__ import division
+import csv
+
+import numpy as np
+
+from annotation_arrays import load_annotations, latest_rows
+from landmark_schemes import load_scheme
+from shape_model import procrustes_mean, normalize_shapes, complete_shapes
+
+# Rows scored at once; every row takes a few kB in the temporaries of a chunk
+CHUNK_ROWS = 16384
+
+# Complete shapes the mean shape and the residual statistics are learned from
+SAMPLE_ROWS = 20000
+
+# Robust z-score above which a landmark residual is an outlier
+RESIDUAL_THRESHOLD = 8.0
+
+# A shape is mirrored if its best reflection leaves less than this fraction of the error of its best rotation
+MIRROR_RATIO = 0.25
+
+# A similarity transform fits any two points exactly; fewer usable landmarks than this are not aligned
+MIN_FIT_POINTS = 3
+
+# Suspects are ranked by their most severe finding first, then by the largest residual z-score
+SEVERITY = {'mirrored': 4, 'swapped': 3, 'origin': 3, 'outlier': 2, 'missing': 1}
+
+# MAD times this estimates the standard deviation of normally distributed values
+MAD_SCALE = 1.4826
+
+
+def labeled_landmarks(shapes):
+    """Returns the (N, K) masks of the labeled landmarks of an (N, K, 2) array and of those at the origin."""
+    # Unlabeled landmarks are NaN in x and y alike
+    x, y = shapes[:, :, 0], shapes[:, :, 1]
+    return ~np.isnan(x), (x == 0) & (y == 0)
+
+
+def as_complex(points):
+    """Returns the (..., K) complex x + iy of a (..., K, 2) float64 array, a view where the array allows it."""
+    return np.ascontiguousarray(points, dtype=np.float64).view(np.complex128)[..., 0]
+
+
+def fit_shapes(shapes, mean, pairs):
+    """
+    Fits the normalized (K, 2) mean shape to every shape of an (N, K, 2) array by the similarity transform that
+    fits its usable landmarks (labeled and not at the origin) best, and compares them.
+
+    Returns (residuals, fitted, mirrored, swapped): the (N, K) distance of every usable landmark from the mean
+    after alignment (NaN for the others), whether a shape had MIN_FIT_POINTS usable landmarks to be aligned
+    with, whether a reflection fits it MIRROR_RATIO times better than any rotation, and the number of its
+    (left, right) landmark pairs (0-based (P, 2) array) that are the wrong way round.
+    """
+    labeled, origin = labeled_landmarks(shapes)
+    usable = labeled & ~origin
+    weights = usable.astype(np.float64)
+    count = weights.sum(axis=1)
+    reference = as_complex(mean)
+    # Unusable landmarks are 0, so sums over all landmarks are sums over the usable ones
+    points = np.where(usable, as_complex(shapes), 0)
+
+    # The shape and the mean are centered on the same landmarks. The centered sums follow from the raw ones,
+    # e.g. sum(conj(x - xc) (m - mc)) = sum(conj(x) m) - n conj(xc) mc, so no centered copy is made.
+    n = np.maximum(count, 1)
+    x_center = points.sum(axis=1) / n
+    m_center = as_complex(weights @ mean) / n
+    x_norm = np.einsum('nk,nk->n', points.view(np.float64), points.view(np.float64)) - n * np.abs(x_center) ** 2
+    m_norm = weights @ (mean ** 2).sum(axis=1) - n * np.abs(m_center) ** 2
+    fitted = (count >= MIN_FIT_POINTS) & (x_norm > 0)
+    x_norm = np.where(fitted, x_norm, 1)
+
+    # Rotation and scale z -> a z, and reflection z -> b conj(z), each least squares
+    a = (np.conj(points @ np.conj(reference)) - n * np.conj(x_center) * m_center) / x_norm
+    b = (points @ reference - n * x_center * m_center) / x_norm
+    rotated_error = m_norm - np.abs(a) ** 2 * x_norm
+    reflected_error = m_norm - np.abs(b) ** 2 * x_norm
+    mirrored = fitted & (reflected_error < MIRROR_RATIO * rotated_error)
+
+    # Residual of landmark k: |a (x_k - xc) + mc - m_k|, computed in place
+    usable &= fitted[:, None]
+    residuals = points * a[:, None]
+    residuals += (m_center - a * x_center)[:, None]
+    residuals -= reference
+    residuals = np.abs(residuals)
+    residuals[~usable] = np.nan
+
+    # A pair is swapped when its vector from left to right, aligned, points against the mean's
+    left, right = pairs[:, 0], pairs[:, 1]
+    expected = np.conj(reference[right] - reference[left])
+    swapped = (((points[:, right] - points[:, left]) * expected * a[:, None]).real < 0)
+    swapped &= usable[:, left] & usable[:, right]
+    return residuals, fitted, mirrored, swapped.sum(axis=1)
+
+
+def shape_statistics(landmarks, rows, sample_rows=SAMPLE_ROWS):
+    """
+    Learns the mean shape and the median and MAD of every landmark's residual from up to sample_rows of the
+    given rows, evenly spread. Returns (mean, median, mad), or None without three complete shapes.
+    """
+    sample = landmarks[rows[np.linspace(0, len(rows) - 1, min(len(rows), sample_rows)).astype(np.int64)]]
+    sample = sample.astype(np.float64)
+    shapes = complete_shapes(sample)
+    if len(shapes) < 3:
+        return None
+
+    mean, aligned = procrustes_mean(shapes)
+    # The median shape is not pulled off by the bad annotations of the sample
+    mean = normalize_shapes(np.median(aligned, axis=0)[None])[0]
+
+    residuals, fitted, mirrored, swapped = fit_shapes(sample, mean, np.empty((0, 2), dtype=np.int64))
+    residuals = residuals[fitted & ~mirrored]
+    median = np.nanmedian(residuals, axis=0)
+    mad = np.nanmedian(np.abs(residuals - median), axis=0)
+    return mean, median, np.maximum(mad, 1e-9)
+
+
+def score_chunk(shapes, statistics, pairs, threshold):
+    """
+    Checks an (N, K, 2) chunk of shapes. Returns (findings, score): a list of (row in chunk, finding, detail)
+    and the (N,) largest residual z-score of every row (0 where none was computed).
+    """
+    findings = []
+    labeled, origin = labeled_landmarks(shapes)
+    missing = (~labeled).sum(axis=1)
+    origin = origin.sum(axis=1)
+    score = np.zeros(len(shapes))
+
+    if statistics is not None:
+        mean, median, mad = statistics
+        residuals, fitted, mirrored, swapped = fit_shapes(shapes, mean, pairs)
+        z = np.nan_to_num((residuals - median) / (MAD_SCALE * mad), nan=-np.inf)
+        worst = z.argmax(axis=1)
+        score = np.maximum(z[np.arange(len(z)), worst], 0)
+
+        for row in np.flatnonzero(mirrored):
+            findings.append((row, 'mirrored', ''))
+        for row in np.flatnonzero(~mirrored & (swapped > 0)):
+            findings.append((row, 'swapped', f"{swapped[row]} pairs"))
+        for row in np.flatnonzero(score > threshold):
+            findings.append((row, 'outlier', f"landmark {worst[row] + 1}, z={score[row]:.1f}"))
+
+    for row in np.flatnonzero(origin):
+        findings.append((row, 'origin', f"{origin[row]} landmarks"))
+    for row in np.flatnonzero(missing):
+        findings.append((row, 'missing', f"{missing[row]} landmarks"))
+    return findings, score
+
+
+def find_suspects(output_path, scheme=None, threshold=RESIDUAL_THRESHOLD, chunk_rows=CHUNK_ROWS,
+                  sample_rows=SAMPLE_ROWS):
+    """
+    Checks the latest annotation of every image in a text output. Returns (suspects, checked): the ranked list
+    of (img_path, score, findings) of the images with any finding, where findings is a list of (finding,
+    detail), and the number of images checked.
+
+    scheme is the LandmarkScheme the output was annotated with (iBUG-68 by default).
+    """
+    scheme = load_scheme() if scheme is None else scheme
+    landmarks, paths = load_annotations(output_path, scheme.number_of_landmarks)
+    latest = latest_rows(paths)
+    rows = np.fromiter(sorted(latest.values()), dtype=np.int64, count=len(latest))
+    if not len(rows):
+        return [], 0
+
+    statistics = shape_statistics(landmarks, rows, sample_rows)
+    pairs = np.array(scheme.symmetry, dtype=np.int64).reshape(-1, 2) - 1
+
+    findings = {}
+    scores = {}
+    for start in range(0, len(rows), chunk_rows):
+        chunk = rows[start:start + chunk_rows]
+        chunk_findings, score = score_chunk(landmarks[chunk].astype(np.float64), statistics, pairs, threshold)
+        for row, finding, detail in chunk_findings:
+            findings.setdefault(chunk[row], []).append((finding, detail))
+            scores[chunk[row]] = score[row]
+
+    suspects = []
+    for row, row_findings in findings.items():
+        row_findings.sort(key=lambda finding: -SEVERITY[finding[0]])
+        suspects.append((str(paths[row]), float(scores[row]), row_findings))
+    suspects.sort(key=lambda suspect: (-SEVERITY[suspect[2][0][0]], -suspect[1]))
+    return suspects, len(rows)
+
+
+def format_findings(findings):
+    return '; '.join(f"{finding} ({detail})" if detail else finding for finding, detail in findings)
+
+
+def write_report(report_path, suspects):
+    """Writes the ranked suspects of find_suspects as CSV: rank, image, score and findings."""
+    with open(report_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['rank', 'image', 'score', 'findings'])
+        for rank, (img_path, score, findings) in enumerate(suspects, 1):
+            writer.writerow([rank, img_path, f"{score:.2f}", format_findings(findings)])
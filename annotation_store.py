@@ -0,0 +1,170 @@
+"""
+Indexed SQLite annotation store for the Face-Annotation-Tool
+
+An alternative to landmark_output.txt that can be queried without re-parsing the whole output. The
+database runs in WAL mode, so readers (e.g. a QA script) never block the annotator writing to it.
+
+Tables:
+  sessions:    one row per annotation session (start time, host, pid)
+  images:      one row per image path, pointing at its latest annotation
+  annotations: one row per saved annotation of an image
+  landmarks:   one row per landmark of an annotation; unlabeled landmarks have NULL coordinates
+
+All lookups below go through an index (B-tree, O(log n)):
+  is_annotated(path)        images.path (unique)
+  latest(path)              images.path, then annotations/landmarks primary keys
+  missing_landmark(k)       partial index on landmarks(landmark) for unlabeled landmarks
+  annotated_since(t)        annotations.created
+"""
+from __future__ import print_function
+from __future__ import division
+import os
+import time
+import socket
+import sqlite3
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    host TEXT,
+    pid INTEGER
+);
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    latest_annotation_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS images_latest_annotation ON images (latest_annotation_id);
+CREATE TABLE IF NOT EXISTS annotations (
+    id INTEGER PRIMARY KEY,
+    image_id INTEGER NOT NULL REFERENCES images (id),
+    session_id INTEGER REFERENCES sessions (id),
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS annotations_image ON annotations (image_id, created);
+CREATE INDEX IF NOT EXISTS annotations_created ON annotations (created);
+CREATE TABLE IF NOT EXISTS landmarks (
+    annotation_id INTEGER NOT NULL REFERENCES annotations (id),
+    landmark INTEGER NOT NULL,
+    x INTEGER,
+    y INTEGER,
+    PRIMARY KEY (annotation_id, landmark)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS landmarks_missing ON landmarks (landmark, annotation_id) WHERE x IS NULL;
+'''
+
+
+class SQLiteAnnotationStore(object):
+    """
+    SQLiteAnnotationStore - Class
+
+    Writes annotations into an indexed SQLite database and answers lookups on it.
+
+    Functions:
+    __init__: Requires the database path; the schema is created on first use. Every store opens a new row in
+    the sessions table. batch_size is the number of annotations buffered before they are inserted in one
+    transaction.
+
+    write: Buffers the annotation of one image (coords_list as kept by InteractiveViewer) and inserts the
+    buffer once it holds batch_size annotations.
+
+    flush: Inserts all buffered annotations in a single transaction.
+
+    is_annotated: Returns True if the image has at least one saved annotation.
+
+    latest: Returns the most recent annotation of an image as a list of (x, y) tuples, one per landmark of its
+    scheme (None for unlabeled landmarks), or None if the image was never annotated.
+
+    missing_landmark: Returns the paths of all images whose latest annotation has no label for landmark k
+    (1-based, as the buttons).
+
+    annotated_since: Returns the paths of images annotated at or after the given UNIX timestamp.
+
+    annotated_paths: Iterates over the paths of all annotated images.
+
+    close: Flushes the buffer and closes the database.
+    """
+
+    def __init__(self, db_path, batch_size=1):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.buffer = []
+
+        # The work server writes from its request threads, one at a time under its lock
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+
+        with self.conn:
+            cursor = self.conn.execute('INSERT INTO sessions (started, host, pid) VALUES (?, ?, ?)',
+                                       (time.time(), socket.gethostname(), os.getpid()))
+        self.session_id = cursor.lastrowid
+
+    def write(self, img_path, coords_list, created=None):
+        self.buffer.append((img_path, list(coords_list[1:]),
+                            time.time() if created is None else created))
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+
+        with self.conn:
+            for img_path, landmarks, created in self.buffer:
+                self.conn.execute('INSERT OR IGNORE INTO images (path) VALUES (?)', (img_path,))
+                image_id, = self.conn.execute('SELECT id FROM images WHERE path = ?', (img_path,)).fetchone()
+
+                annotation_id = self.conn.execute(
+                    'INSERT INTO annotations (image_id, session_id, created) VALUES (?, ?, ?)',
+                    (image_id, self.session_id, created)).lastrowid
+                self.conn.executemany(
+                    'INSERT INTO landmarks (annotation_id, landmark, x, y) VALUES (?, ?, ?, ?)',
+                    [(annotation_id, k, None, None) if coords is None else (annotation_id, k, coords[0], coords[1])
+                     for k, coords in enumerate(landmarks, start=1)])
+
+                self.conn.execute('UPDATE images SET latest_annotation_id = ? WHERE id = ?',
+                                  (annotation_id, image_id))
+        self.buffer = []
+
+    def is_annotated(self, img_path):
+        self.flush()
+        row = self.conn.execute('SELECT latest_annotation_id FROM images WHERE path = ?', (img_path,)).fetchone()
+        return row is not None and row[0] is not None
+
+    def latest(self, img_path):
+        self.flush()
+        rows = self.conn.execute(
+            'SELECT l.landmark, l.x, l.y FROM images i JOIN landmarks l ON l.annotation_id = i.latest_annotation_id '
+            'WHERE i.path = ? ORDER BY l.landmark', (img_path,)).fetchall()
+        if not rows:
+            return None
+
+        # Every annotation stores a row for each landmark of its scheme, missing ones with NULL coordinates
+        return [None if x is None else (x, y) for k, x, y in rows]
+
+    def missing_landmark(self, k):
+        self.flush()
+        rows = self.conn.execute(
+            'SELECT i.path FROM landmarks l JOIN images i ON i.latest_annotation_id = l.annotation_id '
+            'WHERE l.landmark = ? AND l.x IS NULL ORDER BY i.path', (k,))
+        return [path for path, in rows]
+
+    def annotated_since(self, timestamp):
+        self.flush()
+        rows = self.conn.execute(
+            'SELECT DISTINCT i.path FROM annotations a JOIN images i ON i.id = a.image_id WHERE a.created >= ?',
+            (timestamp,))
+        return [path for path, in rows]
+
+    def annotated_paths(self):
+        self.flush()
+        for path, in self.conn.execute('SELECT path FROM images WHERE latest_annotation_id IS NOT NULL'):
+            yield path
+
+    def close(self):
+        self.flush()
+        self.conn.close()
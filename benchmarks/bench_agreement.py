@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""
+Inter-annotator agreement benchmark
+
+Writes the iBUG-68 text outputs of --annotators synthetic annotators of
+--images faces (the faces of bench_qa). Every annotator annotates a random
+--coverage fraction of the images, adding Gaussian noise of its own size
+to every landmark: annotator a has a standard deviation of
+NOISE * (1 + a / 4) of the face height. Times compare_annotators without
+(cold) and with (warm) the memory-mapped array caches, and write_consensus.
+Compares the result with a reference that loops over the images and pairs
+in Python (on the first --loop-images images) and checks the pair NMEs
+against the expected value sqrt(pi / 2) * sqrt(s_a^2 + s_b^2) / d, where
+d is the inter-ocular distance of the template (pixel rounding adds a
+little).
+
+Usage:
+  python benchmarks/bench_agreement.py --annotators 10 --images 100000
+"""
+from __future__ import print_function
+from __future__ import division
+import os
+import sys
+import time
+import argparse
+import resource
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from annotation_io import format_header, format_row  # noqa: E402
+from annotation_agreement import compare_annotators, write_consensus, join_outputs  # noqa: E402
+from landmark_schemes import load_scheme  # noqa: E402
+from bench_qa import ibug68_template, synthetic_shapes  # noqa: E402
+
+NOISE = 0.004
+
+
+def annotator_noise(annotator):
+    return NOISE * (1 + annotator / 4)
+
+
+def write_outputs(tmp_dir, annotators, images, coverage, rng):
+    template = ibug68_template()
+    faces, scale = synthetic_shapes(template, images, rng)
+    header = format_header(68)
+    paths = []
+    for annotator in range(annotators):
+        path = os.path.join(tmp_dir, 'annotator{:02d}.txt'.format(annotator))
+        chosen = np.flatnonzero(rng.random(images) < coverage)
+        noise = rng.normal(0, annotator_noise(annotator), (len(chosen),) + template.shape)
+        shapes = np.rint(faces[chosen] + noise * scale[chosen, None, None]).astype(np.int64)
+        with open(path, 'w') as f:
+            for image, shape in zip(chosen.tolist(), shapes.tolist()):
+                f.write(header + '\n')
+                f.write(format_row('dataset/{:04d}/{:08d}.jpg'.format(image // 1000, image),
+                                   [None] + [tuple(point) for point in shape]) + '\n')
+        paths.append(path)
+    return paths, template
+
+
+def reference_nme(output_paths, scheme, images):
+    """Mean NME of every image, one image and one pair at a time."""
+    img_paths, table, landmarks = join_outputs(output_paths, scheme.number_of_landmarks)
+    left, right = (index - 1 for index in scheme.interocular)
+    result = {}
+    for image in range(min(images, len(table))):
+        shapes = [landmarks[a][row].astype(np.float64) for a, row in enumerate(table[image]) if row >= 0]
+        if len(shapes) < 2:
+            continue
+        consensus = np.nanmedian(np.stack(shapes), axis=0)
+        distance = np.linalg.norm(consensus[right] - consensus[left])
+        errors = [np.nanmean(np.linalg.norm(shapes[i] - shapes[j], axis=1)) / distance
+                  for i in range(len(shapes)) for j in range(i + 1, len(shapes))]
+        result[img_paths[image]] = np.mean(errors)
+    return result
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Measure inter-annotator agreement speed and accuracy.')
+    parser.add_argument('--annotators', type=int, default=10, help='synthetic annotators')
+    parser.add_argument('--images', type=int, default=100000, help='images in the synthetic dataset')
+    parser.add_argument('--coverage', type=float, default=0.8, help='fraction of the images every annotator annotates')
+    parser.add_argument('--loop-images', type=int, default=2000, help='images compared by the Python loop reference')
+    return parser.parse_args()
+
+
+def main(args):
+    rng = np.random.default_rng(0)
+    scheme = load_scheme('ibug68')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_paths, template = write_outputs(tmp_dir, args.annotators, args.images, args.coverage, rng)
+        print('{} annotators, {} images, {:.0f} MB of outputs'.format(
+            args.annotators, args.images, sum(os.path.getsize(path) for path in output_paths) / 1e6))
+
+        base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        for name in ('cold', 'warm'):
+            start = time.perf_counter()
+            agreement = compare_annotators(output_paths, scheme)
+            print('  {:<9s} {:8.2f} s, {} images compared'.format(name, time.perf_counter() - start,
+                                                                   len(agreement.img_paths)))
+        start = time.perf_counter()
+        write_consensus(os.path.join(tmp_dir, 'consensus.txt'), agreement)
+        print('  {:<9s} {:8.2f} s'.format('consensus', time.perf_counter() - start))
+        # ru_maxrss is in kilobytes on Linux
+        print('  peak RSS growth {:.0f} MB'.format(
+            (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base_rss) / 1024))
+
+        start = time.perf_counter()
+        reference = reference_nme(output_paths, scheme, args.loop_images)
+        elapsed = time.perf_counter() - start
+        positions = {img_path: image for image, img_path in enumerate(agreement.img_paths)}
+        difference = max(abs(agreement.image_nme[positions[img_path]] - nme) for img_path, nme in reference.items())
+        print('  loop reference {:.2f} s for {} images ({:.0f} s extrapolated), max NME difference {:.1e}'.format(
+            elapsed, len(reference), elapsed * len(agreement.img_paths) / max(len(reference), 1), difference))
+
+        interocular = np.linalg.norm(template[45] - template[36])
+        print('  {:<9s} {:>9s} {:>9s}'.format('pair', 'NME', 'expected'))
+        for first, second in ((0, 1), (0, args.annotators - 1), (args.annotators - 2, args.annotators - 1)):
+            expected = np.sqrt(np.pi / 2) * np.hypot(annotator_noise(first), annotator_noise(second)) / interocular
+            print('  {:<9s} {:9.4f} {:9.4f}'.format('{}-{}'.format(first, second),
+                                                    agreement.pair_nme[first, second], expected))
+        print('  NME against the consensus by annotator: ' + ' '.join(
+            '{:.4f}'.format(nme) for nme in agreement.annotator_nme))
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
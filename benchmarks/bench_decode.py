@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+"""
+Decode pipeline benchmark: time-to-first-frame and peak memory per image
+
+For the demo/ images and synthetic JPEGs (upscaled noise, so they compress
+like photos; one with EXIF orientation 6), times getting an image from its
+file onto the screen on the headless Agg backend: decode, the overview level
+of the DisplayPyramid, and the first full draw of a figure showing it.
+  legacy  cv2.imread, then cvtColor into a new RGB array (the old load_image)
+  full    load_display_image with reduce 1: full-resolution decode
+  auto    load_display_image: JPEGs larger than the overview decoded at its
+          resolution
+Every image and mode runs in a fresh process, so the reported peak RSS (above
+the RSS after imports) belongs to that decode alone.
+
+Usage:
+  python benchmarks/bench_decode.py --megapixels 12 50 --repeat 5
+"""
+from __future__ import print_function
+from __future__ import division
+import os
+import sys
+import json
+import glob
+import time
+import struct
+import argparse
+import resource
+import tempfile
+import subprocess
+
+import numpy as np
+import cv2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from image_loader import load_display_image, DisplayPyramid  # noqa: E402
+
+MODES = ('legacy', 'full', 'auto')
+
+DEMO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'demo')
+
+
+def exif_orientation_segment(orientation):
+    ifd = struct.pack('>H', 1) + struct.pack('>HHIHH', 0x0112, 3, 1, orientation, 0) + struct.pack('>I', 0)
+    payload = b'Exif\0\0MM' + struct.pack('>HI', 42, 8) + ifd
+    return b'\xff\xe1' + struct.pack('>H', len(payload) + 2) + payload
+
+
+def synthetic_jpeg(path, megapixels, orientation=1):
+    width = int(round((megapixels * 1e6 * 4 / 3) ** 0.5))
+    height = int(round(width * 3 / 4))
+    rng = np.random.default_rng(0)
+    # Noise at 1/8 resolution scaled up: smooth enough to compress like a photo, quick to make
+    small = rng.integers(0, 256, (height // 8 + 1, width // 8 + 1, 3), dtype=np.uint8)
+    image = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    data = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+    if orientation != 1:
+        data = data[:2] + exif_orientation_segment(orientation) + data[2:]
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def legacy_pyramid(img_path):
+    image = cv2.imread(img_path)
+    return DisplayPyramid(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+
+
+def first_frame(img_path, mode):
+    from matplotlib import pyplot as plt
+    pyramid = legacy_pyramid(img_path) if mode == 'legacy' else load_display_image(
+        img_path, 1 if mode == 'full' else 'auto')
+    fig = plt.figure(figsize=(12, 8), dpi=100)
+    ax = fig.add_subplot(1, 2, 1)
+    ax.imshow(pyramid.overview(), interpolation='nearest',
+              extent=(-0.5, pyramid.width - 0.5, pyramid.height - 0.5, -0.5))
+    fig.canvas.draw()
+    plt.close(fig)
+    return pyramid
+
+
+def run_worker(args):
+    """Times one image in one mode. Runs in its own process; prints JSON."""
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import pyplot as plt  # noqa: F401
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    times = []
+    for i in range(args.repeat):
+        start = time.perf_counter()
+        pyramid = first_frame(args.worker, args.mode)
+        times.append(time.perf_counter() - start)
+        if i == 0:
+            # ru_maxrss is in kilobytes on Linux
+            peak_mb = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base_rss) / 1024
+        del pyramid
+    print(json.dumps({'ms': float(np.median(times) * 1e3), 'peak_mb': peak_mb}))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Measure time-to-first-frame and peak memory of image decoding.')
+    parser.add_argument('--megapixels', type=float, nargs='+', default=[12, 50],
+                        help='sizes of the synthetic JPEGs')
+    parser.add_argument('--repeat', type=int, default=3, help='decodes per image and mode (median is reported)')
+    parser.add_argument('--worker', type=str, help=argparse.SUPPRESS)
+    parser.add_argument('--mode', type=str, choices=MODES, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main(args):
+    if args.worker is not None:
+        run_worker(args)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        images = sorted(glob.glob(os.path.join(DEMO_DIR, '*.jpg')))
+        for megapixels in args.megapixels:
+            path = os.path.join(tmp_dir, '{:g}mp.jpg'.format(megapixels))
+            synthetic_jpeg(path, megapixels)
+            images.append(path)
+        path = os.path.join(tmp_dir, '{:g}mp_rotated.jpg'.format(args.megapixels[0]))
+        synthetic_jpeg(path, args.megapixels[0], orientation=6)
+        images.append(path)
+
+        print('{:<24s} {:>11s}'.format('image', 'size') + ''.join(
+            '  {:>10s} {:>9s}'.format(mode + ' ms', 'peak MB') for mode in MODES))
+        for path in images:
+            pyramid = load_display_image(path)
+            cells = []
+            for mode in MODES:
+                result = json.loads(subprocess.check_output(
+                    [sys.executable, os.path.abspath(__file__), '--worker', path, '--mode', mode,
+                     '--repeat', str(args.repeat)]).decode('utf-8'))
+                cells.append('  {:10.1f} {:9.1f}'.format(result['ms'], result['peak_mb']))
+            print('{:<24s} {:>11s}'.format(os.path.basename(path), '{}x{}'.format(pyramid.width, pyramid.height))
+                  + ''.join(cells))
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+Event dispatch benchmark for InteractiveViewer
+
+Builds a viewer on the headless Agg backend for every landmark scheme and times
+the event handlers alone: a landmark placement (on_click) and clicks on the
+first, middle and last landmark button (button_event). Blitting is switched off,
+so the numbers are the cost of finding and updating the label, which should not
+depend on the number of landmarks.
+
+For comparison, "linear" times the lookup the old 70-way elif chain did: one
+axes comparison per button until the clicked one is found.
+
+Usage:
+  python benchmarks/bench_dispatch.py --schemes 5point ibug68 wflw98 --repeat 20000
+"""
+from __future__ import print_function
+from __future__ import division
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import matplotlib
+matplotlib.use('Agg')
+
+from matplotlib import pyplot as plt
+from matplotlib.backend_bases import MouseEvent
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import annotate_faces  # noqa: E402
+from landmark_schemes import load_scheme  # noqa: E402
+from bench_redraw import synthetic_image  # noqa: E402
+
+
+def button_press(viewer, button):
+    bbox = button.ax.bbox
+    return MouseEvent('button_press_event', viewer.fig.canvas, (bbox.x0 + bbox.x1) / 2, (bbox.y0 + bbox.y1) / 2,
+                      button=1)
+
+
+def linear_dispatch(viewer, event):
+    for index, button in enumerate(viewer.button_list):
+        if event.inaxes == button.ax:
+            return index
+    return None
+
+
+def time_call(function, event, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(event)
+    return (time.perf_counter() - start) / repeat
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Measure per-event dispatch cost of InteractiveViewer.')
+    parser.add_argument('-s', '--schemes', type=str, nargs='+', default=['5point', 'ibug68', 'wflw98'],
+                        help='landmark schemes to benchmark')
+    parser.add_argument('-r', '--repeat', type=int, default=20000,
+                        help='number of events per measurement')
+    return parser.parse_args()
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'synthetic.jpg')
+        width, height = synthetic_image(path, 0.3)
+
+        print('{:<10s} {:>5s} {:>10s} {:>10s} {:>10s} {:>10s} {:>12s}'.format(
+            'scheme', 'K', 'click', 'first', 'middle', 'last', 'linear last'))
+        for name in args.schemes:
+            scheme = load_scheme(name)
+            viewer = annotate_faces.InteractiveViewer(path, scheme=scheme)
+            viewer.init_subplots()
+            viewer.fig.canvas.draw()
+            # Only the handlers themselves are timed
+            viewer.blit_overlay = lambda: None
+            viewer.blit_button = lambda button: None
+
+            x, y = viewer.im_ax.transData.transform((width / 2, height / 2))
+            click = MouseEvent('button_press_event', viewer.fig.canvas, x, y, button=1)
+            # Place every click as a new label instead of grabbing the landmark placed before
+            viewer.landmark_index.nearest = lambda x, y, radius: None
+
+            count = scheme.number_of_landmarks
+            presses = [button_press(viewer, viewer.button_list[index]) for index in (1, (count + 1) // 2, count)]
+
+            times = [time_call(viewer.on_click, click, args.repeat)]
+            times += [time_call(viewer.button_event, event, args.repeat) for event in presses]
+            times.append(time_call(lambda event: linear_dispatch(viewer, event), presses[-1], args.repeat))
+            plt.close(viewer.fig)
+
+            print('{:<10s} {:>5d} '.format(name, count)
+                  + ' '.join('{:>7.2f} us'.format(t * 1e6) for t in times[:4])
+                  + ' {:>9.2f} us'.format(times[4] * 1e6))
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+Idle CPU benchmark for InteractiveViewer
+
+Opens a viewer, leaves it idle for a few seconds and then presses Skip from a timer, measuring the
+process CPU time spent while nobody touched the window. Two loops are compared:
+  poll:  the former "while True: plt.pause(0.01)" loop checking the viewer flags
+  run:   InteractiveViewer.run, blocking in the backend's event loop
+
+Usage:
+  python benchmarks/bench_idle.py --seconds 5 --backend TkAgg
+"""
+from __future__ import print_function
+from __future__ import division
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+
+import matplotlib
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Measure CPU used by an idle InteractiveViewer.')
+    parser.add_argument('-s', '--seconds', type=float, default=5.0,
+                        help='idle time per loop')
+    parser.add_argument('-b', '--backend', type=str, default='Agg',
+                        help='matplotlib backend; use an interactive one (TkAgg, QtAgg) on a display')
+    parser.add_argument('-m', '--megapixels', type=float, default=12.0,
+                        help='synthetic image size')
+    return parser.parse_args()
+
+
+def skip_later(viewer, seconds, backend):
+    def skip():
+        viewer.is_skipped = True
+        viewer.fig.canvas.stop_event_loop()
+
+    if backend.lower() == 'agg':
+        # Agg has no timers of its own; its fallback event loop just sleeps, so a thread can stop it
+        threading.Timer(seconds, skip).start()
+    else:
+        timer = viewer.fig.canvas.new_timer(interval=int(seconds * 1000))
+        timer.single_shot = True
+        timer.add_callback(skip)
+        timer.start()
+        viewer.timer = timer
+
+
+def poll(viewer):
+    from matplotlib import pyplot as plt
+    while not (viewer.is_finished or viewer.is_skipped):
+        plt.pause(0.01)
+
+
+def measure(viewer, seconds, backend, loop):
+    skip_later(viewer, seconds, backend)
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    loop(viewer)
+    return time.process_time() - cpu, time.perf_counter() - wall
+
+
+def main(args):
+    matplotlib.use(args.backend)
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+    import annotate_faces
+    from bench_redraw import synthetic_image
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'synthetic.jpg')
+        synthetic_image(path, args.megapixels)
+        viewer = annotate_faces.InteractiveViewer(path)
+        viewer.init_subplots()
+        viewer.connect()
+
+        for name, loop in (('poll', poll), ('run', lambda v: v.run())):
+            viewer.set_image(path, viewer.pyramid)
+            viewer.fig.canvas.draw()
+            cpu, wall = measure(viewer, args.seconds, args.backend, loop)
+            print('{:<5s} cpu={:7.3f} s over {:6.2f} s idle ({:5.1f}% of one core)'.format(
+                name, cpu, wall, 100 * cpu / wall))
+        viewer.close()
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
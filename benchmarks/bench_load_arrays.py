@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+Annotation loader benchmark
+
+Writes a synthetic text output of --rows annotations (10% of the landmarks
+unlabeled, a header before every row, like the viewer writes it) and times:
+  rows         reading it row by row with iter_rows and parse_row
+  vectorized   load_annotations without the cache
+  cold         load_annotations building the memory-mapped cache
+  reopen       load_annotations with an up to date cache
+  append       load_annotations after 1% more rows were appended
+
+Usage:
+  python benchmarks/bench_load_arrays.py --rows 1000000
+"""
+from __future__ import print_function
+from __future__ import division
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from annotation_io import format_header, format_row, parse_row, iter_rows  # noqa: E402
+from annotation_arrays import load_annotations  # noqa: E402
+
+
+def write_rows(f, start, count, number_of_landmarks, rng):
+    header = format_header(number_of_landmarks)
+    for i in range(start, start + count):
+        coords_list = [None] + [None if rng.random() < 0.1 else (rng.randrange(4000), rng.randrange(3000))
+                                for k in range(number_of_landmarks)]
+        f.write(header + '\n')
+        f.write(format_row('dataset/{:04d}/{:08d}.jpg'.format(i // 1000, i), coords_list) + '\n')
+
+
+def read_rows(output_path, number_of_landmarks):
+    paths = []
+    shapes = []
+    with open(output_path, 'rb') as f:
+        for offset, row in iter_rows(f):
+            img_path, landmarks = parse_row(row, number_of_landmarks)
+            paths.append(img_path)
+            shapes.append([(np.nan, np.nan) if coords is None else coords for coords in landmarks])
+    return np.array(shapes, dtype=np.float32), paths
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Measure loading a text output into NumPy arrays.')
+    parser.add_argument('--rows', type=int, default=200000, help='annotations in the synthetic output')
+    parser.add_argument('--landmarks', type=int, default=68, help='landmarks per annotation')
+    parser.add_argument('--skip-rows', action='store_true', help='do not time the row by row baseline')
+    return parser.parse_args()
+
+
+def main(args):
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_path = os.path.join(tmp_dir, 'landmark_output.txt')
+        with open(output_path, 'w') as f:
+            write_rows(f, 0, args.rows, args.landmarks, rng)
+        print('{} rows, {:.0f} MB'.format(args.rows, os.path.getsize(output_path) / 1e6))
+
+        if not args.skip_rows:
+            seconds, (shapes, paths) = timed(read_rows, output_path, args.landmarks)
+            print('  {:<11s} {:10.3f} s'.format('rows', seconds))
+        seconds, (landmarks, paths) = timed(load_annotations, output_path, args.landmarks, cache=False)
+        print('  {:<11s} {:10.3f} s'.format('vectorized', seconds))
+        if not args.skip_rows:
+            assert np.array_equal(shapes, landmarks, equal_nan=True)
+        seconds, (landmarks, paths) = timed(load_annotations, output_path, args.landmarks)
+        print('  {:<11s} {:10.3f} s'.format('cold', seconds))
+        seconds, (landmarks, paths) = timed(load_annotations, output_path, args.landmarks)
+        print('  {:<11s} {:10.3f} ms'.format('reopen', seconds * 1e3))
+
+        with open(output_path, 'a') as f:
+            write_rows(f, args.rows, args.rows // 100, args.landmarks, rng)
+        seconds, (landmarks, paths) = timed(load_annotations, output_path, args.landmarks)
+        print('  {:<11s} {:10.3f} ms ({} rows)'.format('append', seconds * 1e3, len(landmarks)))
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
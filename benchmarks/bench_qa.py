@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+"""
+Annotation QA benchmark
+
+Writes a synthetic iBUG-68 text output of --rows annotations (a template face
+with per-landmark noise, random scale, rotation and position) and plants
+faults in a known fraction of the images:
+  mirrored  left and right labels swapped throughout
+  swapped   the two eyes labeled the wrong way round
+  origin    a few landmarks at (0, 0)
+  outlier   one landmark a fifth of the face size off
+  missing   a few landmarks unlabeled
+Some images are annotated twice, mirrored first and fixed in the second row,
+so they must not be reported. Times find_suspects without (cold) and with
+(warm) the memory-mapped array cache, and reports per fault how many of the
+planted images were found, and how many clean images were reported.
+
+Usage:
+  python benchmarks/bench_qa.py --rows 1000000
+"""
+from __future__ import print_function
+from __future__ import division
+import os
+import sys
+import time
+import argparse
+import resource
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from annotation_io import format_header, format_row  # noqa: E402
+from annotation_qa import find_suspects  # noqa: E402
+from landmark_schemes import load_scheme  # noqa: E402
+
+FAULTS = ('mirrored', 'swapped', 'origin', 'outlier', 'missing')
+
+
+def arc(center, radii, start, end, count):
+    angles = np.radians(np.linspace(start, end, count))
+    return np.stack([center[0] + radii[0] * np.cos(angles), center[1] + radii[1] * np.sin(angles)], axis=1)
+
+
+def ibug68_template():
+    """A face of unit height in image coordinates (y down), landmarks in iBUG-68 order."""
+    return np.concatenate([
+        arc((0, 0), (0.45, 0.5), 180, 0, 17),          # jaw, from the left ear round the chin
+        arc((-0.2, -0.15), (0.12, 0.04), 180, 360, 5),  # brows
+        arc((0.2, -0.15), (0.12, 0.04), 180, 360, 5),
+        np.stack([np.zeros(4), np.linspace(-0.08, 0.06, 4)], axis=1),  # nose bridge
+        arc((0, 0.1), (0.08, 0.03), 160, 20, 5),         # nostrils
+        arc((-0.2, -0.03), (0.08, 0.03), 180, 360, 4),  # left eye: outer corner, upper lid, inner corner
+        arc((-0.2, -0.03), (0.08, 0.03), 60, 120, 2),   # lower lid
+        arc((0.2, -0.03), (0.08, 0.03), 180, 360, 4),   # right eye: inner corner, upper lid, outer corner
+        arc((0.2, -0.03), (0.08, 0.03), 60, 120, 2),
+        arc((0, 0.28), (0.18, 0.07), 180, 360, 7),      # outer lips: left corner, upper, right corner
+        arc((0, 0.28), (0.18, 0.07), 30, 150, 5),       # lower, back to the left
+        arc((0, 0.28), (0.12, 0.03), 180, 360, 5),      # inner lips
+        arc((0, 0.28), (0.12, 0.03), 45, 135, 3),
+    ])
+
+
+def mirror_permutation(scheme):
+    permutation = np.arange(scheme.number_of_landmarks)
+    for left, right in scheme.symmetry:
+        permutation[left - 1], permutation[right - 1] = right - 1, left - 1
+    return permutation
+
+
+def synthetic_shapes(template, count, rng):
+    scale = rng.uniform(150, 800, count)
+    angle = np.radians(rng.normal(0, 10, count))
+    rotation = np.stack([np.stack([np.cos(angle), np.sin(angle)], axis=1),
+                         np.stack([-np.sin(angle), np.cos(angle)], axis=1)], axis=1)
+    shapes = template + rng.normal(0, 0.008, (count,) + template.shape)
+    shapes = np.matmul(shapes, rotation) * scale[:, None, None]
+    shapes += rng.uniform(500, 2500, (count, 1, 2))
+    return shapes, scale
+
+
+def plant(shapes, scale, fault, permutation, rng):
+    if fault == 'mirrored':
+        shapes[:] = shapes[permutation]
+    elif fault == 'swapped':
+        shapes[36:42], shapes[42:48] = shapes[42:48].copy(), shapes[36:42].copy()
+    elif fault == 'origin':
+        shapes[rng.choice(68, rng.integers(1, 4), replace=False)] = 0
+    elif fault == 'outlier':
+        direction = rng.uniform(0, 2 * np.pi)
+        shapes[rng.integers(68)] += 0.2 * scale * np.array([np.cos(direction), np.sin(direction)])
+    elif fault == 'missing':
+        shapes[rng.choice(68, rng.integers(1, 6), replace=False)] = np.nan
+
+
+def write_output(path, rows, fault_rate, rng):
+    """Writes the synthetic output. Returns {img_path: planted fault} of the faulty images."""
+    scheme = load_scheme('ibug68')
+    permutation = mirror_permutation(scheme)
+    template = ibug68_template()
+    header = format_header(68)
+    planted = {}
+    with open(path, 'w') as f:
+        for start in range(0, rows, 10000):
+            count = min(10000, rows - start)
+            shapes, scale = synthetic_shapes(template, count, rng)
+            kinds = rng.random(count)
+            for i in range(count):
+                img_path = 'dataset/{:04d}/{:08d}.jpg'.format((start + i) // 1000, start + i)
+                kind = int(kinds[i] / fault_rate)
+                if kind < len(FAULTS):
+                    plant(shapes[i], scale[i], FAULTS[kind], permutation, rng)
+                    planted[img_path] = FAULTS[kind]
+                elif kind == len(FAULTS):
+                    # Annotated twice: the mirrored first row is superseded by the second
+                    f.write(header + '\n')
+                    f.write(format_row(img_path, [None] + [(int(round(x)), int(round(y)))
+                                                           for x, y in shapes[i][permutation]]) + '\n')
+                f.write(header + '\n')
+                f.write(format_row(img_path, [None] + [None if np.isnan(x) else (int(round(x)), int(round(y)))
+                                                       for x, y in shapes[i]]) + '\n')
+    return planted
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Measure annotation QA speed and the faults it finds.')
+    parser.add_argument('--rows', type=int, default=200000, help='annotated images in the synthetic output')
+    parser.add_argument('--fault-rate', type=float, default=0.002,
+                        help='fraction of the images with each kind of fault')
+    return parser.parse_args()
+
+
+def main(args):
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_path = os.path.join(tmp_dir, 'landmark_output.txt')
+        planted = write_output(output_path, args.rows, args.fault_rate, rng)
+        print('{} images, {:.0f} MB, {} with planted faults'.format(args.rows, os.path.getsize(output_path) / 1e6,
+                                                                    len(planted)))
+
+        base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        for name in ('cold', 'warm'):
+            start = time.perf_counter()
+            suspects, checked = find_suspects(output_path)
+            print('  {:<5s} {:8.2f} s, {} suspects'.format(name, time.perf_counter() - start, len(suspects)))
+        # ru_maxrss is in kilobytes on Linux
+        print('  peak RSS growth {:.0f} MB'.format(
+            (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base_rss) / 1024))
+
+        found = {img_path: [finding for finding, detail in findings] for img_path, score, findings in suspects}
+        for fault in FAULTS:
+            images = [img_path for img_path, kind in planted.items() if kind == fault]
+            hits = sum(fault in found.get(img_path, ()) for img_path in images)
+            print('  {:<9s} found {:5d} of {:5d}'.format(fault, hits, len(images)))
+        false_alarms = [img_path for img_path in found if img_path not in planted]
+        print('  clean images reported: {}'.format(len(false_alarms)))
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""
+Redraw latency benchmark for InteractiveViewer
+
+Builds a viewer on the headless Agg backend around a synthetic image and
+replays landmark clicks, mouse moves over the image (which only move the
+loupe) and rectangle drags through the canvas callback registry. After
+every event the figure is flushed the way the backend event loop that
+InteractiveViewer.run blocks in (start_event_loop) would flush it: the
+handlers blit their own artists, and a full draw happens only when a
+handler left the figure stale. The reported time is therefore the
+click-to-frame latency.
+
+Usage:
+  python benchmarks/bench_redraw.py --megapixels 0.3 12 24 --events 50
+  python benchmarks/bench_redraw.py --loupe 0     # without the loupe
+"""
+from __future__ import print_function
+from __future__ import division
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import matplotlib
+matplotlib.use('Agg')
+
+import cv2
+import numpy as np
+from matplotlib import pyplot as plt
+from matplotlib.backend_bases import MouseEvent
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import annotate_faces  # noqa: E402
+
+
+def synthetic_image(path, megapixels, seed=0):
+    height = int(round((megapixels * 1e6 * 3 / 4) ** 0.5))
+    width = int(round(height * 4 / 3))
+    rng = np.random.RandomState(seed)
+    small = rng.randint(0, 256, size=(max(height // 64, 1), max(width // 64, 1), 3), dtype=np.uint8)
+    image = cv2.resize(small, (width, height), interpolation=cv2.INTER_LINEAR)
+    cv2.imwrite(path, image)
+    return width, height
+
+
+def send(viewer, name, xdata, ydata):
+    canvas = viewer.fig.canvas
+    x, y = viewer.im_ax.transData.transform((xdata, ydata))
+    event = MouseEvent(name, canvas, x, y, button=1)
+    canvas.callbacks.process(name, event)
+
+
+def flush(viewer):
+    # What the backend event loop does between events: handlers have already blitted, so only a pending
+    # draw_idle (a stale figure) costs a full render
+    if viewer.fig.stale:
+        viewer.fig.canvas.draw()
+
+
+def time_events(viewer, events, width, height, rng):
+    click_times = []
+    move_times = []
+    for _ in range(events):
+        x, y = rng.uniform(0, width - 1), rng.uniform(0, height - 1)
+        start = time.perf_counter()
+        send(viewer, 'button_press_event', x, y)
+        flush(viewer)
+        click_times.append(time.perf_counter() - start)
+
+    hover_times = []
+    for _ in range(events):
+        x, y = rng.uniform(0, width - 1), rng.uniform(0, height - 1)
+        start = time.perf_counter()
+        send(viewer, 'motion_notify_event', x, y)
+        flush(viewer)
+        hover_times.append(time.perf_counter() - start)
+
+    viewer.curr_state = annotate_faces.RECT_STATE
+    send(viewer, 'button_press_event', width * 0.2, height * 0.2)
+    flush(viewer)
+    for _ in range(events):
+        x, y = rng.uniform(width * 0.3, width - 1), rng.uniform(height * 0.3, height - 1)
+        start = time.perf_counter()
+        send(viewer, 'motion_notify_event', x, y)
+        flush(viewer)
+        move_times.append(time.perf_counter() - start)
+    send(viewer, 'button_release_event', width * 0.8, height * 0.8)
+    return click_times, hover_times, move_times
+
+
+def summarize(name, times):
+    times_ms = np.asarray(times) * 1e3
+    return '{:<8s} n={:<4d} p50={:8.2f} ms  p95={:8.2f} ms  max={:8.2f} ms'.format(
+        name, len(times_ms), np.percentile(times_ms, 50), np.percentile(times_ms, 95), times_ms.max())
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Measure per-event redraw latency of InteractiveViewer.')
+    parser.add_argument('-m', '--megapixels', type=float, nargs='+', default=[0.3, 12.0, 24.0],
+                        help='synthetic image sizes to benchmark')
+    parser.add_argument('-e', '--events', type=int, default=30,
+                        help='number of clicks and mouse moves per image size')
+    parser.add_argument('--loupe', type=int, default=annotate_faces.LOUPE_PIXELS,
+                        help='pixels across the loupe (0: no loupe)')
+    return parser.parse_args()
+
+
+def main(args):
+    rng = np.random.RandomState(0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for megapixels in args.megapixels:
+            path = os.path.join(tmp_dir, 'synthetic_{}mp.jpg'.format(megapixels))
+            width, height = synthetic_image(path, megapixels)
+            viewer = annotate_faces.InteractiveViewer(path, loupe=args.loupe)
+            viewer.init_subplots()
+            viewer.connect()
+            viewer.fig.canvas.draw()
+            click_times, hover_times, move_times = time_events(viewer, args.events, width, height, rng)
+            plt.close(viewer.fig)
+            print('{:.1f} MP ({}x{})'.format(megapixels, width, height))
+            print('  ' + summarize('click', click_times))
+            print('  ' + summarize('hover', hover_times))
+            print('  ' + summarize('move', move_times))
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+"""
+Deterministic event-replay benchmark for InteractiveViewer
+
+Replays a fixed annotation session on the headless Agg backend, for synthetic
+images from 0.3 to 100 MP. For every image the session is:
+  load     decode the image and switch the viewer to it (set_image)
+  rect     press the Rect button, drag out the face box
+  place    click every landmark of the scheme
+  drag     grab placed landmarks and move them
+  button   press landmark buttons and click their label again
+  zoom     zoom in 4x and back out (full redraws through the DisplayPyramid)
+  done     press Done and save the annotation to a text output
+Every event goes through the canvas callback registry, like a real mouse event,
+and is timed up to the next frame (a full draw if the figure went stale). Event
+positions come from a seeded generator in image-relative coordinates and the
+figure size is fixed, so every run replays the same events.
+
+Each image size runs in its own process so that the reported peak RSS belongs
+to that size alone. Results (per-event-type latency percentiles, per-image time
+and throughput, peak RSS) can be saved as a JSON baseline and later runs
+compared against it:
+
+Usage:
+  python benchmarks/bench_replay.py --megapixels 0.3 12 100 --output baseline.json
+  python benchmarks/bench_replay.py --megapixels 0.3 12 100 --compare baseline.json
+"""
+from __future__ import print_function
+from __future__ import division
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import tempfile
+import contextlib
+import subprocess
+
+import matplotlib
+matplotlib.use('Agg')
+matplotlib.rcParams['figure.figsize'] = (12.8, 7.2)
+matplotlib.rcParams['figure.dpi'] = 100
+
+import cv2
+import numpy as np
+from matplotlib.backend_bases import MouseEvent
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import annotate_faces  # noqa: E402
+from annotation_io import TextAnnotationWriter  # noqa: E402
+from image_loader import load_image  # noqa: E402
+from landmark_schemes import load_scheme  # noqa: E402
+from bench_redraw import synthetic_image  # noqa: E402
+
+BASELINE_VERSION = 1
+
+EVENT_TYPES = ('rect', 'place', 'drag', 'button', 'zoom', 'done')
+
+
+class Replay(object):
+    """Sends events to a viewer and records the time to the next frame per event type."""
+
+    def __init__(self, viewer):
+        self.viewer = viewer
+        self.times = {event_type: [] for event_type in EVENT_TYPES}
+
+    def flush(self):
+        if self.viewer.fig.stale:
+            self.viewer.fig.canvas.draw()
+
+    def send(self, event_type, name, x, y):
+        canvas = self.viewer.fig.canvas
+        start = time.perf_counter()
+        canvas.callbacks.process(name, MouseEvent(name, canvas, x, y, button=1))
+        self.flush()
+        self.times[event_type].append(time.perf_counter() - start)
+
+    def image_event(self, event_type, name, xdata, ydata):
+        x, y = self.viewer.im_ax.transData.transform((xdata, ydata))
+        self.send(event_type, name, x, y)
+
+    def image_click(self, event_type, xdata, ydata):
+        self.image_event(event_type, 'button_press_event', xdata, ydata)
+        self.image_event(event_type, 'button_release_event', xdata, ydata)
+
+    def button_click(self, event_type, button):
+        bbox = button.ax.bbox
+        x, y = (bbox.x0 + bbox.x1) / 2, (bbox.y0 + bbox.y1) / 2
+        self.send(event_type, 'button_press_event', x, y)
+        self.send(event_type, 'button_release_event', x, y)
+
+    def zoom(self, x0, x1, y0, y1):
+        start = time.perf_counter()
+        self.viewer.im_ax.set_xlim(x0, x1)
+        self.viewer.im_ax.set_ylim(y1, y0)
+        self.flush()
+        self.times['zoom'].append(time.perf_counter() - start)
+
+
+def session_script(seed, number_of_landmarks, moves=20, drags=5, buttons=5):
+    """Returns the image-relative positions of one session, the same for every image size."""
+    rng = np.random.RandomState(seed)
+    return {
+        'rect': np.column_stack([np.linspace(0.25, 0.75, moves + 2), np.linspace(0.2, 0.85, moves + 2)]),
+        'place': rng.uniform(0.3, 0.7, size=(number_of_landmarks, 2)),
+        'drag': [(rng.randint(number_of_landmarks), rng.uniform(-0.02, 0.02, size=(moves // 2, 2)).cumsum(axis=0))
+                 for i in range(drags)],
+        'button': [(rng.randint(number_of_landmarks) + 1, rng.uniform(0.3, 0.7, size=2)) for i in range(buttons)],
+    }
+
+
+def replay_session(replay, script, width, height):
+    viewer = replay.viewer
+    size = np.array([width - 1, height - 1])
+
+    replay.button_click('rect', viewer.button_list[annotate_faces.RECT_STATE])
+    rect = script['rect'] * size
+    replay.image_event('rect', 'button_press_event', *rect[0])
+    for xy in rect[1:-1]:
+        replay.image_event('rect', 'motion_notify_event', *xy)
+    replay.image_event('rect', 'button_release_event', *rect[-1])
+
+    for xy in script['place'] * size:
+        replay.image_click('place', *xy)
+
+    for index, path in script['drag']:
+        start = np.array(viewer.coords_list[index + 1], dtype=float)
+        replay.image_event('drag', 'button_press_event', *start)
+        for xy in start + path * size:
+            replay.image_event('drag', 'motion_notify_event', *xy)
+        replay.image_event('drag', 'button_release_event', *(start + path[-1] * size))
+
+    for number, xy in script['button']:
+        replay.button_click('button', viewer.button_list[number])
+        replay.image_click('button', *(xy * size))
+
+    # 4x zoom on the centre of the face box, then back to the whole image
+    cx, cy = size / 2
+    replay.zoom(cx - width / 8, cx + width / 8, cy - height / 8, cy + height / 8)
+    replay.zoom(-0.5, width - 0.5, -0.5, height - 0.5)
+
+    replay.button_click('done', viewer.button_done)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        viewer.save_annotations()
+    replay.times['done'].append(time.perf_counter() - start)
+
+
+def percentiles(times):
+    times_ms = np.asarray(times) * 1e3
+    p50, p95, p99 = np.percentile(times_ms, (50, 95, 99))
+    return {'n': len(times_ms), 'p50_ms': round(p50, 3), 'p95_ms': round(p95, 3), 'p99_ms': round(p99, 3),
+            'max_ms': round(times_ms.max(), 3), 'mean_ms': round(times_ms.mean(), 3)}
+
+
+def run_worker(args):
+    """Replays the session on every image of one size. Runs in its own process; writes JSON to args.result."""
+    scheme = load_scheme(args.scheme)
+    output_path = os.path.join(os.path.dirname(args.paths[0]), 'replay_output.txt')
+    output = TextAnnotationWriter(open(output_path, 'w'))
+
+    viewer = None
+    replay = None
+    image_times = []
+    for i, path in enumerate(args.paths):
+        start = time.perf_counter()
+        image = load_image(path)
+        if viewer is None:
+            viewer = annotate_faces.InteractiveViewer(path, image, output, scheme=scheme)
+            viewer.init_subplots()
+            viewer.connect()
+            viewer.fig.canvas.draw()
+            replay = Replay(viewer)
+        else:
+            viewer.set_image(path, image)
+            replay.flush()
+        height, width = image.shape[:2]
+        del image
+        replay_session(replay, session_script(args.seed + i, scheme.number_of_landmarks), width, height)
+        image_times.append(time.perf_counter() - start)
+    viewer.close()
+    output.close()
+
+    # ru_maxrss is in kilobytes on Linux
+    result = {
+        'megapixels': args.worker,
+        'width': width,
+        'height': height,
+        'images': len(image_times),
+        'events': {event_type: percentiles(times) for event_type, times in replay.times.items() if times},
+        'image': percentiles(image_times),
+        'images_per_s': round(len(image_times) / sum(image_times), 4),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    with open(args.result, 'w') as f:
+        json.dump(result, f)
+
+
+def machine_info():
+    return {
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'matplotlib': matplotlib.__version__,
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+    }
+
+
+def print_result(result):
+    print('{:.1f} MP ({}x{}): {:.3f} images/s, peak RSS {:.0f} MB'.format(
+        result['megapixels'], result['width'], result['height'], result['images_per_s'], result['peak_rss_mb']))
+    for name, stats in list(result['events'].items()) + [('image', result['image'])]:
+        print('  {:<7s} n={:<5d} p50={:9.2f} ms  p95={:9.2f} ms  p99={:9.2f} ms  max={:9.2f} ms'.format(
+            name, stats['n'], stats['p50_ms'], stats['p95_ms'], stats['p99_ms'], stats['max_ms']))
+
+
+def compare(baseline, results, tolerance):
+    """Prints current/baseline ratios of the p50 latencies, image time and peak RSS. Returns the regressions."""
+    previous = {result['megapixels']: result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        old = previous.get(result['megapixels'])
+        if old is None:
+            continue
+        metrics = [(f"{name} p50", stats['p50_ms'], old['events'][name]['p50_ms'])
+                   for name, stats in result['events'].items() if name in old['events']]
+        metrics.append(('image p50', result['image']['p50_ms'], old['image']['p50_ms']))
+        metrics.append(('peak RSS', result['peak_rss_mb'], old['peak_rss_mb']))
+
+        print('{:.1f} MP vs baseline'.format(result['megapixels']))
+        for name, new_value, old_value in metrics:
+            ratio = new_value / old_value if old_value > 0 else float('inf')
+            flag = ''
+            if ratio > tolerance:
+                flag = '  REGRESSION'
+                regressions.append((result['megapixels'], name, ratio))
+            print('  {:<12s} {:10.2f} -> {:10.2f}  x{:.2f}{}'.format(name, old_value, new_value, ratio, flag))
+    return regressions
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Replay a fixed annotation session on InteractiveViewer.')
+    parser.add_argument('-m', '--megapixels', type=float, nargs='+', default=[0.3, 3.0, 12.0, 24.0, 50.0, 100.0],
+                        help='synthetic image sizes to benchmark')
+    parser.add_argument('-n', '--images', type=int, default=3,
+                        help='number of images per size')
+    parser.add_argument('-s', '--scheme', type=str, default='ibug68',
+                        help='landmark scheme of the session')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the synthetic images and event positions')
+    parser.add_argument('-o', '--output', type=str,
+                        help='save the results as a JSON baseline')
+    parser.add_argument('-c', '--compare', type=str,
+                        help='compare against this baseline; exits with status 1 on a regression')
+    parser.add_argument('-t', '--tolerance', type=float, default=1.25,
+                        help='current/baseline ratio above which a metric counts as a regression')
+    # Internal: replay one size in this process
+    parser.add_argument('--worker', type=float, help=argparse.SUPPRESS)
+    parser.add_argument('--paths', type=str, nargs='+', help=argparse.SUPPRESS)
+    parser.add_argument('--result', type=str, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main(args):
+    if args.worker is not None:
+        run_worker(args)
+        return 0
+
+    results = []
+    for megapixels in args.megapixels:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = []
+            for i in range(args.images):
+                path = os.path.join(tmp_dir, 'synthetic_{}mp_{}.jpg'.format(megapixels, i))
+                synthetic_image(path, megapixels, seed=args.seed + i)
+                paths.append(path)
+
+            result_path = os.path.join(tmp_dir, 'result.json')
+            subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', str(megapixels),
+                            '--scheme', args.scheme, '--seed', str(args.seed), '--result', result_path,
+                            '--paths'] + paths, check=True)
+            with open(result_path) as f:
+                result = json.load(f)
+        print_result(result)
+        results.append(result)
+
+    baseline = {
+        'version': BASELINE_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'machine': machine_info(),
+        'settings': {'images': args.images, 'scheme': args.scheme, 'seed': args.seed,
+                     'figure_size': list(matplotlib.rcParams['figure.figsize']),
+                     'dpi': matplotlib.rcParams['figure.dpi']},
+        'results': results,
+    }
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(baseline, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.tolerance)
+        if regressions:
+            print('{} regressions beyond x{:.2f}'.format(len(regressions), args.tolerance))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(parse_arguments()))
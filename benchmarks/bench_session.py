@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+Per-image switch benchmark for InteractiveViewer
+
+Compares the two ways of moving on to the next image on the headless Agg backend:
+  rebuild: a new InteractiveViewer with its own figure and buttons, closing the old one
+  reuse:   InteractiveViewer.set_image on the window that is already open
+Both include the first full draw of the new image, so the numbers are time-to-frame.
+
+Usage:
+  python benchmarks/bench_session.py --megapixels 0.3 12 --images 10
+"""
+from __future__ import print_function
+from __future__ import division
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import matplotlib
+matplotlib.use('Agg')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import annotate_faces  # noqa: E402
+from image_loader import load_image  # noqa: E402
+from bench_redraw import synthetic_image, summarize  # noqa: E402
+
+
+def time_rebuild(paths, images):
+    times = []
+    viewer = None
+    for path, image in zip(paths, images):
+        start = time.perf_counter()
+        if viewer is not None:
+            viewer.close()
+        viewer = annotate_faces.InteractiveViewer(path, image)
+        viewer.init_subplots()
+        viewer.connect()
+        viewer.fig.canvas.draw()
+        times.append(time.perf_counter() - start)
+    viewer.close()
+    return times
+
+
+def time_reuse(paths, images):
+    times = []
+    viewer = annotate_faces.InteractiveViewer(paths[0], images[0])
+    viewer.init_subplots()
+    viewer.connect()
+    viewer.fig.canvas.draw()
+    for path, image in zip(paths, images):
+        start = time.perf_counter()
+        # set_image requests the redraw itself; draw_idle renders synchronously on Agg
+        viewer.set_image(path, image)
+        times.append(time.perf_counter() - start)
+    viewer.close()
+    return times
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Measure per-image switch time of InteractiveViewer.')
+    parser.add_argument('-m', '--megapixels', type=float, nargs='+', default=[0.3, 12.0],
+                        help='synthetic image sizes to benchmark')
+    parser.add_argument('-n', '--images', type=int, default=10,
+                        help='number of image switches per size')
+    return parser.parse_args()
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for megapixels in args.megapixels:
+            paths = []
+            for i in range(2):
+                path = os.path.join(tmp_dir, 'synthetic_{}mp_{}.jpg'.format(megapixels, i))
+                width, height = synthetic_image(path, megapixels, seed=i)
+                paths.append(path)
+            # Decoding is not part of the switch; alternate between two pre-decoded images
+            decoded = [load_image(path) for path in paths]
+            paths = [paths[i % 2] for i in range(args.images)]
+            images = [decoded[i % 2] for i in range(args.images)]
+
+            print('{:.1f} MP ({}x{})'.format(megapixels, width, height))
+            print('  ' + summarize('rebuild', time_rebuild(paths, images)))
+            print('  ' + summarize('reuse', time_reuse(paths, images)))
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
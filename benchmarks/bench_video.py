@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""
+Video mode benchmark: frame access and optical-flow landmark propagation
+
+Writes a synthetic video (mp4v) of a textured scene that moves and turns by
+a known amount every frame, with the 68 landmarks of the bench_qa template
+face placed on it, and measures:
+  disk      the video against dumping every frame to JPEG (quality 95), the
+            workflow -v replaces
+  access    VideoFrames.get stepping forward (decode), stepping back within
+            the ring buffer, and jumping back past it (seek)
+  tracking  track_landmarks time per frame, and how far the landmarks drift
+            from their true position when they are carried over --frames
+            frames without any correction, and how many are dropped
+The landmarks are handed on the way annotate_video does it, as whole-pixel
+labels with their sub-pixel tracked positions; --pixel-labels hands on the
+rounded labels alone instead, to show the drift that rounding adds up to.
+
+Usage:
+  python benchmarks/bench_video.py --width 1920 --height 1080 --frames 100
+"""
+from __future__ import print_function
+from __future__ import division
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import numpy as np
+import cv2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from video_frames import VideoFrames, track_landmarks, label_points, pixel_labels  # noqa: E402
+from bench_qa import ibug68_template  # noqa: E402
+
+
+def scene_motion(t, width, height):
+    """Affine transform from the scene to frame t: a slow turn about the center and a drift to the right."""
+    angle = 0.2 * t
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    matrix[:, 2] += (1.3 * t, 0.4 * t)
+    return matrix
+
+
+def write_video(path, width, height, frames, rng):
+    # Blurred noise has texture at every scale, like skin and hair under a camera
+    scene = rng.integers(0, 256, (height // 4, width // 4, 3), dtype=np.uint8)
+    scene = cv2.GaussianBlur(cv2.resize(scene, (width, height), interpolation=cv2.INTER_CUBIC), (0, 0), 1.5)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), 25, (width, height))
+    jpeg_bytes = 0
+    for t in range(frames):
+        frame = cv2.warpAffine(scene, scene_motion(t, width, height), (width, height), borderMode=cv2.BORDER_REFLECT)
+        writer.write(frame)
+        jpeg_bytes += len(cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 95])[1])
+    writer.release()
+    return jpeg_bytes
+
+
+def true_landmarks(points, t, width, height):
+    matrix = scene_motion(t, width, height)
+    return points @ matrix[:, :2].T + matrix[:, 2]
+
+
+def time_get(frames, indices):
+    start = time.perf_counter()
+    for index in indices:
+        frames.get(index)
+    return (time.perf_counter() - start) / len(indices) * 1e3
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Measure video frame access and landmark tracking.')
+    parser.add_argument('--width', type=int, default=1920, help='video width')
+    parser.add_argument('--height', type=int, default=1080, help='video height')
+    parser.add_argument('--frames', type=int, default=100, help='frames in the video')
+    parser.add_argument('--pixel-labels', action='store_true',
+                        help='track from the rounded labels, without the sub-pixel positions')
+    return parser.parse_args()
+
+
+def main(args):
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        video_path = os.path.join(tmp_dir, 'talk.mp4')
+        jpeg_bytes = write_video(video_path, args.width, args.height, args.frames, rng)
+        print('{} frames of {}x{}'.format(args.frames, args.width, args.height))
+        print('  disk: video {:.1f} MB, frames as JPEG {:.1f} MB'.format(os.path.getsize(video_path) / 1e6,
+                                                                        jpeg_bytes / 1e6))
+
+        frames = VideoFrames(video_path)
+        forward = time_get(frames, range(args.frames))
+        back = time_get(frames, range(args.frames - 2, args.frames - 2 - frames.ring_frames + 1, -1))
+        jumps = list(range(args.frames - frames.ring_frames - 1, 0, -max(args.frames // 10, 1)))
+        seek = time_get(frames, jumps)
+        print('  access ms per frame: forward {:.1f}, back in ring {:.3f}, back by seeking {:.1f}'.format(
+            forward, back, seek))
+
+        # The template face, a third of the frame high, on the scene at frame 0
+        points = ibug68_template() * args.height / 3 + (args.width / 2, args.height / 2)
+        coords = pixel_labels(points)
+        tracked = None
+        track_times = []
+        for t in range(1, args.frames):
+            # As annotate_video does it, with every label left where it was tracked to
+            start = time.perf_counter()
+            tracked = track_landmarks(frames.get(t - 1), frames.get(t),
+                                      label_points(coords, None if args.pixel_labels else tracked))
+            track_times.append(time.perf_counter() - start)
+            coords = pixel_labels(tracked)
+        truth = true_landmarks(points, args.frames - 1, args.width, args.height)
+        kept = [k for k, xy in enumerate(coords) if xy is not None]
+        drift = np.linalg.norm(np.array([coords[k] for k in kept], dtype=float) - truth[kept], axis=1)
+        print('  tracking: {:.1f} ms per frame; after {} frames {} of 68 landmarks kept, drift median {:.2f} px, '
+              'max {:.2f} px'.format(np.median(track_times) * 1e3, args.frames - 1, len(kept),
+                                     np.median(drift) if len(kept) else np.nan, drift.max() if len(kept) else np.nan))
+        frames.close()
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
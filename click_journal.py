@@ -0,0 +1,222 @@
+"""
+Write-ahead journal of in-progress annotations
+
+Annotations reach the output only when Done is pressed. Until then every placed, moved or cleared label is
+appended to a ClickJournal (by default <output>.journal), so a crash, a killed X session or pressing q loses
+no work: the next time the viewer opens that image, the journal is replayed into its coords_list.
+
+The journal is a text file of one record per line:
+  I<TAB><img_path>                    following records belong to this image
+  S<TAB><k><TAB><x><TAB><y>           landmark k (1-based) placed at (x, y)
+  S<TAB>0<TAB><x0><TAB><y0><TAB><x1><TAB><y1>   bounding box
+  C<TAB><k>                           landmark k cleared
+Every record is flushed to the OS right away, which survives the process dying. fsync, which also survives
+the machine going down, is batched: it runs every sync_every records or sync_interval seconds, on close, and
+when the journal is compacted.
+
+Once an image is saved or skipped its records are dropped: the journal is rewritten (atomically) with only
+the images that still have unfinished work, which is usually none.
+
+Since compacting replaces the file, a journal must have one writer. Processes that share an output (--shard,
+--connect) therefore each journal to a file of their own, named <host>-<pid>-<session>.journal like their
+shards, and adopt_journals moves the journals of this host's processes that are no longer running into the
+journal of the new process, so a restarted session still restores them.
+"""
+from __future__ import print_function
+from __future__ import division
+import os
+import glob
+import time
+import socket
+
+from annotation_io import image_key
+
+
+class ClickJournal(object):
+    """
+    ClickJournal - Class
+
+    Append-only journal of the labels of images that are not saved yet.
+
+    Functions:
+    __init__: Requires the journal path. Reads the unfinished images of an existing journal (a torn last line
+    from a crash is dropped) and opens it for appending.
+
+    load: Replays the journal file into the unfinished labels of every image. Used by: __init__
+
+    __len__: Returns the number of images with unfinished work.
+
+    begin: Starts journaling an image. Returns the labels recorded for it earlier as {k: coords}, where k = 0
+    is the bounding box [(x0, y0), (x1, y1)] and k >= 1 a landmark (x, y).
+
+    record: Appends label k of the current image (None clears it).
+
+    complete: Drops the records of saved or skipped images and compacts the journal. Images may be completed
+    while another one is being journaled, e.g. once a batch of them reached a work server.
+
+    compact: Atomically rewrites the journal with one record per label of the images with unfinished work.
+    Used by: complete
+
+    sync: Forces the records written so far to disk.
+
+    close: Syncs and closes the journal.
+    """
+
+    def __init__(self, path, sync_every=32, sync_interval=2.0):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        # image key -> {k: coords} of every image with unfinished work
+        self.pending = {}
+        self.current = None
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+        if os.path.exists(path):
+            self.load()
+        self.f = open(path, 'a', encoding='utf-8')
+
+    def load(self):
+        valid_bytes = 0
+        labels = None
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                valid_bytes += len(line)
+                fields = line.decode('utf-8').rstrip('\n').split('\t')
+                if fields[0] == 'I':
+                    labels = self.pending.setdefault(image_key(fields[1]), {})
+                elif labels is None:
+                    continue
+                elif fields[0] == 'S' and fields[1] == '0':
+                    x0, y0, x1, y1 = (int(value) for value in fields[2:6])
+                    labels[0] = [(x0, y0), (x1, y1)]
+                elif fields[0] == 'S':
+                    labels[int(fields[1])] = (int(fields[2]), int(fields[3]))
+                elif fields[0] == 'C':
+                    labels.pop(int(fields[1]), None)
+        if os.path.getsize(self.path) > valid_bytes:
+            # Torn last record of a crashed session
+            os.truncate(self.path, valid_bytes)
+
+        for key in [key for key, labels in self.pending.items() if not labels]:
+            del self.pending[key]
+
+    def __len__(self):
+        return len(self.pending)
+
+    def begin(self, img_path):
+        self.current = image_key(img_path)
+        recovered = dict(self.pending.get(self.current, {}))
+        self.pending.setdefault(self.current, {})
+        self.write(f"I\t{self.current}")
+        return recovered
+
+    def record(self, k, coords):
+        labels = self.pending[self.current]
+        if coords is None:
+            labels.pop(k, None)
+            self.write(f"C\t{k}")
+        elif k == 0:
+            (x0, y0), (x1, y1) = coords
+            labels[0] = [(x0, y0), (x1, y1)]
+            self.write(f"S\t0\t{x0}\t{y0}\t{x1}\t{y1}")
+        else:
+            labels[k] = tuple(coords)
+            self.write(f"S\t{k}\t{coords[0]}\t{coords[1]}")
+
+    def write(self, line):
+        self.f.write(line + '\n')
+        self.f.flush()
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every or time.monotonic() - self.last_sync >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        if self.unsynced:
+            os.fsync(self.f.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def complete(self, *img_paths):
+        for img_path in img_paths:
+            key = image_key(img_path)
+            self.pending.pop(key, None)
+            if key == self.current:
+                self.current = None
+        self.compact()
+
+    def compact(self):
+        self.f.close()
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            # The image being journaled goes last, so the records appended after compacting still follow its I line
+            keys = [key for key in self.pending if key != self.current]
+            for key in keys + ([self.current] if self.current is not None else []):
+                labels = self.pending[key]
+                if not labels and key != self.current:
+                    continue
+                f.write(f"I\t{key}\n")
+                for k, coords in sorted(labels.items()):
+                    if k == 0:
+                        (x0, y0), (x1, y1) = coords
+                        f.write(f"S\t0\t{x0}\t{y0}\t{x1}\t{y1}\n")
+                    else:
+                        f.write(f"S\t{k}\t{coords[0]}\t{coords[1]}\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+        self.f = open(self.path, 'a', encoding='utf-8')
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        self.sync()
+        self.f.close()
+
+
+def process_running(pid):
+    if os.name == 'nt':
+        # os.kill would terminate the process; treat it as running, so its journal is never taken over
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def adopt_journals(path):
+    """
+    Appends the journals <host>-<pid>-*.journal next to path of this host's processes that are no longer
+    running to the journal at path and removes them. Returns the number of journals adopted. Every journal is
+    renamed before it is read, so of several processes starting at once only one adopts it.
+    """
+    host = socket.gethostname()
+    directory = os.path.dirname(path) or '.'
+    adopted = 0
+    for other in sorted(glob.glob(os.path.join(glob.escape(directory), glob.escape(host) + '-*.journal'))):
+        pid = os.path.basename(other)[len(host) + 1:].split('-', 1)[0]
+        if os.path.abspath(other) == os.path.abspath(path) or not pid.isdigit() or process_running(int(pid)):
+            continue
+        claimed = path + '.adopt'
+        try:
+            os.rename(other, claimed)
+        except FileNotFoundError:
+            # Adopted by another process
+            continue
+        with open(claimed, 'rb') as f:
+            data = f.read()
+        # Without a torn last record, which would run into the first record appended after it
+        data = data[:data.rfind(b'\n') + 1]
+        with open(path, 'ab') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.remove(claimed)
+        adopted += 1
+    return adopted
@@ -0,0 +1,196 @@
+"""
+Contact sheet browser for directory mode
+
+ContactSheet shows the images of a dataset as a paged grid of thumbnails, framed by their state:
+  green   done      the image has an annotation in the output
+  orange  skipped   the image was skipped in the viewer (<output>.skipped)
+  grey    pending   neither
+Clicking a thumbnail returns its image from run, and the caller opens it in InteractiveViewer. Thumbnails
+come from a ThumbnailCache: the page on screen is requested first and the next page after it, and they are
+filled in as they arrive, so paging never waits for a decode.
+
+Keys: right / pagedown next page, left / pageup previous page, home / end first and last page, n the next
+page with a pending image, q or closing the window quits.
+"""
+from __future__ import print_function
+from __future__ import division
+import os
+import math
+
+import numpy as np
+from matplotlib import pyplot as plt
+
+STATE_COLORS = {'done': '#2ca02c', 'skipped': '#ff7f0e', 'pending': '#7f7f7f'}
+
+# Thumbnails that arrived are put on screen at this interval (ms) while any are outstanding
+POLL_INTERVAL_MS = 100
+
+
+class ContactSheet(object):
+    """
+    ContactSheet - Class
+
+    Paged thumbnail grid of a dataset with the annotation state of every image.
+
+    Functions:
+    __init__: Requires the ordered image paths, a function returning the state ('done', 'skipped' or
+    'pending') of an image path and a ThumbnailCache. rows and cols set the grid size.
+
+    run: Shows the sheet and blocks in the event loop until a thumbnail is clicked or the sheet is closed.
+    Returns the index of the clicked image, or None.
+
+    show_page: Shows page number page and requests its thumbnails (and those of the next page).
+
+    refresh_states: Re-reads the state of every image on the page, e.g. after one was annotated.
+
+    close: Closes the window.
+    """
+
+    def __init__(self, img_paths, state, thumbnails, rows=5, cols=8):
+        self.img_paths = img_paths
+        self.state = state
+        self.thumbnails = thumbnails
+        self.rows = rows
+        self.cols = cols
+        self.per_page = rows * cols
+        self.pages = max(1, math.ceil(len(img_paths) / self.per_page))
+        self.page = 0
+        # img_path -> RGB thumbnail (None if unreadable) of the pages requested last
+        self.loaded = {}
+
+        self.fig = None
+        self.axes = []
+        self.artists = []
+        self.timer = None
+        self.clicked = None
+        self.is_quit = False
+        self.is_closed = False
+
+    def init_figure(self):
+        self.fig = plt.figure('Contact sheet', figsize=(self.cols * 1.6, self.rows * 1.8 + 0.6))
+        self.fig.subplots_adjust(left=0.01, right=0.99, bottom=0.01, top=0.93, wspace=0.05, hspace=0.25)
+        blank = np.zeros((self.thumbnails.size, self.thumbnails.size, 3), dtype=np.uint8)
+        for slot in range(self.per_page):
+            ax = self.fig.add_subplot(self.rows, self.cols, slot + 1)
+            ax.set_xticks([])
+            ax.set_yticks([])
+            self.axes.append(ax)
+            self.artists.append(ax.imshow(blank, interpolation='nearest'))
+        self.fig.canvas.mpl_connect('button_press_event', self.on_click)
+        self.fig.canvas.mpl_connect('key_press_event', self.on_key_press)
+        self.fig.canvas.mpl_connect('close_event', self.on_close)
+        self.timer = self.fig.canvas.new_timer(interval=POLL_INTERVAL_MS)
+        self.timer.add_callback(self.on_timer)
+
+    def page_paths(self, page):
+        return self.img_paths[page * self.per_page:(page + 1) * self.per_page]
+
+    def show_page(self, page):
+        self.page = min(max(page, 0), self.pages - 1)
+        wanted = self.page_paths(self.page) + self.page_paths(self.page + 1)
+        self.loaded = {img_path: self.loaded[img_path] for img_path in wanted if img_path in self.loaded}
+        self.thumbnails.request([img_path for img_path in wanted if img_path not in self.loaded])
+
+        paths = self.page_paths(self.page)
+        for slot, (ax, artist) in enumerate(zip(self.axes, self.artists)):
+            if slot >= len(paths):
+                ax.set_visible(False)
+                continue
+            ax.set_visible(True)
+            self.show_thumbnail(slot, paths[slot])
+        self.refresh_states()
+        self.start_polling()
+
+    def show_thumbnail(self, slot, img_path):
+        thumbnail = self.loaded.get(img_path)
+        if thumbnail is None:
+            # Not there yet, or unreadable
+            thumbnail = np.zeros((self.thumbnails.size, self.thumbnails.size, 3), dtype=np.uint8)
+        self.artists[slot].set_data(thumbnail)
+
+    def refresh_states(self):
+        counts = {'done': 0, 'skipped': 0, 'pending': 0}
+        paths = self.page_paths(self.page)
+        for slot, img_path in enumerate(paths):
+            state = self.state(img_path)
+            counts[state] += 1
+            ax = self.axes[slot]
+            ax.set_title(f"{self.page * self.per_page + slot + 1}: {os.path.basename(img_path)[-18:]}",
+                         fontsize=7, color=STATE_COLORS[state])
+            for spine in ax.spines.values():
+                spine.set_edgecolor(STATE_COLORS[state])
+                spine.set_linewidth(1 if state == 'pending' else 3)
+        self.fig.suptitle(f"Page {self.page + 1}/{self.pages} of {len(self.img_paths)} images - this page: "
+                          f"{counts['done']} done, {counts['skipped']} skipped, {counts['pending']} pending   "
+                          f"(arrows: page, n: next pending, click: annotate)", fontsize=9)
+        self.fig.canvas.draw_idle()
+
+    def start_polling(self):
+        if self.thumbnails.pending():
+            self.timer.start()
+
+    def on_timer(self):
+        paths = self.page_paths(self.page)
+        slots = {img_path: slot for slot, img_path in enumerate(paths)}
+        changed = False
+        for img_path, thumbnail in self.thumbnails.pop_ready():
+            self.loaded[img_path] = thumbnail
+            if img_path in slots:
+                self.show_thumbnail(slots[img_path], img_path)
+                changed = True
+        if changed:
+            self.fig.canvas.draw_idle()
+        if not self.thumbnails.pending():
+            # Idle again; nothing is polled until the next page is requested
+            self.timer.stop()
+
+    def next_pending_page(self):
+        for index in range((self.page + 1) * self.per_page, len(self.img_paths)):
+            if self.state(self.img_paths[index]) == 'pending':
+                return index // self.per_page
+        return self.page
+
+    def on_key_press(self, event):
+        pages = {'right': self.page + 1, 'pagedown': self.page + 1, 'left': self.page - 1, 'pageup': self.page - 1,
+                 'home': 0, 'end': self.pages - 1}
+        if event.key in pages:
+            self.show_page(pages[event.key])
+        elif event.key == 'n':
+            self.show_page(self.next_pending_page())
+        elif event.key == 'q':
+            self.is_quit = True
+            self.fig.canvas.stop_event_loop()
+
+    def on_click(self, event):
+        if event.inaxes not in self.axes:
+            return
+        index = self.page * self.per_page + self.axes.index(event.inaxes)
+        if index < len(self.img_paths):
+            self.clicked = index
+            self.fig.canvas.stop_event_loop()
+
+    def on_close(self, event):
+        self.is_closed = True
+        event.canvas.stop_event_loop()
+
+    def run(self):
+        if self.fig is None:
+            self.init_figure()
+            self.show_page(self.page)
+        else:
+            self.refresh_states()
+            self.start_polling()
+        plt.show(block=False)
+
+        self.clicked = None
+        if not (self.is_quit or self.is_closed):
+            self.fig.canvas.start_event_loop(timeout=0)
+        return None if self.is_quit or self.is_closed else self.clicked
+
+    def close(self):
+        if self.fig is None:
+            return
+        self.timer.stop()
+        if not self.is_closed:
+            plt.close(self.fig)
+        self.fig = None
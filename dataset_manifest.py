@@ -0,0 +1,109 @@
+"""
+Dataset manifest for the Face-Annotation-Tool directory mode
+
+build_manifest returns the sorted list of image files below a dataset root. Directories are listed in
+parallel with os.scandir on a thread pool (listing network-mounted storage is latency bound, so many
+requests in flight help), and only files with an image extension are kept.
+
+The result can be persisted to a JSON manifest together with the listing and mtime of every directory.
+On the next run a directory whose mtime did not change is not listed again: its cached files and
+subdirectories are reused and only its subdirectories are stat'ed. Adding or removing an entry changes the
+mtime of the directory holding it, so this catches every change to the tree.
+"""
+from __future__ import print_function
+from __future__ import division
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp', '.jp2', '.pgm', '.ppm'}
+
+MANIFEST_VERSION = 1
+
+
+def is_image_file(name):
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+def scan_directory(path):
+    """Lists one directory. Returns (mtime_ns, sorted image file names, sorted subdirectory names)."""
+    mtime_ns = os.stat(path).st_mtime_ns
+    files = []
+    dirs = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                # Symlinked directories are not followed, so a link cycle cannot make the walk endless
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.name)
+                elif entry.is_file() and is_image_file(entry.name):
+                    files.append(entry.name)
+            except OSError:
+                # Entry vanished or is unreadable while we were listing
+                continue
+    return mtime_ns, sorted(files), sorted(dirs)
+
+
+def load_manifest(manifest_path, root):
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    if manifest.get('version') != MANIFEST_VERSION or manifest.get('root') != os.path.abspath(root):
+        return {}
+    return manifest.get('dirs', {})
+
+
+def save_manifest(manifest_path, root, dirs, img_paths):
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'root': os.path.abspath(root),
+        'dirs': dirs,
+        'images': img_paths,
+    }
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+
+def build_manifest(root, manifest_path=None, recursive=True, workers=16):
+    """
+    Returns the sorted paths (os.path.join(root, relative path)) of all image files below root.
+
+    recursive=False only lists root itself. With manifest_path, the directory listings are cached in that file
+    and directories whose mtime is unchanged since the last run are not listed again.
+    """
+    cached = load_manifest(manifest_path, root) if manifest_path is not None else {}
+    dirs = {}
+
+    def visit(rel_dir):
+        path = os.path.join(root, rel_dir) if rel_dir else root
+        entry = cached.get(rel_dir)
+        if entry is not None and os.stat(path).st_mtime_ns == entry['mtime_ns']:
+            return rel_dir, entry
+        mtime_ns, files, subdirs = scan_directory(path)
+        return rel_dir, {'mtime_ns': mtime_ns, 'files': files, 'dirs': subdirs}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(visit, '')}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    rel_dir, entry = future.result()
+                except OSError:
+                    # A directory removed or unreadable during the walk is treated as empty
+                    continue
+                dirs[rel_dir] = entry
+                if recursive:
+                    for name in entry['dirs']:
+                        pending.add(executor.submit(visit, os.path.join(rel_dir, name) if rel_dir else name))
+
+    img_paths = sorted(os.path.join(root, rel_dir, name) if rel_dir else os.path.join(root, name)
+                       for rel_dir, entry in dirs.items() for name in entry['files'])
+
+    if manifest_path is not None:
+        save_manifest(manifest_path, root, dirs, img_paths)
+    return img_paths
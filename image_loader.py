@@ -0,0 +1,449 @@
+"""
+Image loading for the Face-Annotation-Tool
+
+load_image decodes a single image into an RGB array, decode_image does the same for an image file already
+read into memory. Both read the file once, swap BGR to RGB in place and apply the EXIF orientation
+themselves (OpenCV is told to ignore it, so it is applied exactly once whichever OpenCV version decodes). A
+JPEG can be decoded at 1/2, 1/4 or 1/8 resolution, which libjpeg does during decoding.
+
+load_display_image / display_image return the DisplayPyramid that InteractiveViewer shows. A JPEG larger
+than the overview is decoded straight at the overview resolution, so the first frame needs neither the
+time nor the memory of a full-resolution decode; the full resolution is decoded once the annotator zooms
+in, and dropped again when the image leaves the screen.
+
+ImagePrefetcher decodes the images that come next in directory mode on a small thread pool
+(cv2.imdecode releases the GIL while decoding), and keeps decoded images in an LRU cache bounded by a
+memory budget. Advancing to the next image is then a cache hit, and going back to a recently seen
+image does not decode it again. A cached DisplayPyramid reports every level it builds later, so the budget
+also covers the levels of the image on screen.
+
+DisplayPyramid serves very large images to the viewer at the resolution the screen can actually show: a
+downsampled overview of the whole image, and a crop of the finest useful pyramid level for a zoomed-in
+viewport. Coordinates are always full-resolution pixel coordinates.
+"""
+from __future__ import print_function
+from __future__ import division
+import math
+import struct
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+# Longest side, in pixels, of the pyramid level shown while the whole image is on screen
+OVERVIEW_SIZE = 2048
+
+# Frame header markers (SOF0-SOF15 except DHT, JPG and DAC)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+REDUCED_DECODE_FLAGS = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4,
+                        8: cv2.IMREAD_REDUCED_COLOR_8}
+
+
+def jpeg_header(data):
+    """
+    Returns (width, height, orientation) of JPEG data (a bytes-like object) from its SOF and EXIF segments,
+    without decoding it, or None if data is not a JPEG. width and height are before the orientation is applied.
+    """
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    orientation = 1
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # Fill byte
+            pos += 1
+            continue
+        length = struct.unpack_from('>H', data, pos + 2)[0]
+        if marker == 0xE1 and bytes(data[pos + 4:pos + 10]) == b'Exif\0\0':
+            orientation = exif_orientation(data, pos + 10, pos + 2 + length)
+        elif marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack_from('>HH', data, pos + 5)
+            return width, height, orientation
+        elif marker == 0xDA:
+            # Start of scan without a frame header
+            return None
+        pos += 2 + length
+    return None
+
+
+def exif_orientation(data, start, end):
+    """Returns the Orientation tag of the EXIF (TIFF) block in data[start:end], 1 if it has none."""
+    try:
+        order = '<' if bytes(data[start:start + 2]) == b'II' else '>'
+        ifd = start + struct.unpack_from(order + 'I', data, start + 4)[0]
+        for entry in range(struct.unpack_from(order + 'H', data, ifd)[0]):
+            tag, kind, count, value = struct.unpack_from(order + 'HHIH', data, ifd + 2 + 12 * entry)
+            if tag == 0x0112 and ifd + 14 + 12 * entry <= end:
+                return value if 1 <= value <= 8 else 1
+    except struct.error:
+        pass
+    return 1
+
+
+def apply_orientation(image, orientation):
+    """Turns an image as stored into the image as displayed, for EXIF orientation 1 to 8."""
+    if orientation == 2:
+        return cv2.flip(image, 1)
+    if orientation == 3:
+        return cv2.rotate(image, cv2.ROTATE_180)
+    if orientation == 4:
+        return cv2.flip(image, 0)
+    if orientation == 5:
+        return cv2.transpose(image)
+    if orientation == 6:
+        return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
+    if orientation == 7:
+        return cv2.flip(cv2.transpose(image), -1)
+    if orientation == 8:
+        return cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return image
+
+
+def decode_image(data, img_path, reduce=1):
+    """
+    Decodes an encoded image file held in memory (bytes or a uint8 array) into RGB. reduce (1, 2, 4 or 8)
+    decodes a JPEG at that fraction of its resolution, which libjpeg does while decoding, for a fraction of
+    the time and memory. EXIF orientation is applied here, once.
+    """
+    header = jpeg_header(data)
+    if header is None:
+        # Not a JPEG: OpenCV applies any orientation itself, and there is no reduced decode
+        flags = cv2.IMREAD_COLOR
+    else:
+        flags = REDUCED_DECODE_FLAGS[reduce] | cv2.IMREAD_IGNORE_ORIENTATION
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+    if image is None:
+        raise IOError(f"could not decode image {img_path}")
+    # In place; the decoded BGR image is not needed
+    cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=image)
+    if header is not None:
+        image = apply_orientation(image, header[2])
+    return image
+
+
+def load_image(img_path, reduce=1):
+    try:
+        data = np.fromfile(img_path, dtype=np.uint8)
+    except (IOError, OSError):
+        raise IOError(f"could not read image {img_path}")
+    return decode_image(data, img_path, reduce)
+
+
+def display_image(data, img_path, reduce='auto', overview_size=OVERVIEW_SIZE):
+    """
+    Returns a DisplayPyramid of an encoded image file held in memory. With reduce 'auto', a JPEG too large to
+    be shown whole at full resolution is decoded at the resolution of the overview only, and at full
+    resolution the first time a zoomed-in view needs it. reduce 1 always decodes the full resolution.
+    """
+    header = jpeg_header(data)
+    if header is None or reduce == 1:
+        return DisplayPyramid(decode_image(data, img_path), overview_size)
+
+    width, height, orientation = header
+    if orientation >= 5:
+        width, height = height, width
+    if reduce == 'auto':
+        reduce = 1
+        # The overview is the first pyramid level no larger than overview_size; decode straight to it
+        while reduce < 8 and max(width, height) / reduce > overview_size:
+            reduce *= 2
+    if reduce == 1:
+        return DisplayPyramid(decode_image(data, img_path), overview_size)
+    return DisplayPyramid(decode_image(data, img_path, reduce), overview_size, full_size=(height, width),
+                          load_full=lambda: decode_image(data, img_path))
+
+
+def load_display_image(img_path, reduce='auto', overview_size=OVERVIEW_SIZE):
+    try:
+        data = np.fromfile(img_path, dtype=np.uint8)
+    except (IOError, OSError):
+        raise IOError(f"could not read image {img_path}")
+    return display_image(data, img_path, reduce, overview_size)
+
+
+class ImagePrefetcher(object):
+    """
+    ImagePrefetcher - Class
+
+    Decodes images of an ordered path list ahead of time and caches them.
+
+    Functions:
+    __init__: Requires the ordered list of image paths. prefetch is the number of images after the requested
+    one that are decoded in the background, max_bytes bounds the memory used by decoded images and workers is
+    the size of the decoding thread pool.
+
+    get: Returns the decoded image at position index of the path list. Served from the cache when possible,
+    otherwise waits for (or starts) its decode. Schedules the next prefetch images.
+
+    close: Cancels pending decodes and shuts the thread pool down.
+    """
+
+    def __init__(self, paths, prefetch=4, max_bytes=1024 * 1024 * 1024, workers=2, loader=load_image):
+        self.paths = list(paths)
+        self.prefetch = prefetch
+        self.max_bytes = max_bytes
+        self.loader = loader
+
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.RLock()
+
+        # path -> decoded image (an array or a DisplayPyramid), least recently used first
+        self.cache = OrderedDict()
+        # path -> bytes counted for it, kept up to date as pyramids build and drop levels
+        self.sizes = {}
+        self.cache_bytes = 0
+        # path -> Future of a decode that has not landed in the cache yet
+        self.pending = {}
+        # The image on screen is never evicted, even if it alone exceeds the budget
+        self.pinned = None
+
+    def _store(self, path, image):
+        with self.lock:
+            if path in self.cache:
+                return
+            self.cache[path] = image
+            if isinstance(image, DisplayPyramid):
+                image.on_resize = lambda image=image, path=path: self._resized(path, image)
+                self.sizes[path] = image.nbytes()
+            else:
+                self.sizes[path] = image.nbytes
+            self.cache_bytes += self.sizes[path]
+            self._evict()
+
+    def _resized(self, path, pyramid):
+        # A cached pyramid built or dropped levels
+        with self.lock:
+            if self.cache.get(path) is not pyramid:
+                return
+            size = pyramid.nbytes()
+            self.cache_bytes += size - self.sizes[path]
+            self.sizes[path] = size
+            self._evict()
+
+    def _evict(self):
+        for path in list(self.cache):
+            if self.cache_bytes <= self.max_bytes:
+                break
+            if path == self.pinned:
+                continue
+            del self.cache[path]
+            self.cache_bytes -= self.sizes.pop(path)
+
+    def _on_decoded(self, path, future):
+        with self.lock:
+            self.pending.pop(path, None)
+        if not future.cancelled() and future.exception() is None:
+            self._store(path, future.result())
+
+    def _schedule(self, path):
+        # Must be called with the lock held
+        if path in self.cache or path in self.pending:
+            return self.pending.get(path)
+        future = self.executor.submit(self.loader, path)
+        self.pending[path] = future
+        future.add_done_callback(lambda done, path=path: self._on_decoded(path, done))
+        return future
+
+    def get(self, index):
+        path = self.paths[index]
+
+        with self.lock:
+            previous = self.cache.get(self.pinned) if self.pinned != path else None
+            self.pinned = path
+            if isinstance(previous, DisplayPyramid):
+                # The full resolution of a reduced decode is only kept while its image is on screen
+                previous.release_full()
+            image = self.cache.get(path)
+            if image is not None:
+                self.cache.move_to_end(path)
+                future = None
+            else:
+                future = self._schedule(path)
+            for ahead in self.paths[index + 1:index + 1 + self.prefetch]:
+                self._schedule(ahead)
+
+        if image is None:
+            image = future.result()
+            self._store(path, image)
+        return image
+
+    def close(self):
+        with self.lock:
+            for future in self.pending.values():
+                future.cancel()
+            self.pending.clear()
+        self.executor.shutdown(wait=True)
+
+
+class DisplayPyramid(object):
+    """
+    DisplayPyramid - Class
+
+    Mipmap of an image for display. Level 0 is the full-resolution image itself (not copied), every further
+    level halves the resolution with cv2.pyrDown. Levels are built lazily and kept for the lifetime of the
+    pyramid, which adds at most a third of the full-resolution size.
+
+    The pyramid can also start from a coarser level, e.g. a JPEG decoded at reduced resolution: then
+    full_size is the (height, width) of level 0 and load_full returns the full-resolution image, which is
+    only called once a finer level than the given one is needed, or by load_full_in_background. Levels are
+    built under a lock, so a background decode and the viewer never decode the same image twice. If the full
+    resolution cannot be decoded, level raises IOError once and the finer levels fall back to the given one.
+    on_resize, if set, is called (without the lock held) whenever levels were built or dropped.
+
+    Functions:
+    __init__: Requires the image. overview_size is the longest side, in pixels, of the overview level used when
+    the whole image is on screen. full_size and load_full are given when image is not the full resolution.
+
+    level: Returns pyramid level k, building the missing levels on the way.
+
+    overview: Returns the overview level.
+
+    full: Returns the full-resolution image (level 0).
+
+    finest: Returns the number of the finest level built so far, without building any.
+
+    load_full_in_background: Starts decoding the full resolution on the given executor. Returns the Future of
+    the decode, which raises its error, or None if the full resolution is there, failed or is being decoded.
+
+    release_full: Drops the levels finer than the given image, which load_full can decode again, and cancels a
+    background decode that has not started.
+
+    nbytes: Returns the memory held by the levels built so far.
+
+    region: Returns (crop, extent) for the full-resolution region x0..x1, y0..y1 cut from level k. crop is a
+    view into the level and extent places it in full-resolution coordinates (as imshow's extent). Returns None
+    if the region lies outside the image.
+
+    viewport: Returns region for the full-resolution region x0..x1, y0..y1 shown on display_width x
+    display_height screen pixels, from the coarsest level that still has at least one pixel per screen pixel,
+    or from the finest level built while the full resolution is not loaded. Returns None when the overview is
+    already fine enough for that viewport.
+    """
+
+    def __init__(self, image, overview_size=OVERVIEW_SIZE, full_size=None, load_full=None):
+        self.height, self.width = image.shape[:2] if full_size is None else full_size
+        self.load_full = load_full
+
+        # Levels finer than the given image are None until the full resolution is loaded
+        base = 0
+        while (self.width + 2 ** base - 1) // 2 ** base > image.shape[1]:
+            base += 1
+        self.base = base
+        self.levels = [None] * base + [image]
+        self.lock = threading.Lock()
+        self.full_future = None
+        self.full_failed = False
+        self.on_resize = None
+
+        self.overview_level = 0
+        while max(self.height, self.width) / 2 ** self.overview_level > overview_size:
+            self.overview_level += 1
+
+    def level(self, k):
+        # Built levels are returned without the lock, so a decode in the background never blocks them
+        if k < len(self.levels) and self.levels[k] is not None:
+            return self.levels[k]
+        with self.lock:
+            if k < len(self.levels) and self.levels[k] is None:
+                if self.full_failed:
+                    return self.levels[self.finest()]
+                if self.levels[0] is None:
+                    try:
+                        self.levels[0] = self.load_full()
+                    except (IOError, OSError):
+                        self.full_failed = True
+                        raise
+                    except cv2.error as e:
+                        self.full_failed = True
+                        raise IOError(f"could not decode the full resolution: {e}")
+                for i in range(1, k + 1):
+                    if self.levels[i] is None:
+                        self.levels[i] = cv2.pyrDown(self.levels[i - 1])
+            while len(self.levels) <= k:
+                self.levels.append(cv2.pyrDown(self.levels[-1]))
+            level = self.levels[k]
+        if self.on_resize is not None:
+            self.on_resize()
+        return level
+
+    def full(self):
+        return self.level(0)
+
+    def finest(self):
+        return next(k for k, level in enumerate(self.levels) if level is not None)
+
+    def load_full_in_background(self, executor):
+        with self.lock:
+            if self.levels[0] is not None or self.full_failed:
+                return None
+            if self.full_future is not None and not self.full_future.done():
+                return None
+            self.full_future = executor.submit(self.full)
+            return self.full_future
+
+    def release_full(self):
+        if self.full_future is not None:
+            # A decode that has not started yet is no longer needed; a running one finishes before the lock is free
+            self.full_future.cancel()
+        with self.lock:
+            if self.base == 0 or self.levels[0] is None:
+                return
+            self.levels[:self.base] = [None] * self.base
+        if self.on_resize is not None:
+            self.on_resize()
+
+    def nbytes(self):
+        return sum(level.nbytes for level in self.levels if level is not None)
+
+    def overview(self):
+        return self.level(self.overview_level)
+
+    def region(self, k, x0, x1, y0, y1):
+        x0, x1 = sorted((x0, x1))
+        y0, y1 = sorted((y0, y1))
+        x0, y0 = max(x0, -0.5), max(y0, -0.5)
+        x1, y1 = min(x1, self.width - 0.5), min(y1, self.height - 0.5)
+        if x1 <= x0 or y1 <= y0:
+            return None
+
+        level = self.level(k)
+        scale_x = self.width / level.shape[1]
+        scale_y = self.height / level.shape[0]
+
+        # Level pixel i covers full-resolution [i * scale - 0.5, (i + 1) * scale - 0.5)
+        c0 = max(int(math.floor((x0 + 0.5) / scale_x)), 0)
+        c1 = min(int(math.ceil((x1 + 0.5) / scale_x)), level.shape[1])
+        r0 = max(int(math.floor((y0 + 0.5) / scale_y)), 0)
+        r1 = min(int(math.ceil((y1 + 0.5) / scale_y)), level.shape[0])
+
+        crop = level[r0:r1, c0:c1]
+        extent = (c0 * scale_x - 0.5, c1 * scale_x - 0.5, r1 * scale_y - 0.5, r0 * scale_y - 0.5)
+        return crop, extent
+
+    def viewport(self, x0, x1, y0, y1, display_width, display_height):
+        if x1 == x0 or y1 == y0 or display_width <= 0 or display_height <= 0:
+            return None
+
+        # Full-resolution pixels per screen pixel decides how far down the pyramid we may go. Only the part of
+        # the viewport inside the image counts.
+        width = min(max(x0, x1), self.width - 0.5) - max(min(x0, x1), -0.5)
+        height = min(max(y0, y1), self.height - 0.5) - max(min(y0, y1), -0.5)
+        if width <= 0 or height <= 0:
+            return None
+        density = min(width / display_width, height / display_height)
+        k = int(math.floor(math.log2(density))) if density >= 1 else 0
+        k = min(max(k, 0), self.overview_level)
+        if self.levels[0] is None:
+            # Never decodes the full resolution on the caller's thread; until it is loaded (see
+            # load_full_in_background) the finest level there is stands in
+            k = max(k, self.finest())
+        if k >= self.overview_level:
+            return None
+
+        return self.region(k, x0, x1, y0, y1)
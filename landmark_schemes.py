@@ -0,0 +1,81 @@
+"""
+Landmark schemes for the Face-Annotation-Tool
+
+A landmark scheme defines how many landmarks are annotated per face and which of them are joined into
+contours in the overlay. Schemes are JSON files:
+  {
+    "name": "iBUG-68",
+    "landmarks": 68,
+    "contours": [[1, 2, ..., 17], [37, 38, ..., 42, 37], ...],
+    "symmetry": [[1, 17], [2, 16], ..., [37, 46], ...],
+    "interocular": [37, 46]
+  }
+Landmarks are numbered from 1, as on the buttons and in the output. A closed contour repeats its first point.
+symmetry (optional) pairs every landmark on the left of the face with its mirror image on the right; the
+annotation QA checks that every pair is in the right order. interocular (optional) is the pair whose distance
+(usually the outer eye corners) normalizes the errors of the inter-annotator agreement.
+
+The schemes shipped with the tool live in the schemes/ directory next to this file (ibug68, 5point, wflw98);
+any other definition file can be given by its path.
+"""
+from __future__ import print_function
+from __future__ import division
+import os
+import json
+
+SCHEME_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schemes')
+
+DEFAULT_SCHEME = 'ibug68'
+
+
+class LandmarkScheme(object):
+    """
+    LandmarkScheme - Class
+
+    Number of landmarks, overlay contours, left/right landmark pairs and inter-ocular pair of one annotation
+    layout.
+
+    Functions:
+    __init__: Requires the scheme name, the number of landmarks and the list of contours (lists of 1-based
+    landmark numbers). symmetry is the list of (left, right) landmark pairs, interocular the pair of eye
+    landmarks or None. Raises ValueError if a contour or pair refers to a landmark that does not exist.
+    """
+
+    def __init__(self, name, number_of_landmarks, contours=(), symmetry=(), interocular=None):
+        self.name = name
+        self.number_of_landmarks = int(number_of_landmarks)
+        self.contours = [list(contour) for contour in contours]
+        self.symmetry = [tuple(pair) for pair in symmetry]
+        self.interocular = None if interocular is None else tuple(interocular)
+
+        if self.number_of_landmarks < 1:
+            raise ValueError(f"scheme {name} has no landmarks")
+        for contour in self.contours:
+            for index in contour:
+                if not 1 <= index <= self.number_of_landmarks:
+                    raise ValueError(f"scheme {name}: contour point {index} is not a landmark "
+                                     f"(1..{self.number_of_landmarks})")
+        for pair in self.symmetry + ([self.interocular] if self.interocular else []):
+            if len(pair) != 2 or not all(1 <= index <= self.number_of_landmarks for index in pair):
+                raise ValueError(f"scheme {name}: landmark pair {list(pair)} is not a pair of landmarks "
+                                 f"(1..{self.number_of_landmarks})")
+
+
+def available_schemes():
+    return sorted(os.path.splitext(name)[0] for name in os.listdir(SCHEME_DIR) if name.endswith('.json'))
+
+
+def load_scheme(name_or_path=DEFAULT_SCHEME):
+    """Loads a shipped scheme by name (e.g. 'wflw98') or a scheme definition file by path."""
+    path = name_or_path
+    if not os.path.exists(path):
+        path = os.path.join(SCHEME_DIR, name_or_path + '.json')
+        if not os.path.exists(path):
+            raise ValueError(f"unknown landmark scheme {name_or_path}; "
+                             f"choose one of {', '.join(available_schemes())} or give a definition file")
+
+    with open(path, 'r', encoding='utf-8') as f:
+        definition = json.load(f)
+    return LandmarkScheme(definition.get('name', os.path.splitext(os.path.basename(path))[0]),
+                          definition['landmarks'], definition.get('contours', []), definition.get('symmetry', []),
+                          definition.get('interocular'))
@@ -0,0 +1,146 @@
+"""
+Latency tracing for the Face-Annotation-Tool GUI
+
+A Tracer records timed spans: the name of a stage (on_click, blit_overlay, draw, load, ...), the image it
+ran for, its start and its duration. InteractiveViewer wraps its event handlers and drawing stages with
+Tracer.wrap when --profile is given. A disabled Tracer (no path) returns the functions unchanged and its
+spans are a shared no-op context manager, so tracing costs nothing unless it is switched on.
+
+On close, an enabled Tracer writes the trace and prints p50/p95/p99 latencies and a histogram per stage to
+stderr. A path ending in .csv gets one "name,image,start_s,duration_ms" row per span; any other path gets
+the Chrome trace event JSON format, which chrome://tracing and Perfetto display as a timeline (nested spans,
+such as a blit inside a click, show up nested).
+"""
+from __future__ import print_function
+from __future__ import division
+import os
+import csv
+import sys
+import json
+import time
+import functools
+import contextlib
+
+import numpy as np
+
+# Upper bucket edges of the latency histogram, in milliseconds
+HISTOGRAM_EDGES_MS = (1, 4, 16, 64, 256)
+
+NULL_SPAN = contextlib.nullcontext()
+
+
+class Span(object):
+
+    def __init__(self, tracer, name, image):
+        self.tracer = tracer
+        self.name = name
+        self.image = image
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.tracer.record(self.name, self.image, self.start, time.perf_counter() - self.start)
+
+
+class Tracer(object):
+    """
+    Tracer - Class
+
+    Collects timed spans and writes them as a trace.
+
+    Functions:
+    __init__: Takes the path of the trace file. Without a path the tracer is disabled.
+
+    set_image: Sets the image that following spans are attributed to.
+
+    span: Returns a context manager that records one span named name, for the given image (by default the
+    current one).
+
+    wrap: Returns function wrapped so that every call is recorded as a span named name. Returns function
+    itself when disabled.
+
+    record: Adds a finished span (start and duration in seconds, from time.perf_counter).
+
+    report: Returns the per-span latency summary as text.
+
+    close: Writes the trace file and prints the report to stderr. Does nothing when disabled.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.enabled = path is not None
+        self.image = None
+        self.origin = time.perf_counter()
+        self.spans = []
+
+    def set_image(self, img_path):
+        self.image = img_path
+
+    def span(self, name, image=None):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, self.image if image is None else image)
+
+    def wrap(self, name, function):
+        if not self.enabled:
+            return function
+
+        @functools.wraps(function)
+        def traced(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.spans.append((name, self.image, start, time.perf_counter() - start))
+        return traced
+
+    def record(self, name, image, start, duration):
+        self.spans.append((name, image, start, duration))
+
+    def write_csv(self, f):
+        writer = csv.writer(f)
+        writer.writerow(('name', 'image', 'start_s', 'duration_ms'))
+        for name, image, start, duration in self.spans:
+            writer.writerow((name, image or '', f"{start - self.origin:.6f}", f"{duration * 1e3:.3f}"))
+
+    def write_json(self, f):
+        pid = os.getpid()
+        events = [{'name': name, 'ph': 'X', 'pid': pid, 'tid': 0,
+                   'ts': round((start - self.origin) * 1e6, 1), 'dur': round(duration * 1e6, 1),
+                   'args': {'image': image}}
+                  for name, image, start, duration in self.spans]
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def report(self):
+        durations = {}
+        for name, image, start, duration in self.spans:
+            durations.setdefault(name, []).append(duration * 1e3)
+
+        bucket_names = [f"<{edge}" for edge in HISTOGRAM_EDGES_MS] + [f">={HISTOGRAM_EDGES_MS[-1]}"]
+        lines = ['{:<20s} {:>7s} {:>9s} {:>9s} {:>9s} {:>9s}   {}'.format(
+            'span (ms)', 'count', 'p50', 'p95', 'p99', 'max', ' '.join(f"{b:>6s}" for b in bucket_names))]
+        for name, times in sorted(durations.items()):
+            times = np.asarray(times)
+            p50, p95, p99 = np.percentile(times, (50, 95, 99))
+            counts = np.bincount(np.searchsorted(HISTOGRAM_EDGES_MS, times, side='right'),
+                                 minlength=len(bucket_names))
+            lines.append('{:<20s} {:>7d} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}   {}'.format(
+                name, len(times), p50, p95, p99, times.max(), ' '.join(f"{count:>6d}" for count in counts)))
+        return '\n'.join(lines)
+
+    def close(self):
+        if not self.enabled:
+            return
+
+        with open(self.path, 'w', newline='', encoding='utf-8') as f:
+            if self.path.lower().endswith('.csv'):
+                self.write_csv(f)
+            else:
+                self.write_json(f)
+
+        print(f"Latency trace of {len(self.spans)} spans written to {self.path}", file=sys.stderr)
+        print(self.report(), file=sys.stderr)
+        self.enabled = False
@@ -0,0 +1,206 @@
+"""
+Sharded text output for several annotators sharing one output
+
+Appending to one landmark_output.txt from several processes interleaves their lines, and on NFS it can tear
+them. With --shard every process appends to a file of its own instead, <output>.shards/<host>-<pid>-<session>.txt,
+and --merge combines the shards into the output afterwards.
+
+A shard is a text output (see annotation_io.py) where every annotation is preceded by a timestamp line:
+  # <seconds since the epoch>
+  image_name,x_0,...
+  <img_path>,<x_1>,<y_1>,...
+Lines starting with '#' are skipped by iter_rows, so a shard can be read, resumed and rendered like any
+other output. The timestamps of a shard never decrease, since one process appends to it.
+
+merge_shards does a streaming k-way merge of the shards by timestamp: heapq.merge keeps the next annotation
+of every shard and nothing else, so memory is constant in the size of the output (one annotation per shard).
+The merged output keeps the timestamp lines, starts with a MERGE_MARKER line and is rewritten from the shards
+on every merge, so it is written to a temporary file and atomically replaces the old one. The marker line
+records the size of the merged output. Rows appended to it after the merge, e.g. by a --serve session, lie
+past that size; the next merge first moves them into a shard of their own, appended-<offset>-<size>.txt, so
+they are merged now and on every later merge.
+"""
+from __future__ import print_function
+from __future__ import division
+import os
+import glob
+import time
+import heapq
+import socket
+import contextlib
+
+from annotation_io import iter_rows, parse_path, image_key, TextAnnotationWriter
+
+MERGE_MARKER = '# merged from shards'
+# The marker line with the size of the merged output, fixed-width so it can be written before the size is known
+MERGE_LINE = MERGE_MARKER + ': {:020d} bytes\n'
+
+# Caches of an output that describe its old content once the output is replaced by a merge
+OUTPUT_CACHES = ('.idx', '.meanshape.npz', '.arrays.json', '.landmarks.npy', '.paths.npy')
+
+
+def shard_dir(output_path):
+    return output_path + '.shards'
+
+
+def session_name(session=None):
+    """Returns <host>-<pid>-<session>, the name of the files this process writes on its own."""
+    session = time.strftime('%Y%m%dT%H%M%S') if session is None else session
+    return f"{socket.gethostname()}-{os.getpid()}-{session}"
+
+
+def shard_path(output_path, session=None):
+    """Returns the path of the shard of this process: <output>.shards/<host>-<pid>-<session>.txt."""
+    return os.path.join(shard_dir(output_path), session_name(session) + '.txt')
+
+
+def list_shards(output_path):
+    return sorted(glob.glob(os.path.join(glob.escape(shard_dir(output_path)), '*.txt')))
+
+
+def iter_records(f):
+    """
+    Yields (timestamp, lines) for the complete annotations of a shard opened in binary mode. Rows without a
+    timestamp line, from an output written without --shard, get timestamp 0 and come first.
+    """
+    timestamp = 0.0
+    lines = []
+    for line in f:
+        if not line.endswith(b'\n'):
+            # Torn last line of a crashed session
+            break
+        if line.startswith(MERGE_MARKER.encode('utf-8')):
+            continue
+        if line.startswith(b'#'):
+            timestamp = float(line[1:])
+            lines = [line]
+        elif line.startswith(b'image_name,'):
+            lines.append(line)
+        elif line.strip():
+            lines.append(line)
+            yield timestamp, b''.join(lines)
+            timestamp = 0.0
+            lines = []
+
+
+def merged_size(output_path):
+    """
+    Returns the size output_path had when it was merged, or None if it is empty or does not exist. Raises
+    ValueError if it is not the result of an earlier merge, since merging would replace annotations that are in
+    no shard.
+    """
+    if not os.path.exists(output_path) or not os.path.getsize(output_path):
+        return None
+    with open(output_path, 'r', encoding='utf-8') as f:
+        line = f.readline()
+    if not line.startswith(MERGE_MARKER):
+        raise ValueError(f"{output_path} has annotations that are in no shard; move it into "
+                         f"{shard_dir(output_path)}/ to merge it with the shards")
+    size = line[len(MERGE_MARKER):].strip(': \n').partition(' ')[0]
+    if not size.isdigit():
+        raise ValueError(f"{output_path} was merged without recording its size, so rows appended since cannot "
+                         f"be told apart; move it into {shard_dir(output_path)}/ to merge it with the shards")
+    return int(size)
+
+
+def move_appended(output_path, offset):
+    """
+    Copies the rows appended to a merged output since its merge (everything past offset) into a shard of their
+    own and returns its path, or None if nothing was appended. Rows without a timestamp line get the time the
+    output was last modified. The shard is named after offset and the output size, so copying the same rows
+    again after a crash replaces it instead of duplicating them.
+    """
+    size = os.path.getsize(output_path)
+    if size <= offset:
+        return None
+    modified = os.path.getmtime(output_path)
+    path = os.path.join(shard_dir(output_path), f"appended-{offset}-{size}.txt")
+    os.makedirs(shard_dir(output_path), exist_ok=True)
+    last_timestamp = 0.0
+    with open(output_path, 'rb') as f, open(path, 'wb') as out:
+        f.seek(offset)
+        for timestamp, lines in iter_records(f):
+            if lines.startswith(b'#'):
+                lines = lines.partition(b'\n')[2]
+            # Keep the shard sorted, as ShardWriter does
+            last_timestamp = max(timestamp or modified, last_timestamp)
+            out.write(f"# {last_timestamp:.6f}\n".encode('utf-8') + lines)
+        out.flush()
+        os.fsync(out.fileno())
+    return path
+
+
+def merge_shards(output_path, shard_paths=None):
+    """
+    Merges the shards of output_path (by default all of them) into output_path, ordered by timestamp, together
+    with any rows appended to output_path since the last merge (see move_appended). Returns the number of
+    annotations merged. Raises ValueError if output_path is not the result of an earlier merge (see
+    merged_size).
+    """
+    shard_paths = list_shards(output_path) if shard_paths is None else list(shard_paths)
+    size = merged_size(output_path)
+    appended = None if size is None else move_appended(output_path, size)
+    if appended is not None and appended not in shard_paths:
+        shard_paths.append(appended)
+
+    count = 0
+    tmp_path = output_path + '.tmp'
+    with contextlib.ExitStack() as stack:
+        shards = [iter_records(stack.enter_context(open(path, 'rb'))) for path in shard_paths]
+        with open(tmp_path, 'wb') as out:
+            out.write(MERGE_LINE.format(0).encode('utf-8'))
+            # Ties are broken by shard, which heapq.merge keeps stable
+            for timestamp, lines in heapq.merge(*shards, key=lambda record: record[0]):
+                out.write(lines)
+                count += 1
+            end = out.tell()
+            out.seek(0)
+            out.write(MERGE_LINE.format(end).encode('utf-8'))
+            out.flush()
+            os.fsync(out.fileno())
+    os.replace(tmp_path, output_path)
+
+    for suffix in OUTPUT_CACHES:
+        if os.path.exists(output_path + suffix):
+            os.remove(output_path + suffix)
+    return count
+
+
+def annotated_in_shards(output_path, number_of_landmarks, exclude=()):
+    """
+    Returns the set of image keys annotated in the merged output or any shard but the paths in exclude, for
+    --resume. The files are only read, without a ResumeIndex: other processes are appending to their shards
+    and would race with writes to the .idx caches next to them.
+    """
+    excluded = set(os.path.abspath(path) for path in exclude)
+    done = set()
+    for path in [output_path] + list_shards(output_path):
+        if os.path.abspath(path) in excluded or not os.path.exists(path):
+            continue
+        with open(path, 'rb') as f:
+            for offset, row in iter_rows(f):
+                done.add(image_key(parse_path(row, number_of_landmarks)))
+    return done
+
+
+class ShardWriter(TextAnnotationWriter):
+    """
+    ShardWriter - Class
+
+    TextAnnotationWriter for a shard: writes a timestamp line before every annotation.
+
+    Functions:
+    __init__: Requires an open, writable file object, like TextAnnotationWriter.
+
+    write: Writes the timestamp line, the header line and the row for one image.
+    """
+
+    def __init__(self, f, index=None):
+        TextAnnotationWriter.__init__(self, f, index)
+        self.last_timestamp = 0.0
+
+    def write(self, img_path, coords_list):
+        # Keep the shard sorted even if the wall clock is set back
+        self.last_timestamp = max(time.time(), self.last_timestamp)
+        self.f.write(f"# {self.last_timestamp:.6f}\n")
+        TextAnnotationWriter.write(self, img_path, coords_list)
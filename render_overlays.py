@@ -0,0 +1,101 @@
+"""
+Headless overlay rendering for reviewing annotations
+
+render_overlays reads a text annotation output and writes, for every annotated image, a JPEG of the image
+with its landmarks and the contours of its landmark scheme drawn on top. Nothing is shown on screen.
+
+The output is streamed, never loaded whole: a first pass remembers where the last row of every image
+ends (an image annotated twice is rendered with its latest annotation only), and a second pass hands rows
+to a process pool with a bounded number of rows in flight, so memory stays flat on any output size while
+all cores decode, draw and encode.
+"""
+from __future__ import print_function
+from __future__ import division
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import cv2
+
+from annotation_io import parse_path, parse_row, iter_rows, image_key
+from landmark_schemes import load_scheme
+
+LANDMARK_COLOR = (0, 0, 255)     # BGR
+CONTOUR_COLOR = (255, 255, 0)
+
+
+def overlay_path(out_dir, img_path):
+    # Mirror the image path below out_dir; '..' components must not escape it
+    parts = [part if part != '..' else '__' for part in image_key(img_path).replace('\\', '/').split('/')]
+    rel_path = os.path.join(*[part for part in parts if part not in ('', '.')])
+    return os.path.join(out_dir, os.path.splitext(rel_path)[0] + '.jpg')
+
+
+def draw_overlay(image, landmarks, contours):
+    height, width = image.shape[:2]
+    radius = max(2, int(round(max(height, width) / 500)))
+
+    for contour in contours:
+        for start, end in zip(contour[:-1], contour[1:]):
+            if landmarks[start - 1] is not None and landmarks[end - 1] is not None:
+                cv2.line(image, landmarks[start - 1], landmarks[end - 1], CONTOUR_COLOR, max(1, radius // 2),
+                         cv2.LINE_AA)
+    for coords in landmarks:
+        if coords is not None:
+            cv2.circle(image, coords, radius, LANDMARK_COLOR, -1, cv2.LINE_AA)
+    return image
+
+
+def render_row(row, out_dir, quality, scheme):
+    img_path, landmarks = parse_row(row, scheme.number_of_landmarks)
+    image = cv2.imread(img_path)
+    if image is None:
+        return img_path, False
+
+    out_path = overlay_path(out_dir, img_path)
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    cv2.imwrite(out_path, draw_overlay(image, landmarks, scheme.contours), [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return img_path, True
+
+
+def latest_rows_in_output(output_path, number_of_landmarks):
+    """Returns {image key: end offset of its last row} for the output file."""
+    latest = {}
+    with open(output_path, 'rb') as f:
+        for offset, row in iter_rows(f):
+            latest[image_key(parse_path(row, number_of_landmarks))] = offset
+    return latest
+
+
+def render_overlays(output_path, out_dir, workers=None, quality=90, in_flight_per_worker=4, scheme=None):
+    """
+    Renders every annotated image of output_path into out_dir. Returns (rendered, failed) counts.
+
+    scheme is the LandmarkScheme the output was annotated with (iBUG-68 by default).
+    """
+    scheme = load_scheme() if scheme is None else scheme
+    workers = workers or os.cpu_count() or 1
+    latest = latest_rows_in_output(output_path, scheme.number_of_landmarks)
+
+    counts = {True: 0, False: 0}
+
+    def collect(futures):
+        for future in futures:
+            img_path, ok = future.result()
+            counts[ok] += 1
+            if not ok:
+                print(f"could not read image {img_path}", file=sys.stderr)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor, open(output_path, 'rb') as f:
+        pending = set()
+        for offset, row in iter_rows(f):
+            if latest.get(image_key(parse_path(row, scheme.number_of_landmarks))) != offset:
+                continue
+
+            pending.add(executor.submit(render_row, row, out_dir, quality, scheme))
+            if len(pending) >= workers * in_flight_per_worker:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+        collect(pending)
+
+    return counts[True], counts[False]
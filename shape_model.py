@@ -0,0 +1,141 @@
+"""
+Mean face shape for pre-annotation
+
+A ShapeModel holds the Procrustes-aligned mean of the shapes saved in a text annotation output.
+When the annotator draws a face box, the mean shape is fitted to that box and fills in every landmark that
+is not labeled yet, so only the points that are off have to be moved.
+
+Alignment is vectorized over all shapes at once: every shape is centered and scaled to unit norm, and the
+optimal rotation onto the reference for all shapes comes from one batched 2x2 SVD. Only complete shapes
+(all points of the landmark scheme labeled) take part.
+
+The mean is cached in <output>.meanshape.npz together with the sum of the aligned shapes and the output
+offset it covers. Later refreshes only read the rows appended since then, align them to the current mean
+and add them to the running sum.
+"""
+from __future__ import print_function
+from __future__ import division
+import os
+
+import numpy as np
+
+from annotation_io import NUMBER_OF_LANDMARKS
+from annotation_arrays import parse_chunk, iter_chunks
+
+
+def read_shapes(output_path, offset=0, number_of_landmarks=NUMBER_OF_LANDMARKS):
+    """Returns (shapes, end_offset): an (N, K, 2) float array of the rows after offset, NaN where unlabeled."""
+    chunks = [np.empty((0, number_of_landmarks, 2))]
+    end_offset = offset
+    with open(output_path, 'rb') as f:
+        for end_offset, data in iter_chunks(f, offset):
+            chunks.append(parse_chunk(data, number_of_landmarks)[1].astype(np.float64))
+    return np.concatenate(chunks), end_offset
+
+
+def normalize_shapes(shapes):
+    """Centers every shape of an (N, K, 2) array on its centroid and scales it to unit Frobenius norm."""
+    centered = shapes - shapes.mean(axis=1, keepdims=True)
+    norms = np.sqrt((centered ** 2).sum(axis=(1, 2), keepdims=True))
+    return centered / np.where(norms > 0, norms, 1)
+
+
+def align_shapes(shapes, reference):
+    """Rotates every normalized shape of an (N, K, 2) array onto the normalized (K, 2) reference."""
+    # The rotation R minimizing |X R - Y| is U V^T for the SVD U S V^T of X^T Y
+    cross = np.einsum('nki,kj->nij', shapes, reference)
+    u, _, vt = np.linalg.svd(cross)
+    # Flip the last axis where U V^T would be a reflection; a mirrored face is not a rotation of it
+    u[:, :, -1] *= np.sign(np.linalg.det(np.matmul(u, vt)))[:, None]
+    return np.matmul(shapes, np.matmul(u, vt))
+
+
+def procrustes_mean(shapes, iterations=20, tolerance=1e-8):
+    """Generalized Procrustes analysis of an (N, K, 2) array. Returns (mean, aligned shapes)."""
+    shapes = normalize_shapes(shapes)
+    mean = shapes[0]
+    aligned = shapes
+    for i in range(iterations):
+        aligned = align_shapes(shapes, mean)
+        # Keep the orientation of the first shape so the mean stays upright
+        new_mean = align_shapes(normalize_shapes(aligned.mean(axis=0)[None]), mean)[0]
+        converged = np.abs(new_mean - mean).max() < tolerance
+        mean = new_mean
+        if converged:
+            break
+    return mean, aligned
+
+
+def complete_shapes(shapes):
+    return shapes[~np.isnan(shapes).any(axis=(1, 2))]
+
+
+class ShapeModel(object):
+    """
+    ShapeModel - Class
+
+    Procrustes mean of the shapes in a text annotation output, kept up to date incrementally.
+
+    Functions:
+    __init__: Requires the path of the text output and the number of landmarks of its scheme. Loads the cached
+    mean (cache_path, by default <output>.meanshape.npz) and refreshes it with the rows written since.
+
+    refresh: Reads the rows appended to the output since the last refresh, adds their aligned shapes to the
+    running mean and rewrites the cache. Does a full Procrustes analysis when nothing is cached yet.
+
+    fit_to_box: Returns the mean shape scaled and translated so that its landmark bounding box matches the
+    given face box ((x0, y0), (x1, y1)), as a (K, 2) array. None while no complete shape was saved yet.
+    """
+
+    def __init__(self, output_path, cache_path=None, number_of_landmarks=NUMBER_OF_LANDMARKS):
+        self.output_path = output_path
+        self.number_of_landmarks = number_of_landmarks
+        self.cache_path = output_path + '.meanshape.npz' if cache_path is None else cache_path
+
+        self.offset = 0
+        self.count = 0
+        self.total = np.zeros((number_of_landmarks, 2))
+        self.mean = None
+
+        if os.path.exists(self.cache_path):
+            cache = np.load(self.cache_path)
+            output_size = os.path.getsize(output_path) if os.path.exists(output_path) else 0
+            # An output shorter than the cached offset was truncated or replaced, and a mean of another landmark
+            # scheme does not fit; start over
+            if int(cache['offset']) <= output_size and cache['total'].shape == self.total.shape:
+                self.offset = int(cache['offset'])
+                self.count = int(cache['count'])
+                self.total = cache['total']
+                self.mean = cache['mean'] if self.count else None
+
+        self.refresh()
+
+    def refresh(self):
+        if not os.path.exists(self.output_path) or os.path.getsize(self.output_path) <= self.offset:
+            return
+
+        shapes, self.offset = read_shapes(self.output_path, self.offset, self.number_of_landmarks)
+        shapes = complete_shapes(shapes)
+
+        if len(shapes):
+            if self.mean is None:
+                self.mean, aligned = procrustes_mean(shapes)
+            else:
+                aligned = align_shapes(normalize_shapes(shapes), self.mean)
+            self.total = self.total + aligned.sum(axis=0)
+            self.count += len(shapes)
+            self.mean = align_shapes(normalize_shapes((self.total / self.count)[None]), self.mean)[0]
+
+        np.savez(self.cache_path, offset=self.offset, count=self.count, total=self.total,
+                 mean=self.mean if self.mean is not None else np.zeros((self.number_of_landmarks, 2)))
+
+    def fit_to_box(self, box):
+        if self.mean is None:
+            return None
+
+        (x0, y0), (x1, y1) = box
+        lo = self.mean.min(axis=0)
+        hi = self.mean.max(axis=0)
+        origin = np.array([min(x0, x1), min(y0, y1)], dtype=np.float64)
+        size = np.array([abs(x1 - x0), abs(y1 - y0)], dtype=np.float64)
+        return origin + (self.mean - lo) / (hi - lo) * size
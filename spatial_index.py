@@ -0,0 +1,68 @@
+"""
+Spatial index for hit-testing landmarks
+
+GridIndex is a uniform grid (spatial hash) over points in image coordinates. Moving a point only touches
+the grid cells it leaves and enters, and a nearest-point query within a radius only looks at the cells the
+radius overlaps, so both stay constant-time however many points (landmarks, faces) are on screen.
+"""
+from __future__ import print_function
+from __future__ import division
+import math
+
+
+class GridIndex(object):
+    """
+    GridIndex - Class
+
+    Uniform grid of keyed 2D points.
+
+    Functions:
+    __init__: Requires the cell size, in the same units as the points.
+
+    update: Moves the point with the given key to (x, y), inserting it if needed. None removes the point.
+
+    nearest: Returns the key of the point closest to (x, y) within radius, or None.
+
+    clear: Removes all points.
+    """
+
+    def __init__(self, cell_size):
+        self.cell_size = float(cell_size)
+        self.cells = {}
+        self.points = {}
+
+    def cell(self, x, y):
+        return int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size))
+
+    def update(self, key, xy):
+        old = self.points.pop(key, None)
+        if old is not None:
+            cell = self.cell(*old)
+            members = self.cells[cell]
+            members.discard(key)
+            if not members:
+                del self.cells[cell]
+
+        if xy is not None:
+            self.points[key] = xy
+            self.cells.setdefault(self.cell(*xy), set()).add(key)
+
+    def nearest(self, x, y, radius):
+        cx0, cy0 = self.cell(x - radius, y - radius)
+        cx1, cy1 = self.cell(x + radius, y + radius)
+
+        best = None
+        best_distance = radius * radius
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                for key in self.cells.get((cx, cy), ()):
+                    px, py = self.points[key]
+                    distance = (px - x) ** 2 + (py - y) ** 2
+                    if distance <= best_distance:
+                        best = key
+                        best_distance = distance
+        return best
+
+    def clear(self):
+        self.cells = {}
+        self.points = {}
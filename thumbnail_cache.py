@@ -0,0 +1,143 @@
+"""
+On-disk thumbnail cache for the contact sheet browser
+
+Thumbnails are square JPEGs (the image scaled to fit and padded), stored content-addressed below the cache
+directory: the file name is the SHA-1 of the absolute image path, its mtime, its size and the thumbnail size,
+so a changed image gets a new thumbnail and the cache never has to be invalidated. Since the key holds no
+dataset-specific part, one cache directory can serve several datasets.
+
+ThumbnailCache generates missing thumbnails on a thread pool (decoding and resizing in OpenCV release the
+GIL) and hands finished ones back through pop_ready, so the browser never waits for a decode. An image that
+already has a thumbnail costs one stat and one small JPEG read.
+"""
+from __future__ import print_function
+from __future__ import division
+import os
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+THUMBNAIL_SIZE = 160
+
+# Padding around thumbnails that do not fill the square
+PAD_VALUE = 32
+
+
+def default_cache_dir():
+    return os.path.join(os.path.expanduser('~'), '.cache', 'annotate_faces', 'thumbnails')
+
+
+def make_thumbnail(image, size=THUMBNAIL_SIZE):
+    """Scales a BGR or RGB image to fit a size x size square and pads it to that square."""
+    height, width = image.shape[:2]
+    scale = size / max(height, width)
+    if scale < 1:
+        image = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+    height, width = image.shape[:2]
+    thumbnail = np.full((size, size, 3), PAD_VALUE, dtype=np.uint8)
+    top = (size - height) // 2
+    left = (size - width) // 2
+    thumbnail[top:top + height, left:left + width] = image
+    return thumbnail
+
+
+class ThumbnailCache(object):
+    """
+    ThumbnailCache - Class
+
+    Content-addressed on-disk cache of image thumbnails, filled in the background.
+
+    Functions:
+    __init__: Takes the cache directory, the thumbnail size in pixels and the number of worker threads (by
+    default one per core).
+
+    cache_path: Returns the path of the cached thumbnail of an image, from its path, mtime and size.
+
+    load: Returns the RGB thumbnail of an image, creating and caching it if needed. None if the image can not
+    be read. Runs on the worker threads. Used by: request
+
+    request: Schedules the thumbnails of the given images. Requests of earlier calls that were not started yet
+    are dropped, so the images asked for last (the page on screen) come first.
+
+    pending: Returns True while scheduled thumbnails are not finished.
+
+    pop_ready: Returns the (img_path, thumbnail) pairs finished since the last call.
+
+    close: Drops scheduled thumbnails and shuts the thread pool down.
+    """
+
+    def __init__(self, cache_dir=None, size=THUMBNAIL_SIZE, workers=None):
+        self.cache_dir = default_cache_dir() if cache_dir is None else cache_dir
+        self.size = size
+        self.executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+        # Reentrant: a future that is already done runs its callback inside add_done_callback
+        self.lock = threading.RLock()
+        # img_path -> Future of a thumbnail that was not popped yet
+        self.futures = {}
+        self.ready = []
+
+    def cache_path(self, img_path):
+        img_path = os.path.abspath(img_path)
+        st = os.stat(img_path)
+        key = hashlib.sha1(f"{img_path}\0{st.st_mtime_ns}\0{st.st_size}\0{self.size}".encode('utf-8')).hexdigest()
+        # Two levels keep directories small for large datasets
+        return os.path.join(self.cache_dir, key[:2], key[2:] + '.jpg')
+
+    def load(self, img_path):
+        try:
+            cache_path = self.cache_path(img_path)
+        except OSError:
+            return None
+        thumbnail = cv2.imread(cache_path) if os.path.exists(cache_path) else None
+        if thumbnail is None:
+            image = cv2.imread(img_path)
+            if image is None:
+                return None
+            thumbnail = make_thumbnail(image, self.size)
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            # Written under a temporary name and renamed, so a reader never sees half a file
+            tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.jpg"
+            if cv2.imwrite(tmp_path, thumbnail, [cv2.IMWRITE_JPEG_QUALITY, 85]):
+                os.replace(tmp_path, cache_path)
+        return cv2.cvtColor(thumbnail, cv2.COLOR_BGR2RGB)
+
+    def on_loaded(self, img_path, future):
+        if future.cancelled():
+            return
+        with self.lock:
+            if self.futures.get(img_path) is future:
+                del self.futures[img_path]
+                self.ready.append((img_path, future.result() if future.exception() is None else None))
+
+    def request(self, img_paths):
+        with self.lock:
+            for future in self.futures.values():
+                future.cancel()
+            self.futures = {img_path: future for img_path, future in self.futures.items() if not future.cancelled()}
+            for img_path in img_paths:
+                if img_path in self.futures:
+                    continue
+                future = self.executor.submit(self.load, img_path)
+                self.futures[img_path] = future
+                future.add_done_callback(lambda done, img_path=img_path: self.on_loaded(img_path, done))
+
+    def pending(self):
+        with self.lock:
+            return bool(self.futures)
+
+    def pop_ready(self):
+        with self.lock:
+            ready = self.ready
+            self.ready = []
+        return ready
+
+    def close(self):
+        with self.lock:
+            for future in self.futures.values():
+                future.cancel()
+            self.futures = {}
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,163 @@
+"""
+Video frames for the Face-Annotation-Tool
+
+VideoFrames streams the frames of a video through cv2.VideoCapture for the -v mode, so no frame is ever
+written to disk. Frames are decoded in order as the annotator advances, and the last RING_FRAMES decoded frames
+are kept in a ring buffer: stepping back over recent frames, and forward again, costs no decode. A frame
+further back, or more than SEEK_FRAMES ahead, is reached by seeking the capture (which decodes from the
+preceding keyframe) and reading on from there.
+
+The frames of a video are annotated under frame_key(video_path, index), "<video path>#<frame index>" with the
+index zero-padded, so the rows of a video sort in frame order; parse_frame_key gets the index back.
+
+track_landmarks carries the landmarks of one frame over to the next with pyramidal Lucas-Kanade optical flow
+(cv2.calcOpticalFlowPyrLK). Every point is tracked forward and back again, and a point that does not return
+to within TRACK_ERROR pixels of where it started (occluded, blurred, or on a patch without texture) is dropped
+rather than placed wrongly, so the annotator sees it as unlabeled. Positions are tracked sub-pixel: the labels
+are whole pixels, and starting every frame from the rounded label would lose the fraction of the motion every
+time, which adds up to pixels of drift within a second of steady motion. label_points therefore hands on the
+tracked position of every label the annotator left where it was tracked to.
+"""
+from __future__ import print_function
+from __future__ import division
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+# Decoded frames kept for stepping back; a 1080p frame takes 6 MB
+RING_FRAMES = 32
+
+# Frames up to this far ahead are reached by decoding on rather than seeking
+SEEK_FRAMES = 64
+
+# Forward-backward error, in pixels, above which a tracked landmark counts as lost
+TRACK_ERROR = 1.5
+
+LK_PARAMETERS = dict(winSize=(21, 21), maxLevel=3,
+                     criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 30, 0.01))
+
+
+def frame_key(video_path, index):
+    return f"{video_path}#{index:06d}"
+
+
+def parse_frame_key(img_path):
+    """Returns (video path, frame index) of a frame_key, or None for the path of an image."""
+    video_path, _, index = img_path.rpartition('#')
+    if not video_path or not index.isdigit():
+        return None
+    return video_path, int(index)
+
+
+class VideoFrames(object):
+    """
+    VideoFrames - Class
+
+    Decodes the frames of a video on demand and keeps the most recently used ones.
+
+    Functions:
+    __init__: Requires the path of the video. ring_frames is the number of decoded frames kept. Raises
+    ValueError if the video cannot be opened.
+
+    get: Returns the RGB frame at index, from the ring buffer when possible, or None before the first and past the
+    last frame.
+
+    close: Releases the capture.
+    """
+
+    def __init__(self, video_path, ring_frames=RING_FRAMES):
+        self.video_path = video_path
+        self.capture = cv2.VideoCapture(video_path)
+        if not self.capture.isOpened():
+            raise ValueError(f"cannot open video {video_path}")
+        # Container metadata; the end is only known for sure once a read fails
+        self.frame_count = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS)
+        self.ring_frames = ring_frames
+
+        # frame index -> RGB frame, least recently used first
+        self.ring = OrderedDict()
+        # Index of the frame the capture decodes next, and of the first frame past the end once a read failed
+        self.position = 0
+        self.end = None
+
+    def __len__(self):
+        return self.frame_count if self.end is None else self.end
+
+    def get(self, index):
+        if index < 0 or (self.end is not None and index >= self.end):
+            return None
+        frame = self.ring.get(index)
+        if frame is not None:
+            self.ring.move_to_end(index)
+            return frame
+
+        if not self.position <= index < self.position + SEEK_FRAMES:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, index)
+            self.position = index
+        # Frames skipped on the way are only grabbed, not converted
+        while self.position < index:
+            if not self.capture.grab():
+                self.end = self.position
+                return None
+            self.position += 1
+
+        ok, frame = self.capture.read()
+        if not ok:
+            self.end = index
+            return None
+        self.position = index + 1
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame)
+        self.ring[index] = frame
+        while len(self.ring) > self.ring_frames:
+            self.ring.popitem(last=False)
+        return frame
+
+    def close(self):
+        self.capture.release()
+        self.ring.clear()
+
+
+def label_points(coords, tracked=None):
+    """
+    Returns the (K, 2) float positions of labels, a list of (x, y) pixels or None (NaN) per landmark. A label
+    still on the pixel it was tracked to keeps its sub-pixel position from the (K, 2) tracked array.
+    """
+    points = np.array([(np.nan, np.nan) if xy is None else xy for xy in coords], dtype=np.float64)
+    if tracked is not None:
+        with np.errstate(invalid='ignore'):
+            unmoved = (np.rint(tracked) == points).all(axis=1)
+        points[unmoved] = tracked[unmoved]
+    return points
+
+
+def pixel_labels(points):
+    """Returns the labels of (K, 2) float positions: (x, y) pixels, None for NaN."""
+    return [None if x != x else (int(x), int(y)) for x, y in np.rint(points).tolist()]
+
+
+def track_landmarks(previous, frame, points, max_error=TRACK_ERROR):
+    """
+    Tracks landmarks from the RGB frame previous to frame. points is a (K, 2) float array, NaN for landmarks
+    without a position. Returns their (K, 2) positions in frame, NaN for those that were NaN or got lost.
+    """
+    tracked = np.full(points.shape, np.nan)
+    labeled = np.flatnonzero(~np.isnan(points[:, 0]))
+    if not len(labeled):
+        return tracked
+
+    start = points[labeled].astype(np.float32).reshape(-1, 1, 2)
+    previous_gray = cv2.cvtColor(previous, cv2.COLOR_RGB2GRAY)
+    gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+    forward, status, _ = cv2.calcOpticalFlowPyrLK(previous_gray, gray, start, None, **LK_PARAMETERS)
+    backward, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, previous_gray, forward, None, **LK_PARAMETERS)
+
+    forward = forward.reshape(-1, 2).astype(np.float64)
+    error = np.linalg.norm(backward.reshape(-1, 2) - start.reshape(-1, 2), axis=1)
+    height, width = frame.shape[:2]
+    # Kept only if it rounds to a pixel of the frame
+    good = (status.ravel() == 1) & (back_status.ravel() == 1) & (error < max_error)
+    good &= (forward > -0.5).all(axis=1) & (forward[:, 0] < width - 0.5) & (forward[:, 1] < height - 0.5)
+    tracked[labeled[good]] = forward[good]
+    return tracked
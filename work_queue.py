@@ -0,0 +1,452 @@
+"""
+Work distribution between annotators
+
+One server process owns the dataset and the output; any number of annotators on the same machine or the LAN
+connect to it instead of annotating hand-split directories:
+
+  python annotate_faces.py -d ./dataset -r --db annotations.sqlite --serve 0.0.0.0:8765
+  python annotate_faces.py --connect http://server:8765
+
+WorkQueue hands out images under leases. A lease expires after lease_timeout seconds unless the client
+renews it, and an expired image is re-issued first, so a crashed or disconnected annotator never holds
+images back. An image is done once its first annotation arrives; later submissions for it are dropped, so
+no image is stored twice and no annotator is sent an image that is already done.
+
+WorkServer serves the queue over HTTP with JSON bodies (standard library only):
+  GET  /scheme                                   landmark scheme of the output
+  GET  /status                                   queue counts
+  GET  /image?lease=<id>                         encoded image file of a leased image
+  POST /lease   {"client", "count"}              -> {"leases": [{"lease", "path"}], "outstanding", "timeout"}
+  POST /renew   {"leases": [ids]}                -> {"renewed": [ids]}
+  POST /submit  {"annotations": [{"lease", "path", "landmarks"}]}   -> {"accepted", "duplicates", "rejected"}
+  POST /release {"leases": [ids], "skipped": [ids]}
+A submission is only accepted under a live lease of its path; the others are listed in "rejected" and the
+response is a 409. Every request runs on a thread of its own with a socket timeout of REQUEST_TIMEOUT
+seconds, so a slow or stalled client cannot hold up the others until their leases expire. The queue and
+the output are shared under one lock, which is held for a few dictionary operations, or one transaction per
+submitted batch, but never while an image is read or sent.
+
+On the client side, WorkClient wraps these requests and renews the leases it holds from a background
+thread, and RemoteOutput takes the place of the viewer's output: it buffers finished annotations and
+submits them in batches.
+"""
+from __future__ import print_function
+from __future__ import division
+import os
+import sys
+import json
+import time
+import heapq
+import uuid
+import socket
+import threading
+import collections
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from landmark_schemes import LandmarkScheme
+
+# Seconds a request may take to arrive or be sent before its connection is dropped
+REQUEST_TIMEOUT = 30.0
+
+
+class WorkQueue(object):
+    """
+    WorkQueue - Class
+
+    Leased queue of image paths.
+
+    Functions:
+    __init__: Requires the image paths to hand out, in order. lease_timeout is in seconds.
+
+    lease: Leases up to count images to a client. Expired leases are reclaimed first and their images
+    re-issued before new ones. Returns a list of (lease id, path).
+
+    renew: Extends the given leases by lease_timeout. Returns the ids that were still valid.
+
+    complete: Marks the image of a submission done and ends its lease. Raises ValueError if the lease is unknown
+    or expired or was issued for another path. Returns False if the image was already done (a duplicate).
+
+    release: Puts the images of the given leases back at the front of the queue, or marks them skipped.
+
+    outstanding: Returns the number of images that are queued or leased.
+
+    status: Returns the queue counts as a dict.
+    """
+
+    def __init__(self, img_paths, lease_timeout=900.0, clock=time.monotonic):
+        self.lease_timeout = lease_timeout
+        self.clock = clock
+
+        self.queue = collections.deque(img_paths)
+        # lease id -> [path, client, deadline]
+        self.leases = {}
+        # (deadline, lease id); renewed leases leave stale entries behind, which are ignored
+        self.deadlines = []
+        self.done = set()
+        self.skipped = set()
+        self.reissued = 0
+        # Images neither done nor skipped, queued or leased; kept as a count so polling it is O(1)
+        self.remaining = len(set(img_paths))
+
+    def reclaim(self):
+        now = self.clock()
+        while self.deadlines and self.deadlines[0][0] <= now:
+            deadline, lease_id = heapq.heappop(self.deadlines)
+            lease = self.leases.get(lease_id)
+            if lease is not None and lease[2] == deadline:
+                del self.leases[lease_id]
+                if lease[0] not in self.done:
+                    self.queue.appendleft(lease[0])
+                    self.reissued += 1
+
+    def lease(self, client, count):
+        self.reclaim()
+        leased = []
+        while self.queue and len(leased) < count:
+            path = self.queue.popleft()
+            if path in self.done:
+                continue
+            lease_id = uuid.uuid4().hex
+            deadline = self.clock() + self.lease_timeout
+            self.leases[lease_id] = [path, client, deadline]
+            heapq.heappush(self.deadlines, (deadline, lease_id))
+            leased.append((lease_id, path))
+        return leased
+
+    def renew(self, lease_ids):
+        self.reclaim()
+        renewed = []
+        for lease_id in lease_ids:
+            lease = self.leases.get(lease_id)
+            if lease is None:
+                continue
+            lease[2] = self.clock() + self.lease_timeout
+            heapq.heappush(self.deadlines, (lease[2], lease_id))
+            renewed.append(lease_id)
+        return renewed
+
+    def complete(self, lease_id, path):
+        self.reclaim()
+        lease = self.leases.get(lease_id)
+        if lease is None:
+            raise ValueError(f"{path} was submitted under an unknown or expired lease")
+        if lease[0] != path:
+            raise ValueError(f"{path} was submitted under the lease of {lease[0]}")
+        del self.leases[lease_id]
+        if path in self.done:
+            return False
+        self.done.add(path)
+        self.remaining -= 1
+        return True
+
+    def release(self, lease_ids, skipped=()):
+        for lease_id in skipped:
+            lease = self.leases.pop(lease_id, None)
+            if lease is not None and lease[0] not in self.done:
+                self.done.add(lease[0])
+                self.skipped.add(lease[0])
+                self.remaining -= 1
+        for lease_id in lease_ids:
+            lease = self.leases.pop(lease_id, None)
+            if lease is not None and lease[0] not in self.done:
+                self.queue.appendleft(lease[0])
+
+    def path(self, lease_id):
+        lease = self.leases.get(lease_id)
+        return None if lease is None else lease[0]
+
+    def outstanding(self):
+        return self.remaining
+
+    def status(self):
+        self.reclaim()
+        leased = len(set(lease[0] for lease in self.leases.values()) - self.done)
+        return {'queued': self.remaining - leased, 'leased': leased, 'done': len(self.done) - len(self.skipped),
+                'skipped': len(self.skipped), 'reissued': self.reissued}
+
+
+class WorkRequestHandler(BaseHTTPRequestHandler):
+
+    timeout = REQUEST_TIMEOUT
+
+    def send_json(self, body, status=200):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length).decode('utf-8')) if length else {}
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        server = self.server
+        if url.path == '/scheme':
+            scheme = server.scheme
+            self.send_json({'name': scheme.name, 'landmarks': scheme.number_of_landmarks,
+                            'contours': scheme.contours})
+        elif url.path == '/status':
+            with server.lock:
+                status = server.queue.status()
+            self.send_json(status)
+        elif url.path == '/image':
+            lease_id = urllib.parse.parse_qs(url.query).get('lease', [''])[0]
+            with server.lock:
+                path = server.queue.path(lease_id)
+            if path is None:
+                self.send_json({'error': 'unknown or expired lease'}, 404)
+                return
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except (IOError, OSError) as e:
+                self.send_json({'error': str(e)}, 500)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self.send_json({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        server = self.server
+        request = self.read_json()
+        if self.path == '/lease':
+            with server.lock:
+                leased = server.queue.lease(request.get('client', self.client_address[0]),
+                                            int(request.get('count', 1)))
+                outstanding = server.queue.outstanding()
+            self.send_json({'leases': [{'lease': lease_id, 'path': path} for lease_id, path in leased],
+                            'outstanding': outstanding, 'timeout': server.queue.lease_timeout})
+        elif self.path == '/renew':
+            with server.lock:
+                renewed = server.queue.renew(request.get('leases', []))
+            self.send_json({'renewed': renewed})
+        elif self.path == '/submit':
+            response = server.submit(request.get('annotations', []))
+            self.send_json(response, 409 if response['rejected'] else 200)
+        elif self.path == '/release':
+            with server.lock:
+                server.queue.release(request.get('leases', []), request.get('skipped', []))
+            self.send_json({})
+        else:
+            self.send_json({'error': 'not found'}, 404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class WorkServer(ThreadingHTTPServer):
+    """
+    WorkServer - Class
+
+    HTTP front end of a WorkQueue that writes submitted annotations to a single output.
+
+    Functions:
+    __init__: Requires the (host, port) to listen on, the WorkQueue, the output (TextAnnotationWriter or
+    SQLiteAnnotationStore) and the LandmarkScheme.
+
+    submit: Writes a batch of submitted annotations to the output, dropping duplicates and rejecting the ones
+    without a live lease of their path, and flushes it once.
+
+    serve_until_done: Handles requests until every image is done or skipped, and for linger seconds after
+    that, so that annotators waiting for work learn that there is none left instead of finding the server
+    gone.
+    """
+
+    def __init__(self, address, queue, output, scheme):
+        ThreadingHTTPServer.__init__(self, address, WorkRequestHandler)
+        self.queue = queue
+        self.output = output
+        self.scheme = scheme
+        self.timeout = 1.0
+        # Guards the queue and the output against the request threads
+        self.lock = threading.Lock()
+
+    def submit(self, annotations):
+        accepted = 0
+        rejected = []
+        with self.lock:
+            for annotation in annotations:
+                try:
+                    if not self.queue.complete(annotation.get('lease'), annotation.get('path')):
+                        continue
+                except ValueError as e:
+                    rejected.append({'path': annotation.get('path'), 'error': str(e)})
+                    continue
+                coords_list = [None] + [None if coords is None else tuple(coords)
+                                        for coords in annotation['landmarks']]
+                self.output.write(annotation['path'], coords_list)
+                accepted += 1
+            self.output.flush()
+        return {'accepted': accepted, 'duplicates': len(annotations) - accepted - len(rejected),
+                'rejected': rejected}
+
+    def serve_until_done(self, linger=15.0):
+        while True:
+            with self.lock:
+                if not self.queue.outstanding():
+                    break
+            self.handle_request()
+        finished = time.monotonic()
+        while time.monotonic() - finished < linger:
+            self.handle_request()
+
+
+class WorkClient(object):
+    """
+    WorkClient - Class
+
+    Client of a WorkServer.
+
+    Functions:
+    __init__: Requires the server URL. name identifies the annotator in the server's leases.
+
+    scheme: Returns the server's LandmarkScheme.
+
+    lease: Leases up to count images. Returns (list of (lease id, path), number of images the server still
+    has outstanding). The leases are renewed in the background until they are submitted or released.
+
+    fetch_image: Downloads the encoded image file of a leased path.
+
+    submit: Sends a batch of (path, landmarks) annotations and stops renewing their leases.
+
+    release: Gives leased paths back, either to be re-issued or as skipped.
+
+    close: Releases all leases still held and stops the renewal thread.
+    """
+
+    def __init__(self, url, name=None):
+        self.url = url.rstrip('/')
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        # path -> lease id of every lease held
+        self.held = {}
+        self.lock = threading.Lock()
+        self.timeout = None
+        self.stopped = threading.Event()
+        self.renewer = None
+
+    def request(self, path, body=None):
+        data = None if body is None else json.dumps(body).encode('utf-8')
+        request = urllib.request.Request(self.url + path, data=data, headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=60) as response:
+            return response.read()
+
+    def post(self, path, body):
+        return json.loads(self.request(path, body).decode('utf-8'))
+
+    def scheme(self):
+        definition = json.loads(self.request('/scheme').decode('utf-8'))
+        return LandmarkScheme(definition['name'], definition['landmarks'], definition['contours'])
+
+    def lease(self, count):
+        response = self.post('/lease', {'client': self.name, 'count': count})
+        leased = [(lease['lease'], lease['path']) for lease in response['leases']]
+        with self.lock:
+            for lease_id, path in leased:
+                self.held[path] = lease_id
+        if self.renewer is None:
+            self.timeout = response['timeout']
+            self.renewer = threading.Thread(target=self.renew_loop, daemon=True)
+            self.renewer.start()
+        return leased, response['outstanding']
+
+    def renew_loop(self):
+        # Renew well before the leases run out
+        while not self.stopped.wait(self.timeout / 3):
+            with self.lock:
+                lease_ids = list(self.held.values())
+            if not lease_ids:
+                continue
+            try:
+                self.post('/renew', {'leases': lease_ids})
+            except (IOError, OSError) as e:
+                print(f"could not renew leases: {e}", file=sys.stderr)
+
+    def fetch_image(self, path):
+        with self.lock:
+            lease_id = self.held[path]
+        return self.request('/image?' + urllib.parse.urlencode({'lease': lease_id}))
+
+    def submit(self, annotations):
+        with self.lock:
+            body = [{'lease': self.held.get(path), 'path': path, 'landmarks': landmarks}
+                    for path, landmarks in annotations]
+        try:
+            response = self.post('/submit', {'annotations': body})
+        except urllib.error.HTTPError as e:
+            if e.code != 409:
+                raise
+            # Submitted under leases that expired; the server re-issues those images to other annotators
+            response = json.loads(e.read().decode('utf-8'))
+            for rejected in response['rejected']:
+                print(f"annotation rejected by the server: {rejected['error']}", file=sys.stderr)
+        with self.lock:
+            for path, landmarks in annotations:
+                self.held.pop(path, None)
+        return response
+
+    def release(self, paths, skipped=False):
+        with self.lock:
+            lease_ids = [self.held.pop(path) for path in paths if path in self.held]
+        if lease_ids:
+            self.post('/release', {'skipped': lease_ids} if skipped else {'leases': lease_ids})
+
+    def close(self):
+        self.stopped.set()
+        with self.lock:
+            paths = list(self.held)
+        try:
+            self.release(paths)
+        except (IOError, OSError) as e:
+            # The server re-issues them once the leases expire
+            print(f"could not release {len(paths)} leased images: {e}", file=sys.stderr)
+
+
+class RemoteOutput(object):
+    """
+    RemoteOutput - Class
+
+    Viewer output that submits annotations to a WorkServer in batches.
+
+    Functions:
+    __init__: Requires the WorkClient. batch_size annotations are collected before they are submitted.
+    on_submitted, if given, is called with the image paths of every batch the server accepted (or already had),
+    so the caller learns when an annotation is no longer only in memory.
+
+    write: Buffers the annotation of one image (coords_list as kept by InteractiveViewer).
+
+    flush: Submits the buffered annotations.
+
+    close: Submits what is left.
+    """
+
+    def __init__(self, client, batch_size=4, on_submitted=None):
+        self.client = client
+        self.batch_size = batch_size
+        self.on_submitted = on_submitted
+        self.buffer = []
+
+    def write(self, img_path, coords_list):
+        self.buffer.append((img_path, [None if coords is None else list(coords) for coords in coords_list[1:]]))
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            response = self.client.submit(self.buffer)
+            rejected = set(rejected['path'] for rejected in response.get('rejected', []))
+            if self.on_submitted is not None:
+                self.on_submitted([img_path for img_path, landmarks in self.buffer if img_path not in rejected])
+        self.buffer = []
+
+    def close(self):
+        self.flush()